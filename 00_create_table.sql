@@ -7,9 +7,16 @@ CREATE TABLE IF NOT EXISTS product_similarity.product_raw (
     price NUMERIC,
     review NUMERIC,
     review_rating NUMERIC,
-    prd_img TEXT
+    prd_img TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
 );
 
+ALTER TABLE product_similarity.product_raw
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS product_raw_updated_at_idx
+    ON product_similarity.product_raw (updated_at);
+
 CREATE TABLE IF NOT EXISTS product_similarity.products_trait_image (
     category1 VARCHAR(30),
     category2 VARCHAR(30),
@@ -17,7 +24,9 @@ CREATE TABLE IF NOT EXISTS product_similarity.products_trait_image (
     style VARCHAR(50),
     material VARCHAR(50),
     occasion VARCHAR(50),
-    prd_id VARCHAR(30) NOT NULL
+    prd_id VARCHAR(30) NOT NULL,
+    trait_seq SMALLINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
 );
 
 CREATE TABLE IF NOT EXISTS product_similarity.products_trait_text (
@@ -27,11 +36,61 @@ CREATE TABLE IF NOT EXISTS product_similarity.products_trait_text (
     style VARCHAR(50),
     material VARCHAR(50),
     occasion VARCHAR(50),
-    prd_id VARCHAR(30) NOT NULL
+    prd_id VARCHAR(30) NOT NULL,
+    trait_seq SMALLINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
 );
 
-CREATE TABLE IF NOT EXISTS product_similarity.products_trait_information (
+CREATE INDEX IF NOT EXISTS products_trait_image_prd_id_idx
+    ON product_similarity.products_trait_image (prd_id);
+
+CREATE INDEX IF NOT EXISTS products_trait_text_prd_id_idx
+    ON product_similarity.products_trait_text (prd_id);
+
+-- Trait rows are keyed by (prd_id, trait_seq), the position of the trait object in the
+-- LLM answer; updated_at lets the integration step pick up changed products only.
+-- Tables created before these columns existed are numbered in physical order.
+DO $$
+DECLARE
+    trait_table TEXT;
+BEGIN
+    FOREACH trait_table IN ARRAY ARRAY['products_trait_image', 'products_trait_text'] LOOP
+        EXECUTE format('ALTER TABLE product_similarity.%I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()', trait_table);
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'product_similarity' AND table_name = trait_table AND column_name = 'trait_seq'
+        ) THEN
+            EXECUTE format('ALTER TABLE product_similarity.%I ADD COLUMN trait_seq SMALLINT', trait_table);
+            EXECUTE format('
+                UPDATE product_similarity.%1$I AS trt
+                SET trait_seq = seq.n
+                FROM (SELECT ctid, row_number() OVER (PARTITION BY prd_id ORDER BY ctid) - 1 AS n
+                      FROM product_similarity.%1$I) AS seq
+                WHERE trt.ctid = seq.ctid', trait_table);
+            EXECUTE format('ALTER TABLE product_similarity.%I ALTER COLUMN trait_seq SET NOT NULL, ALTER COLUMN trait_seq SET DEFAULT 0', trait_table);
+        END IF;
+        EXECUTE format('CREATE UNIQUE INDEX IF NOT EXISTS %I ON product_similarity.%I (prd_id, trait_seq)', trait_table || '_key', trait_table);
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON product_similarity.%I (updated_at)', trait_table || '_updated_at_idx', trait_table);
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS product_similarity.products_recognition_status (
     prd_id VARCHAR(30) NOT NULL,
+    source VARCHAR(10) NOT NULL,
+    status VARCHAR(10) NOT NULL,
+    error TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (prd_id, source)
+);
+
+-- High-water marks of incremental steps (e.g. 04 trait integration)
+CREATE TABLE IF NOT EXISTS product_similarity.integration_watermark (
+    stage VARCHAR(30) PRIMARY KEY,
+    watermark TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS product_similarity.products_trait_information (
+    prd_id VARCHAR(30) PRIMARY KEY,
     category VARCHAR(20) NOT NULL,
     prd_name TEXT NOT NULL,
     text_cat1 VARCHAR(30),
@@ -45,12 +104,45 @@ CREATE TABLE IF NOT EXISTS product_similarity.products_trait_information (
     image_color VARCHAR(50),
     image_style VARCHAR(50),
     image_material VARCHAR(50),
-    image_occasion VARCHAR(50)
+    image_occasion VARCHAR(50),
+    text_seq SMALLINT NOT NULL DEFAULT 0,
+    image_seq SMALLINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
 );
 
+-- One row per product joining its canonical text and image traits (text_seq/image_seq
+-- tell which trait rows were chosen), upserted by 04. The table is derived data: when it
+-- predates the key it is emptied and rebuilt by the next 04 run.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = 'product_similarity' AND indexname = 'products_trait_information_pkey'
+    ) THEN
+        TRUNCATE product_similarity.products_trait_information;
+        ALTER TABLE product_similarity.products_trait_information
+            ADD COLUMN IF NOT EXISTS text_seq SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS image_seq SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
+        DROP INDEX IF EXISTS product_similarity.products_trait_information_key;
+        ALTER TABLE product_similarity.products_trait_information ADD PRIMARY KEY (prd_id);
+        DELETE FROM product_similarity.integration_watermark WHERE stage = 'trait_information';
+    END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS product_similarity.products_similarity_score_inner (
     prd_id VARCHAR(30) NOT NULL,
     similarity_name_text NUMERIC NOT NULL,
     similarity_name_image NUMERIC NOT NULL,
     similarity_text_image NUMERIC NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS product_similarity.products_similarity_topk (
+    prd_id VARCHAR(30) NOT NULL,
+    prd_tag VARCHAR(20) NOT NULL,
+    category_only BOOLEAN NOT NULL,
+    rank SMALLINT NOT NULL,
+    similar_prd_id VARCHAR(30) NOT NULL,
+    similarity NUMERIC NOT NULL,
+    PRIMARY KEY (prd_id, prd_tag, category_only, rank)
+);
@@ -1,15 +1,14 @@
-import requests
-import pandas as pd
-import numpy as np
 import os
-import time
 import psycopg2
-import psycopg2.extras
 
-# Load product information data
+from app.download import download_images
+from app.metrics import start_metrics, span
+from app.ingest import read_product_chunks, clean_product_chunk, copy_product_chunk
+
+# Product information data (streamed in chunks below)
 dir_path = os.path.dirname(os.path.realpath(__file__)) + '/product_information/'
 file_name = 'product_information.csv'
-df_prd = pd.read_csv(f"{dir_path}{file_name}", dtype=str)
+chunk_size = 50_000  # rows held in memory at once
 
 # Map category links to category names
 prd_dict = {
@@ -31,53 +30,16 @@ prd_dict = {
     'https://www.coupang.com/np/categories/498974?channel=plp_C2':'신발',
     'https://www.coupang.com/np/categories/499007?channel=plp_C2':'가방/잡화',
 }
-df_prd['category'] = df_prd['category-link-0-href'].map(prd_dict)
-
-# Clean 'rating' column by removing parentheses
-df_prd['rating'] = df_prd['rating']\
-    .map(lambda x: x.replace('(', '').replace(')', '') if pd.notna(x) else x)
-
-# Clean 'price' column by removing the currency symbol
-df_prd['price3'] = df_prd['price3']\
-    .map(lambda x: x.replace('원', '').replace(',', '') if pd.notna(x) else x)
-
-# Rename columns for clarity
-df_prd = df_prd.rename(
-    columns={
-        'web-scraper-order': 'prd_id',
-        'image-src': 'prd_img',
-        'image2-src': 'delivery_type',
-        'rating': 'review',
-        'ratingValue': 'review_rating',
-        'price3': 'price',
-        'name': 'prd_name',
-    }
-)
-
-# Download product images (It takes long long time)
-os.makedirs(f"{dir_path}/prd_img/", exist_ok=True)
-for idx, row in df_prd.iterrows():
-    img_url = row['prd_img']
-    img_id = row['prd_id']
-    response = requests.get(img_url)
-    if response.status_code == 200:
-        with open(f"{dir_path}/prd_img/{img_id}.jpg", "wb") as f:
-            f.write(response.content)
-    time.sleep(np.random.uniform(0.1, 0.35))
 
-# Add product image paths
-df_prd['prd_path'] = df_prd['prd_id']\
-    .apply(lambda x: f"{dir_path}prd_img/{x}.jpg")
-
-# Handle missing values as white spaces
-df_prd.loc[df_prd['review'].isnull(), 'review'] = ''
-df_prd.loc[df_prd['review_rating'].isnull(), 'review_rating'] = ''
-
-# Prepare data for database insertion
-cols = ['prd_id', 'category', 'prd_name', 
-        'price', 'review', 'review_rating', 'prd_path']
-db_insert = [tuple(_) for _ in df_prd[cols].to_numpy()]
-db_insert = [tuple(None if __ == '' else __ for __ in _) for _ in db_insert]
+# Download product images in parallel (pooled session, shared rate limit,
+# already downloaded images are skipped, failures are listed in the manifest)
+DOWNLOAD_CONFIG = {
+    "concurrency": 16,
+    "rate": 20.0,       # requests/sec across all threads
+    "retries": 3,
+    "backoff": 1.0,
+    "timeout": 30.0,
+}
 
 # Connect to your PostgreSQL database
 DB_CONFIG = {
@@ -87,21 +49,50 @@ DB_CONFIG = {
     "host": "pgsql",
     "port": "5432"
 }
-db_conn = psycopg2.connect(**DB_CONFIG)
-db_cur = db_conn.cursor()
 
-# Insert data into the table
-query =\
-    """
-    INSERT INTO product_similarity.product_raw
-    (prd_id, category, prd_name, price, review, review_rating, prd_img)
-    VALUES %s
-    ON CONFLICT (prd_id) DO NOTHING;
-    """
-psycopg2.extras.execute_values(
-    cur=db_cur,
-    sql=query,
-    argslist=db_insert
-)
-db_conn.commit()
-db_conn.close()
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/01_product_information.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/01_product_information.trace.jsonl" to trace every span
+}
+
+
+def main():
+    db_conn = psycopg2.connect(**DB_CONFIG)
+    db_cur = db_conn.cursor()
+
+    # Stream the CSV chunk by chunk: clean (vectorized), download images, COPY into product_raw
+    for chunk_num, df_chunk in enumerate(read_product_chunks(f"{dir_path}{file_name}", chunk_size), start=1):
+        df_prd = clean_product_chunk(df_chunk, prd_dict, img_dir=f"{dir_path}prd_img/")
+
+        df_img = df_prd[df_prd['img_url'].notna()]
+        with span("download_chunk", chunk=chunk_num, images=len(df_img)):
+            result_download = download_images(
+                zip(df_img['prd_id'], df_img['img_url']),
+                out_dir=f"{dir_path}prd_img/",
+                manifest_path=f"{dir_path}prd_img_failed_{chunk_num}.csv",
+                **DOWNLOAD_CONFIG
+            )
+        print(f"Chunk {chunk_num} images downloaded: {result_download['downloaded']}, "
+              f"skipped: {result_download['skipped']}, failed: {result_download['failed']} "
+              f"({result_download['rate']:.1f} images/sec)")
+
+        # Insert new products and refresh changed ones (updated_at drives --since runs)
+        with span("copy_chunk", chunk=chunk_num, rows=len(df_prd)):
+            result_copy = copy_product_chunk(db_cur, df_prd)
+        if not result_copy.get('status'):
+            print(f"Failed to load chunk {chunk_num}: {result_copy.get('return')}")
+        else:
+            print(f"Chunk {chunk_num} loaded: {len(df_prd)} rows")
+
+    db_conn.close()
+
+
+if __name__ == "__main__":
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        main()
+    finally:
+        exporter.close()
@@ -1,7 +1,15 @@
 import psycopg2
-import pandas as pd
 
-from app.preprocess import recognize_image, insert_product_trait_image
+from app.preprocess import recognize_image
+from app.cache import DiskCache
+from app.imageprep import prepare_image
+from app.reader import stream_rows
+from app.incremental import parse_run_args, select_products_query, status_record
+from app.writer import failed_statuses, trait_record, insert_product_traits
+
+
+# Command line options (--incremental, --since)
+args = parse_run_args('Recognize product traits from product images.')
 
 
 # Connect to your PostgreSQL database
@@ -15,17 +23,8 @@ DB_CONFIG = {
 db_conn = psycopg2.connect(**DB_CONFIG)
 db_cur = db_conn.cursor()
 
-# Fetch product id and path of images from the database
-query =\
-    """
-    SELECT prd_id,
-        prd_img
-    FROM product_similarity.product_raw
-    WHERE prd_img IS NOT NULL;
-    """
-db_cur.execute(query=query)
-rows = db_cur.fetchall()
-df_prd = pd.DataFrame(rows, columns=[_[0] for _ in db_cur.description])
+# Products to process (all, or only missing/failed/changed ones), streamed below
+query = select_products_query('image', incremental=args.incremental, since=args.since)
 
 # LLM service configuration
 llm_role =\
@@ -59,29 +58,70 @@ llm_key = "ollama"
 llm_model = "ebdm/gemma3-enhanced:12b"
 llm_temperature = 0.0
 
+# Persistent LLM response cache (keyed by model, temperature, role and prompt/image)
+llm_cache = DiskCache("./llm_cache/responses.db", max_entries=1_000_000)
+
+# Image preparation: images are downscaled to the vision encoder's input size and
+# recompressed before they are sent; the payload is cached next to each image
+prepare_images = True   # False sends the original images
+img_max_side = 896      # longest side in pixels (gemma3 encodes 896x896)
+img_quality = 85        # JPEG quality
+
+# Number of products read per round trip and whose traits (and statuses) are committed together
+batch_size = 200
+
+
+def flush_records(db_cur, records, statuses):
+    result_insert = insert_product_traits(db_cur, 'image', records, statuses)
+    if not result_insert.get('status'):
+        print(f"Failed to insert product traits: {result_insert.get('return')}")
+        # The batch was rolled back: record its products as failed so a rerun picks them up
+        result_insert = insert_product_traits(
+            db_cur, 'image', [], failed_statuses(statuses, result_insert.get('return')))
+        if not result_insert.get('status'):
+            # Keep the batch, the next flush retries it
+            print(f"Failed to record failed products: {result_insert.get('return')}")
+            return
+    records.clear()
+    statuses.clear()
+
+
 # Process each product image and insert the recognized traits into the database
-for prd_id, prd_img in df_prd.itertuples(index=False):
-    result_recognize = recognize_image(
-        service_url=llm_url,
-        service_key=llm_key,
-        service_llm=llm_model,
-        service_temperature=llm_temperature,
-        service_role=llm_role,
-        img_path=prd_img
-    )
-    if result_recognize.get('status'):
-        prd_descs = result_recognize.get('return')
-        for prd_desc in prd_descs:
-            result_insert = insert_product_trait_image(
-                db_cur=db_cur,
-                prd_id=prd_id,
-                prd_desc=prd_desc
-            )
-            if not result_insert.get('status'):
-                print(
-                    f"Failed to insert product trait for product ID {prd_id}: {result_insert.get('return')}")
-    else:
-        print(
-            f"Failed to recognize image for product ID {prd_id}: {result_recognize.get('return')}")
+records = []
+statuses = []
+for rows in stream_rows(db_conn, query, fetch_size=batch_size):
+    for prd_id, prd_img in rows:
+        image_payload = None
+        if prepare_images:
+            result_prepare = prepare_image(prd_img, max_side=img_max_side, quality=img_quality)
+            if not result_prepare.get('status'):
+                print(f"Failed to prepare image for product ID {prd_id}: {result_prepare.get('return')}")
+                statuses.append(status_record(prd_id, 'failed', result_prepare.get('return')))
+                continue
+            image_payload = result_prepare.get('return')
+        result_recognize = recognize_image(
+            service_url=llm_url,
+            service_key=llm_key,
+            service_llm=llm_model,
+            service_temperature=llm_temperature,
+            service_role=llm_role,
+            cache=llm_cache,
+            img_path=prd_img,
+            image_payload=image_payload
+        )
+        if result_recognize.get('status'):
+            records.extend(
+                trait_record(prd_id, prd_desc, seq)
+                for seq, prd_desc in enumerate(result_recognize.get('return')))
+            statuses.append(status_record(prd_id, 'done'))
+        else:
+            print(
+                f"Failed to recognize image for product ID {prd_id}: {result_recognize.get('return')}")
+            statuses.append(status_record(prd_id, 'failed', result_recognize.get('return')))
+    flush_records(db_cur, records, statuses)
 
-db_conn.close()
\ No newline at end of file
+print(llm_cache.report())
+llm_cache.close()
+db_conn.close()
+if statuses:
+    raise SystemExit(f"Could not record {len(statuses)} products, rerun to process them again")
\ No newline at end of file
@@ -1,7 +1,15 @@
 import asyncio
 import asyncpg
+from openai import AsyncOpenAI
 
-from app.preprocess import recognize_image_async, insert_product_trait_image_async
+from app.preprocess import recognize_image_async
+from app.cache import DiskCache
+from app.imageprep import ImagePreparer
+from app.incremental import parse_run_args, select_products_query
+from app.metrics import start_metrics, span
+from app.reader import stream_records
+from app.scheduler import run_bounded
+from app.writer import TraitWriter
 
 # Database configuration
 DB_CONFIG = {
@@ -42,49 +50,129 @@ If you are unsure about any attribute, respond with "unknown" for that attribute
     "url": "http://ollama:11434/v1",
     "key": "ollama",
     "model": "ebdm/gemma3-enhanced:12b",
-    "temperature": 0.0
+    "temperature": 0.0,
+    # Constrain answers to the trait JSON schema (needs json_schema support, e.g. Ollama >= 0.5)
+    "structured_output": False,
 }
 
+# Persistent LLM response cache (keyed by model, temperature, role and prompt/image)
+CACHE_CONFIG = {
+    "path": "./llm_cache/responses.db",
+    "max_entries": 1_000_000,
+}
 
-async def main():
-    conn = await asyncpg.connect(**DB_CONFIG)
-    query = """
-        SELECT prd_id, prd_img
-        FROM product_similarity.product_raw
-        WHERE prd_img IS NOT NULL;
-    """
-    rows = await conn.fetch(query)
-    await conn.close()
+# Image preparation: images are downscaled to the vision encoder's input size and
+# recompressed in worker processes; the payload is cached next to each image
+IMAGE_CONFIG = {
+    "prepare": True,        # False sends the original images
+    "workers": 4,           # preparation processes
+    "max_side": 896,        # longest side in pixels (gemma3 encodes 896x896)
+    "quality": 85,          # JPEG quality
+}
+
+# Scheduler configuration
+RUN_CONFIG = {
+    "max_concurrency": 8,   # in-flight LLM requests, raise until the server saturates
+    "timeout": 120.0,       # seconds per request attempt
+    "retries": 3,
+    "backoff": 2.0,         # base delay in seconds, doubled on every retry
+    "report_every": 100,
+    "pool_size": 4,         # connections shared by the product stream and the trait writer
+    "fetch_size": 1_000,    # products read per round trip of the server-side cursor
+    "flush_rows": 500,      # trait rows buffered before a COPY
+    "flush_interval": 5.0,  # seconds between time-triggered flushes
+}
+
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/02_product_image_recognition.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/02_product_image_recognition.trace.jsonl" to trace every span
+}
 
-    for row in rows:
-        prd_id = row['prd_id']
-        prd_img = row['prd_img']
-
-        result_recognize = await recognize_image_async(
-            service_url=LLM_CONFIG['url'],
-            service_key=LLM_CONFIG['key'],
-            service_llm=LLM_CONFIG['model'],
-            service_temperature=LLM_CONFIG['temperature'],
-            service_role=LLM_CONFIG['role'],
-            img_path=prd_img
-        )
 
+async def main(args):
+    pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=RUN_CONFIG['pool_size'])
+    # Stream products to process (all, or only missing/failed/changed ones)
+    query = select_products_query('image', incremental=args.incremental, since=args.since)
+    rows = stream_records(pool, query, fetch_size=RUN_CONFIG['fetch_size'])
+
+    llm_cache = DiskCache(CACHE_CONFIG['path'], max_entries=CACHE_CONFIG['max_entries'])
+
+    # One client (and its HTTP connection pool) shared by every request
+    client = AsyncOpenAI(
+        base_url=LLM_CONFIG['url'],
+        api_key=LLM_CONFIG['key'],
+        max_retries=0,
+    )
+    # Trait rows are buffered and written with COPY through the pool
+    writer = TraitWriter(
+        pool,
+        source="image",
+        flush_rows=RUN_CONFIG['flush_rows'],
+        flush_interval=RUN_CONFIG['flush_interval'],
+    )
+
+    preparer = ImagePreparer(
+        workers=IMAGE_CONFIG['workers'],
+        max_side=IMAGE_CONFIG['max_side'],
+        quality=IMAGE_CONFIG['quality'],
+    )
+
+    async def recognize(row):
+        with span("recognize_image", prd_id=row['prd_id']):
+            image_payload = None
+            if IMAGE_CONFIG['prepare']:
+                result_prepare = await preparer.prepare(row['prd_img'])
+                if not result_prepare.get('status'):
+                    return result_prepare
+                image_payload = result_prepare.get('return')
+            return await recognize_image_async(
+                service_url=LLM_CONFIG['url'],
+                service_key=LLM_CONFIG['key'],
+                service_llm=LLM_CONFIG['model'],
+                service_temperature=LLM_CONFIG['temperature'],
+                service_role=LLM_CONFIG['role'],
+                structured_output=LLM_CONFIG['structured_output'],
+                img_path=row['prd_img'],
+                client=client,
+                cache=llm_cache,
+                image_payload=image_payload,
+            )
+
+    async def store(row, result_recognize):
+        prd_id = row['prd_id']
         if result_recognize.get('status'):
-            prd_descs = result_recognize.get('return')
-            for prd_desc in prd_descs:
-                result_insert = await insert_product_trait_image_async(
-                    user=DB_CONFIG["user"],
-                    password=DB_CONFIG["password"],
-                    database=DB_CONFIG["database"],
-                    host=DB_CONFIG["host"],
-                    port=DB_CONFIG["port"],
-                    prd_id=prd_id,
-                    prd_desc=prd_desc
-                )
-                if not result_insert.get('status'):
-                    print(f"Failed to insert product trait for product ID {prd_id}: {result_insert.get('return')}")
+            result_insert = await writer.add(prd_id, result_recognize.get('return'))
+            if not result_insert.get('status'):
+                print(f"Failed to insert product traits: {result_insert.get('return')}")
         else:
             print(f"Failed to recognize image for product ID {prd_id}: {result_recognize.get('return')}")
+            await writer.fail(prd_id, result_recognize.get('return'))
+
+    async with writer, preparer:
+        await run_bounded(
+            rows,
+            worker=recognize,
+            on_result=store,
+            max_concurrency=RUN_CONFIG['max_concurrency'],
+            timeout=RUN_CONFIG['timeout'],
+            retries=RUN_CONFIG['retries'],
+            backoff=RUN_CONFIG['backoff'],
+            report_every=RUN_CONFIG['report_every'],
+        )
+    print(f"Inserted {writer.rows_written} trait rows")
+    if IMAGE_CONFIG['prepare']:
+        print(preparer.report())
+    print(llm_cache.report())
+    llm_cache.close()
+    await client.close()
+    await pool.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        asyncio.run(main(parse_run_args('Recognize product traits from product images.')))
+    finally:
+        exporter.close()
@@ -0,0 +1,181 @@
+import asyncio
+import importlib
+import asyncpg
+from openai import AsyncOpenAI
+
+from app.preprocess import recognize_image_async, recognize_text_async
+from app.cache import DiskCache
+from app.imageprep import ImagePreparer
+from app.incremental import parse_run_args, select_products_combined_query
+from app.metrics import start_metrics, span
+from app.reader import stream_records
+from app.scheduler import PriorityLimiter, RunStats, run_bounded, call_with_retry
+from app.writer import TraitWriter
+
+# Prompts, models and cache are shared with the single-source scripts
+image_script = importlib.import_module("02_product_image_recognition_async")
+text_script = importlib.import_module("03_product_name_recognition_async")
+
+DB_CONFIG = image_script.DB_CONFIG
+CACHE_CONFIG = image_script.CACHE_CONFIG
+IMAGE_CONFIG = image_script.IMAGE_CONFIG
+LLM_CONFIGS = {
+    "image": image_script.LLM_CONFIG,
+    "text": text_script.LLM_CONFIG,
+}
+
+RUN_CONFIG = {
+    "max_concurrency": 8,   # in-flight LLM requests across both sources (match the server's parallel slots)
+    # Lower value is admitted first: image requests are the long pole, so starting
+    # them early and backfilling with text keeps the server busy until the end
+    "priority": {"image": 0, "text": 1},
+    "timeout": 120.0,       # seconds per request attempt (waiting for a slot excluded)
+    "retries": 3,
+    "backoff": 2.0,         # base delay in seconds, doubled on every retry
+    "report_every": 100,
+    "pool_size": 4,         # connections shared by the product stream and the trait writers
+    "fetch_size": 1_000,    # products read per round trip of the server-side cursor
+    "flush_rows": 500,      # trait rows buffered before a COPY
+    "flush_interval": 5.0,  # seconds between time-triggered flushes
+}
+
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/02_product_recognition_combined.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/02_product_recognition_combined.trace.jsonl" to trace every span
+}
+
+
+async def main(args):
+    pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=RUN_CONFIG['pool_size'])
+    # One streamed read of product_raw; needs_* tell which sources each product still needs
+    rows = stream_records(
+        pool,
+        select_products_combined_query(incremental=args.incremental, since=args.since),
+        fetch_size=RUN_CONFIG['fetch_size'],
+    )
+
+    llm_cache = DiskCache(CACHE_CONFIG['path'], max_entries=CACHE_CONFIG['max_entries'])
+    client = AsyncOpenAI(
+        base_url=LLM_CONFIGS['image']['url'],
+        api_key=LLM_CONFIGS['image']['key'],
+        max_retries=0,
+    )
+    limiter = PriorityLimiter(RUN_CONFIG['max_concurrency'])
+    request_stats = RunStats(total=None)
+    writers = {
+        source: TraitWriter(
+            pool,
+            source=source,
+            flush_rows=RUN_CONFIG['flush_rows'],
+            flush_interval=RUN_CONFIG['flush_interval'],
+        )
+        for source in LLM_CONFIGS
+    }
+
+    preparer = ImagePreparer(
+        workers=IMAGE_CONFIG['workers'],
+        max_side=IMAGE_CONFIG['max_side'],
+        quality=IMAGE_CONFIG['quality'],
+    )
+
+    async def image_query(row):
+        # Prepared before taking a slot, so resizing never holds LLM budget
+        if not IMAGE_CONFIG['prepare']:
+            return {"status": True, "return": {"img_path": row['prd_img']}}
+        result_prepare = await preparer.prepare(row['prd_img'])
+        if not result_prepare.get('status'):
+            return result_prepare
+        return {"status": True, "return": {"img_path": row['prd_img'], "image_payload": result_prepare.get('return')}}
+
+    def request(source):
+        recognize = recognize_image_async if source == "image" else recognize_text_async
+        config = LLM_CONFIGS[source]
+
+        async def call(row):
+            with span(f"recognize_{source}", prd_id=row['prd_id']):
+                return await attempt(row)
+
+        async def attempt(row):
+            if source == "image":
+                result_query = await image_query(row)
+                if not result_query.get('status'):
+                    return result_query
+                query = result_query.get('return')
+            else:
+                query = {"text_query": row['prd_name']}
+            # The timeout starts once a slot is held, time spent queueing does not count
+            async with limiter.slot(RUN_CONFIG['priority'][source]):
+                try:
+                    return await asyncio.wait_for(
+                        recognize(
+                            service_url=config['url'],
+                            service_key=config['key'],
+                            service_llm=config['model'],
+                            service_temperature=config['temperature'],
+                            service_role=config['role'],
+                            structured_output=config['structured_output'],
+                            client=client,
+                            cache=llm_cache,
+                            **query,
+                        ),
+                        timeout=RUN_CONFIG['timeout'],
+                    )
+                except asyncio.TimeoutError:
+                    return {"status": False, "return": f"Timed out after {RUN_CONFIG['timeout']}s"}
+        return call
+
+    calls = {source: request(source) for source in LLM_CONFIGS}
+
+    async def recognize_product(row):
+        # Text and image requests of a product are queued together
+        sources = [source for source in LLM_CONFIGS if row[f'needs_{source}']]
+        results = await asyncio.gather(*[
+            call_with_retry(calls[source], row, None, RUN_CONFIG['retries'], RUN_CONFIG['backoff'], request_stats)
+            for source in sources
+        ])
+        return {
+            "status": all(result.get('status') for result in results),
+            "return": dict(zip(sources, results)),
+        }
+
+    async def store(row, result_product):
+        prd_id = row['prd_id']
+        for source, result_recognize in result_product.get('return', {}).items():
+            if result_recognize.get('status'):
+                result_insert = await writers[source].add(prd_id, result_recognize.get('return'))
+                if not result_insert.get('status'):
+                    print(f"Failed to insert {source} traits: {result_insert.get('return')}")
+            else:
+                print(f"Failed to recognize {source} for product ID {prd_id}: {result_recognize.get('return')}")
+                await writers[source].fail(prd_id, result_recognize.get('return'))
+
+    async with writers['image'], writers['text'], preparer:
+        # Two requests per product, so this many products keep the limiter's queue full
+        await run_bounded(
+            rows,
+            worker=recognize_product,
+            on_result=store,
+            max_concurrency=RUN_CONFIG['max_concurrency'],
+            timeout=None,
+            retries=0,
+            report_every=RUN_CONFIG['report_every'],
+        )
+    print(f"Requests retried {request_stats.retries} times, admitted per priority: {limiter.admitted}")
+    for source, writer in writers.items():
+        print(f"Inserted {writer.rows_written} {source} trait rows")
+    if IMAGE_CONFIG['prepare']:
+        print(preparer.report())
+    print(llm_cache.report())
+    llm_cache.close()
+    await client.close()
+    await pool.close()
+
+if __name__ == "__main__":
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        asyncio.run(main(parse_run_args('Recognize product traits from product images and names in one pass.')))
+    finally:
+        exporter.close()
@@ -1,7 +1,14 @@
 import psycopg2
-import pandas as pd
 
-from app.preprocess import recognize_text, insert_product_trait_text
+from app.preprocess import recognize_text
+from app.cache import DiskCache
+from app.reader import stream_rows
+from app.incremental import parse_run_args, select_products_query, status_record
+from app.writer import failed_statuses, trait_record, insert_product_traits
+
+
+# Command line options (--incremental, --since)
+args = parse_run_args('Recognize product traits from product names.')
 
 
 # Connect to your PostgreSQL database
@@ -15,17 +22,8 @@ DB_CONFIG = {
 db_conn = psycopg2.connect(**DB_CONFIG)
 db_cur = db_conn.cursor()
 
-# Fetch product id and path of images from the database
-query =\
-    """
-    SELECT prd_id,
-        prd_name
-    FROM product_similarity.product_raw
-    WHERE prd_img IS NOT NULL;
-    """
-db_cur.execute(query=query)
-rows = db_cur.fetchall()
-df_prd = pd.DataFrame(rows, columns=[_[0] for _ in db_cur.description])
+# Products to process (all, or only missing/failed/changed ones), streamed below
+query = select_products_query('text', incremental=args.incremental, since=args.since)
 
 # LLM service configuration
 llm_role =\
@@ -62,29 +60,55 @@ llm_key = "ollama"
 llm_model = "ebdm/gemma3-enhanced:12b"
 llm_temperature = 0.0
 
+# Persistent LLM response cache (keyed by model, temperature, role and prompt/image)
+llm_cache = DiskCache("./llm_cache/responses.db", max_entries=1_000_000)
+
+# Number of products read per round trip and whose traits (and statuses) are committed together
+batch_size = 200
+
+
+def flush_records(db_cur, records, statuses):
+    result_insert = insert_product_traits(db_cur, 'text', records, statuses)
+    if not result_insert.get('status'):
+        print(f"Failed to insert product traits: {result_insert.get('return')}")
+        # The batch was rolled back: record its products as failed so a rerun picks them up
+        result_insert = insert_product_traits(
+            db_cur, 'text', [], failed_statuses(statuses, result_insert.get('return')))
+        if not result_insert.get('status'):
+            # Keep the batch, the next flush retries it
+            print(f"Failed to record failed products: {result_insert.get('return')}")
+            return
+    records.clear()
+    statuses.clear()
+
+
 # Process each product image and insert the recognized traits into the database
-for prd_id, prd_name in df_prd.itertuples(index=False):
-    result_recognize = recognize_text(
-        service_url=llm_url,
-        service_key=llm_key,
-        service_llm=llm_model,
-        service_temperature=llm_temperature,
-        service_role=llm_role,
-        text_query=prd_name
-    )
-    if result_recognize.get('status'):
-        prd_descs = result_recognize.get('return')
-        for prd_desc in prd_descs:
-            result_insert = insert_product_trait_text(
-                db_cur=db_cur,
-                prd_id=prd_id,
-                prd_desc=prd_desc
-            )
-            if not result_insert.get('status'):
-                print(
-                    f"Failed to insert product trait for product ID {prd_id}: {result_insert.get('return')}")
-    else:
-        print(
-            f"Failed to recognize image for product ID {prd_id}: {result_recognize.get('return')}")
+records = []
+statuses = []
+for rows in stream_rows(db_conn, query, fetch_size=batch_size):
+    for prd_id, prd_name in rows:
+        result_recognize = recognize_text(
+            service_url=llm_url,
+            service_key=llm_key,
+            service_llm=llm_model,
+            service_temperature=llm_temperature,
+            service_role=llm_role,
+            cache=llm_cache,
+            text_query=prd_name
+        )
+        if result_recognize.get('status'):
+            records.extend(
+                trait_record(prd_id, prd_desc, seq)
+                for seq, prd_desc in enumerate(result_recognize.get('return')))
+            statuses.append(status_record(prd_id, 'done'))
+        else:
+            print(
+                f"Failed to recognize image for product ID {prd_id}: {result_recognize.get('return')}")
+            statuses.append(status_record(prd_id, 'failed', result_recognize.get('return')))
+    flush_records(db_cur, records, statuses)
 
-db_conn.close()
\ No newline at end of file
+print(llm_cache.report())
+llm_cache.close()
+db_conn.close()
+if statuses:
+    raise SystemExit(f"Could not record {len(statuses)} products, rerun to process them again")
\ No newline at end of file
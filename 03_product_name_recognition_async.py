@@ -1,8 +1,13 @@
-import pandas as pd
 import asyncio
+import time
 import asyncpg
 
-from app.preprocess import recognize_text_async, insert_product_trait_text_async
+from app.preprocess import recognize_text_async, recognize_text_batched_async
+from app.cache import DiskCache
+from app.incremental import parse_run_args, select_products_query
+from app.metrics import start_metrics, span
+from app.reader import stream_records, abatched
+from app.writer import TraitWriter
 
 
 # Connect to your PostgreSQL database
@@ -47,46 +52,106 @@ If you are unsure about any attribute, respond with "unknown" for that attribute
     "url": "http://ollama:11434/v1",
     "key": "ollama",
     "model": "ebdm/gemma3-enhanced:12b",
-    "temperature": 0.0
+    "temperature": 0.0,
+    # Constrain answers to the trait JSON schema (needs json_schema support, e.g. Ollama >= 0.5)
+    "structured_output": False,
 }
 
-async def main():
-    # Connect to PostgreSQL asynchronously
-    db_conn = await asyncpg.connect(**DB_CONFIG)
+# Persistent LLM response cache (keyed by model, temperature, role and prompt/image)
+CACHE_CONFIG = {
+    "path": "./llm_cache/responses.db",
+    "max_entries": 1_000_000,
+}
+
+# Trait writer configuration
+WRITER_CONFIG = {
+    "pool_size": 4,         # connections shared by the product stream and the trait writer
+    "fetch_size": 1_000,    # products read per round trip of the server-side cursor
+    "flush_rows": 500,      # trait rows buffered before a COPY
+    "flush_interval": 5.0,  # seconds between time-triggered flushes
+}
+
+# Product names per LLM request; the system role is sent once per batch.
+# Names without a valid answer in the batch are re-requested individually.
+BATCH_CONFIG = {
+    "batch_size": 16,       # 1 sends one name per request
+}
+
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/03_product_name_recognition.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/03_product_name_recognition.trace.jsonl" to trace every span
+}
+
+async def main(args):
+    # Shared connection pool for reads and buffered trait writes
+    db_pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=WRITER_CONFIG['pool_size'])
+
+    # Stream products to process (all, or only missing/failed/changed ones)
+    query = select_products_query('text', incremental=args.incremental, since=args.since)
+    rows = stream_records(db_pool, query, fetch_size=WRITER_CONFIG['fetch_size'])
+    llm_cache = DiskCache(CACHE_CONFIG['path'], max_entries=CACHE_CONFIG['max_entries'])
+
+    service = {
+        "service_url": LLM_CONFIG['url'],
+        "service_key": LLM_CONFIG['key'],
+        "service_llm": LLM_CONFIG['model'],
+        "service_temperature": LLM_CONFIG['temperature'],
+        "service_role": LLM_CONFIG['role'],
+        "structured_output": LLM_CONFIG['structured_output'],
+        "cache": llm_cache,
+    }
+    batch_size = BATCH_CONFIG['batch_size']
+    usage = {"tokens": 0, "requests": 0, "rerequested": 0}
+    products = 0
+    started = time.perf_counter()
 
-    # Fetch product data
-    query = """
-        SELECT prd_id, prd_name
-        FROM product_similarity.product_raw
-        WHERE prd_img IS NOT NULL;
-    """
-    rows = await db_conn.fetch(query)
-    df_prd = pd.DataFrame(rows, columns=["prd_id", "prd_name"])
+    # Process the products batch by batch
+    async with TraitWriter(
+        db_pool,
+        source="text",
+        flush_rows=WRITER_CONFIG['flush_rows'],
+        flush_interval=WRITER_CONFIG['flush_interval'],
+    ) as writer:
+        async for batch in abatched(rows, batch_size):
+            products += len(batch)
+            with span("recognize_text", prd_id=batch[0]['prd_id'], items=len(batch)):
+                if batch_size > 1:
+                    result_batch = await recognize_text_batched_async(
+                        text_queries=[row['prd_name'] for row in batch], **service)
+                    results = result_batch.get("return")
+                else:
+                    result_batch = await recognize_text_async(text_query=batch[0]['prd_name'], **service)
+                    results = [result_batch]
+            for key in usage:
+                usage[key] += result_batch.get(key, 0)
 
-    # Process each product
-    for prd_id, prd_name in df_prd.itertuples(index=False):
-        result_recognize = await recognize_text_async(
-            service_url=LLM_CONFIG['url'],
-            service_key=LLM_CONFIG['key'],
-            service_llm=LLM_CONFIG['model'],
-            service_temperature=LLM_CONFIG['temperature'],
-            service_role=LLM_CONFIG['role'],
-            text_query=prd_name
-        )
-        if result_recognize.get("status"):
-            prd_descs = result_recognize.get("return")
-            for prd_desc in prd_descs:
-                result_insert = await insert_product_trait_text_async(
-                    db_conf=DB_CONFIG,
-                    prd_id=prd_id,
-                    prd_desc=prd_desc
-                )
-                if not result_insert.get("status"):
-                    print(f"Failed to insert trait for {prd_id}: {result_insert.get('return')}")
-        else:
-            print(f"Failed to recognize traits for {prd_id}: {result_recognize.get('return')}")
+            for row, result_recognize in zip(batch, results):
+                prd_id = row['prd_id']
+                if result_recognize.get("status"):
+                    result_insert = await writer.add(prd_id, result_recognize.get("return"))
+                    if not result_insert.get("status"):
+                        print(f"Failed to insert traits: {result_insert.get('return')}")
+                else:
+                    print(f"Failed to recognize traits for {prd_id}: {result_recognize.get('return')}")
+                    await writer.fail(prd_id, result_recognize.get('return'))
 
-    await db_conn.close()
+    elapsed = time.perf_counter() - started
+    print(
+        f"{products} products in {usage['requests']} requests "
+        f"({usage['rerequested']} re-requested alone), "
+        f"{usage['tokens'] / max(products, 1):.0f} tokens/product, "
+        f"{products / elapsed if elapsed > 0 else 0.0:.2f} products/sec"
+    )
+    print(llm_cache.report())
+    llm_cache.close()
+    await db_pool.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        asyncio.run(main(parse_run_args('Recognize product traits from product names.')))
+    finally:
+        exporter.close()
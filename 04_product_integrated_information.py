@@ -0,0 +1,51 @@
+import argparse
+import psycopg2
+
+from app.integrate import integrate_traits
+from app.metrics import start_metrics, span
+
+
+# Connect to your PostgreSQL database
+DB_CONFIG = {
+    "database": "mydb",
+    "user": "myuser",
+    "password": "mypassword",
+    "host": "pgsql",
+    "port": "5432"
+}
+
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/04_product_integrated_information.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/04_product_integrated_information.trace.jsonl" to trace every span
+}
+
+
+# Join product_raw with the text and image traits into products_trait_information.
+# Only products whose raw row or traits changed since the last run are refreshed;
+# rows are upserted on their key, so the step can be rerun at any time.
+def main(args):
+    db_conn = psycopg2.connect(**DB_CONFIG)
+    with span("integrate", full=args.full):
+        result_integrate = integrate_traits(db_conn, full=args.full, lookback=args.lookback)
+    print(result_integrate.get('return'))
+    db_conn.close()
+    if not result_integrate.get('status'):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Integrate product information with recognized traits.")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="refresh every product, ignoring the last integration's watermark")
+    parser.add_argument(
+        "--lookback", type=float, default=600.0,
+        help="seconds of overlap with the previous run, covering writes that were still uncommitted then")
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        main(parser.parse_args())
+    finally:
+        exporter.close()
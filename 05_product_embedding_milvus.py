@@ -1,9 +1,17 @@
 from sentence_transformers import SentenceTransformer
-from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection
+import argparse
 import pandas as pd
 import psycopg2
-import asyncio
-import os
+
+from app.batcher import EmbeddingBatcher
+from app.cache import DiskCache
+from app.encoder import encode_texts, embedding_cache_key
+from app.embedding import embedding_key
+from app.metrics import start_metrics, span
+from app.quantize import PRECISIONS, truncate_embeddings
+from app.reader import stream_frames
+from app.vectorstore import BACKENDS, open_vector_store
+
 
 # DB connection information
 DB_CONFIG = {
@@ -14,9 +22,6 @@ DB_CONFIG = {
     "port": "5432"
 }
 
-db_conn = psycopg2.connect(**DB_CONFIG)
-db_cur = db_conn.cursor()
-
 # Fetch product id, product name and product traits from image
 query ="""
 SELECT category,
@@ -36,113 +41,167 @@ SELECT category,
         CASE WHEN image_style = 'unknown' THEN '' ELSE image_style END,
         CASE WHEN image_occasion = 'unknown' THEN '' ELSE image_occasion END
     ) AS prd_trait_image
-FROM product_similarity.products_trait_information;
+FROM product_similarity.products_trait_information
+ORDER BY prd_id;
 """
-db_cur.execute(query=query)
-rows = db_cur.fetchall()
-df_prd = pd.DataFrame(rows, columns=[_[0] for _ in db_cur.description])
-db_conn.close()
-
-
-# Milvus lite inintial setting
-os.makedirs('./milvus_db', exist_ok=True)
-connections.connect(
-    alias="default",
-    uri="./milvus_db/product_similarity.db"
-)
-
-fields = [
-    FieldSchema(
-        name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-    FieldSchema(name="prd_id", dtype=DataType.VARCHAR, max_length=50),
-    FieldSchema(name="prd_text", dtype=DataType.VARCHAR, max_length=500),
-    FieldSchema(name="prd_tag", dtype=DataType.VARCHAR, max_length=50),
-    FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=1024),
-]
 
-schema = CollectionSchema(
-    fields,
-    description="Embedding vector of product names & traits from images and names"
-)
+# Load embedding model & prompt
+ENCODE_CONFIG = {
+    "model": "Qwen/Qwen3-Embedding-0.6B",
+    "batch_size": 32,                               # prompts per encode call
+    "max_wait": 0.005,                              # seconds a partial batch waits for more prompts
+    "cache_path": "./embedding_cache/vectors.db",   # vectors keyed by (model, instruction, text hash)
+    "cache_max_bytes": 8 * 1024 ** 3,
+    # Products are streamed from Postgres and synced chunk by chunk; with --workers
+    # the encoding processes are started once per chunk, so keep chunks large
+    "chunk_size": 100_000,
+}
+instruct = "패션 의류 및 아이템 상품 유사도 분류"
+prompt = "Instruct: {}\nQuery: {}"
 
-collection = Collection("product_embedding", schema)
+# Desired state: one row per (prd_tag, prd_id), keyed deterministically
+prd_sources = [
+    ('product_name', 'prd_name'),
+    ('product_image', 'prd_trait_image'),
+    ('product_text', 'prd_trait_text'),
+]
 
-index_params = {
-    "index_type": "IVF_FLAT",
-    "metric_type": "COSINE",
-    "params": {"nlist": 128}
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/05_product_embedding.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/05_product_embedding.trace.jsonl" to trace every span
 }
-collection.create_index("embedding", index_params)
-
 
-# Load embedding model & prompt
-embedding_model = SentenceTransformer("Qwen/Qwen3-Embedding-0.6B")
-instruct = "패션 의류 및 아이템 상품 유사도 분류"
-prompt = "Instruct: {}\nQuery: {}"
 
-# Prepare data for Milvus (product name based data)
-df_prd_name = df_prd[['prd_id', 'prd_name']].drop_duplicates('prd_id').copy()
-prd_name_ids = df_prd_name['prd_id'].tolist()
-prd_name_texts = df_prd_name['prd_name'].tolist()
-prd_name_prompts =\
-    [prompt.format(instruct, _) for _ in df_prd_name['prd_name'].tolist()]
-
-# Prepare data for Milvus (product image based data)
-df_prd_img = df_prd[['prd_id', 'prd_trait_image']].drop_duplicates().copy()
-prd_img_ids = df_prd_img['prd_id'].tolist()
-prd_img_texts = df_prd_img['prd_trait_image'].tolist()
-prd_img_prompts =\
-    [prompt.format(instruct, _) for _ in df_prd_img['prd_trait_image'].tolist()]
-
-# Prepare data for Milvus (product text(of name) based data)
-df_prd_txt = df_prd[['prd_id', 'prd_trait_text']].drop_duplicates().copy()
-prd_txt_ids = df_prd_txt['prd_id'].tolist()
-prd_txt_texts = df_prd_txt['prd_trait_text'].tolist()
-prd_txt_prompts =\
-    [prompt.format(instruct, _) for _ in df_prd_txt['prd_trait_text'].tolist()]
-
-
-# Batch insert into milvus
-async def batch_insert(collection, embedding_model, prd_ids, prd_texts, prd_tag, prd_prompts, batch_size=1000):
-    loop = asyncio.get_event_loop()
-
-    for i in range(0, len(prd_ids), batch_size):
-        batch_ids = prd_ids[i:i+batch_size]
-        batch_texts = prd_texts[i:i+batch_size]
-        batch_prompts = prd_prompts[i:i+batch_size]
-        batch_tags = [prd_tag] * len(batch_ids)
-
-        embeddings = await loop.run_in_executor(None, embedding_model.encode, batch_prompts)
-        await loop.run_in_executor(None, collection.insert, [batch_ids, batch_texts, batch_tags, embeddings])
-    await loop.run_in_executor(None, collection.flush)
-
-
-# Run batch insert
-async def main():
-    await asyncio.gather(
-        batch_insert(
-            collection=collection,
-            embedding_model=embedding_model,
-            prd_ids=prd_name_ids,
-            prd_texts=prd_name_texts,
-            prd_tag='product_name',
-            prd_prompts=prd_name_prompts,
-        ),
-        batch_insert(
-            collection=collection,
-            embedding_model=embedding_model,
-            prd_ids=prd_img_ids,
-            prd_texts=prd_img_texts,
-            prd_tag='product_image',
-            prd_prompts=prd_img_prompts,
-        ),
-        batch_insert(
-            collection=collection,
-            embedding_model=embedding_model,
-            prd_ids=prd_txt_ids,
-            prd_texts=prd_txt_texts,
-            prd_tag='product_text',
-            prd_prompts=prd_txt_prompts,
-        ),
-    )
-asyncio.run(main())
+# Batch upsert into the vector store
+def batch_upsert(store, df_upsert, embeddings, embedding_index, batch_size=1000):
+    for i in range(0, len(df_upsert), batch_size):
+        batch = df_upsert.iloc[i:i+batch_size]
+        with span("upsert", rows=len(batch)):
+            store.upsert(batch, embeddings[embedding_index[i:i+batch_size]])
+
+
+def main(args):
+    # Vector store (Milvus lite by default)
+    store = open_vector_store(args.backend, rebuild=args.rebuild, dim=args.dim, precision=args.precision)
+    # Only (hash, category) per stored row is kept for the delta, not the vectors
+    stored = store.state()
+
+    db_conn = psycopg2.connect(**DB_CONFIG)
+    embedding_model = None
+    vector_cache = None
+    seen_ids = set()
+    total_rows = 0
+    total_upserts = 0
+    for chunk_num, df_prd in enumerate(stream_frames(db_conn, query, chunk_size=ENCODE_CONFIG['chunk_size']), start=1):
+        # products_trait_information holds one row per product (canonical traits, see 04)
+        df_rows = pd.concat([
+            df_prd[['prd_id', 'category', col]]
+                .rename(columns={col: 'prd_text'}).assign(prd_tag=prd_tag)
+            for prd_tag, col in prd_sources
+        ], ignore_index=True)
+        df_rows['id'] = [embedding_key(tag, pid) for tag, pid in zip(df_rows['prd_tag'], df_rows['prd_id'])]
+        # The hash covers model, instruction and text, so any of them changing re-embeds the row
+        df_rows['text_hash'] = [
+            embedding_cache_key(ENCODE_CONFIG['model'], instruct, prompt, text) for text in df_rows['prd_text']]
+        seen_ids.update(df_rows['id'])
+
+        # Delta against what is stored: new or changed rows are upserted
+        changed = [
+            stored.get(key) != (text_hash, category)
+            for key, text_hash, category in zip(df_rows['id'], df_rows['text_hash'], df_rows['category'])
+        ]
+        df_upsert = df_rows[changed].reset_index(drop=True)
+        total_rows += len(df_rows)
+        total_upserts += len(df_upsert)
+        print(f"Chunk {chunk_num}: {len(df_rows)} rows, {len(df_upsert)} to upsert")
+        if not len(df_upsert):
+            continue
+
+        # Encode only the changed rows; distinct prompts are encoded once and shared
+        if vector_cache is None:
+            # With --workers each worker process loads its own copy of the model; in
+            # this process it sits behind a batcher, which other callers can share
+            if args.workers <= 1:
+                embedding_model = EmbeddingBatcher(
+                    SentenceTransformer(ENCODE_CONFIG['model']),
+                    max_batch=ENCODE_CONFIG['batch_size'],
+                    max_wait=ENCODE_CONFIG['max_wait'],
+                    name="05_product_embedding",
+                )
+            vector_cache = DiskCache(
+                ENCODE_CONFIG['cache_path'], max_entries=50_000_000, max_bytes=ENCODE_CONFIG['cache_max_bytes'])
+        with span("encode", chunk=chunk_num, rows=len(df_upsert)):
+            unique_embeddings, embedding_index = encode_texts(
+                embedding_model,
+                df_upsert['prd_text'].tolist(),
+                model_name=ENCODE_CONFIG['model'],
+                instruct=instruct,
+                prompt_template=prompt,
+                cache=vector_cache,
+                batch_size=ENCODE_CONFIG['batch_size'],
+                return_inverse=True,
+                workers=args.workers,
+                threads_per_worker=args.threads_per_worker,
+            )
+        # The cache holds full vectors, so the stored dimension can change without re-encoding
+        unique_embeddings = truncate_embeddings(unique_embeddings, store.dim)
+        batch_upsert(store, df_upsert, unique_embeddings, embedding_index)
+    db_conn.close()
+    if vector_cache is not None:
+        print(vector_cache.report())
+        vector_cache.close()
+    if embedding_model is not None:
+        embedding_model.close()
+        print(embedding_model.report())
+
+    # Rows stored but no longer produced by the query are deleted
+    deleted_ids = sorted(set(stored) - seen_ids)
+    print(f"{total_rows} rows: {total_upserts} upserted, {len(deleted_ids)} to delete, "
+          f"{total_rows - total_upserts} unchanged")
+    with span("commit", deleted=len(deleted_ids)):
+        store.delete(deleted_ids)
+        store.commit()
+
+    # New segments are indexed as they are sealed; only a large delta pays for a full rebuild
+    delta = total_upserts + len(deleted_ids)
+    if stored and delta > args.reindex_threshold * len(stored):
+        print(f"Delta {delta} exceeds {args.reindex_threshold:.0%} of {len(stored)} rows, rebuilding index")
+        with span("reindex"):
+            store.reindex()
+
+
+# Run (guarded, since --workers starts processes that import this module)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed product names and traits into the vector store.")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default="milvus",
+        help="vector store written: milvus, or numpy/faiss (shared local files)")
+    parser.add_argument(
+        "--rebuild", action="store_true",
+        help="drop and rebuild the store instead of syncing the changes")
+    parser.add_argument(
+        "--dim", type=int, default=None,
+        help="keep the first DIM dimensions of the embedding (Matryoshka truncation; "
+             "default: as stored, 1024 for a new store; changing it needs --rebuild)")
+    parser.add_argument(
+        "--precision", choices=list(PRECISIONS), default=None,
+        help="storage precision of the vectors (default: as stored, float32 for a new store); "
+             "milvus switches between float32 and int8 by rebuilding the index only, "
+             "any other change needs --rebuild")
+    parser.add_argument(
+        "--reindex-threshold", type=float, default=0.2,
+        help="rebuild the vector index when upserts + deletes exceed this fraction of the collection")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="CPU encoding processes, each loading the model once (1 encodes in this process)")
+    parser.add_argument(
+        "--threads-per-worker", type=int, default=None,
+        help="torch threads per encoding process (default: cores / workers)")
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        main(parser.parse_args())
+    finally:
+        exporter.close()
@@ -1,8 +1,13 @@
+import argparse
 import asyncio
 import psycopg2
 import psycopg2.extras
 from pymilvus import connections, Collection
-from app.embedding import get_product_similarity_inner, insert_batch_similarities
+from app.embedding import (
+    get_product_similarity_inner, get_product_similarity_inner_matrix, insert_batch_similarities)
+from app.metrics import start_metrics, span
+from app.reader import stream_rows
+from app.vectorstore import BACKENDS, open_vector_store
 
 
 # Variable to store the connection to Milvus DB
@@ -20,10 +25,19 @@ collection_name = "product_embedding"
 batch_size = 500
 max_concurrency = 20
 
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/06_product_similarity_calculation.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/06_product_similarity_calculation.trace.jsonl" to trace every span
+}
+
 
 # Asynchronous wrapper
 async def get_product_similarity_async(collection, prd_id):
-    return await asyncio.to_thread(get_product_similarity_inner, collection, prd_id)
+    with span("similarity_inner", prd_id=prd_id):
+        return await asyncio.to_thread(get_product_similarity_inner, collection, prd_id)
 
 
 async def insert_batch_async(db_cursor, similarities):
@@ -39,27 +53,43 @@ async def process_batch(collection, db_cursor, prd_ids, semaphore):
     results = await asyncio.gather(*tasks)
     await insert_batch_async(db_cursor, results)
 
+# Matrix engine: bulk-export all embeddings and score every product at once
+def main_matrix(backend):
+    store = open_vector_store(backend)
+    with span("similarity_matrix"):
+        similarities = get_product_similarity_inner_matrix(store)
+
+    db_conn = psycopg2.connect(**DB_CONFIG)
+    db_cur = db_conn.cursor()
+    batches = [similarities[i:i + batch_size] for i in range(0, len(similarities), batch_size)]
+    for batch_num, batch in enumerate(batches, start=1):
+        insert_batch_similarities(db_cur, batch)
+        db_conn.commit()
+        print(f"Batch {batch_num}/{len(batches)} committed.")
+
+    db_cur.close()
+    db_conn.close()
+
+
 # Asynchronous process (entire process)
 async def main():
     db_conn = psycopg2.connect(**DB_CONFIG)
     db_cur = db_conn.cursor()
 
-    db_cur.execute("""
-        SELECT DISTINCT prd_id
-        FROM product_similarity.products_trait_information
-    """)
-    prd_ids = [row[0] for row in db_cur.fetchall()]
-
     connections.connect("default", uri=milvus_uri)
     collection = Collection(collection_name)
     collection.load()
 
     semaphore = asyncio.Semaphore(max_concurrency)
-    batches = [prd_ids[i:i + batch_size] for i in range(0, len(prd_ids), batch_size)]
 
-    for batch_num, batch in enumerate(batches, start=1):
-        print(f"Processing batch {batch_num}/{len(batches)} ...")
-        await process_batch(collection, db_cur, batch, semaphore)
+    # Product IDs are streamed batch by batch while the results are committed on the same connection
+    rows = stream_rows(db_conn, """
+        SELECT prd_id
+        FROM product_similarity.products_trait_information
+    """, fetch_size=batch_size)
+    for batch_num, batch in enumerate(rows, start=1):
+        print(f"Processing batch {batch_num} ...")
+        await process_batch(collection, db_cur, [row[0] for row in batch], semaphore)
         db_conn.commit()
         print(f"Batch {batch_num} committed.")
 
@@ -68,4 +98,19 @@ async def main():
 
 # Run
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Calculate intra-product similarity scores.")
+    parser.add_argument(
+        "--engine", choices=["matrix", "milvus"], default="matrix",
+        help="matrix: in-memory batched cosine (default), milvus: per-product Milvus searches")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default="milvus",
+        help="vector store the matrix engine exports the embeddings from")
+    args = parser.parse_args()
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        if args.engine == "matrix":
+            main_matrix(args.backend)
+        else:
+            asyncio.run(main())
+    finally:
+        exporter.close()
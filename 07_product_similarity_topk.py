@@ -0,0 +1,116 @@
+import argparse
+import time
+import psycopg2
+from app.embedding import search_similar_products, insert_batch_similar_products
+from app.metrics import start_metrics, span
+from app.vectorstore import BACKENDS, open_vector_store
+
+
+# Connect to your PostgreSQL database
+DB_CONFIG = {
+    "database": "mydb",
+    "user": "myuser",
+    "password": "mypassword",
+    "host": "pgsql",
+    "port": "5432"
+}
+
+top_k = 10
+search_batch_size = 256   # query vectors per store.search call
+insert_batch_size = 10000
+prd_tags = ['product_name', 'product_text', 'product_image']
+
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/07_product_similarity_topk.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/07_product_similarity_topk.trace.jsonl" to trace every span
+}
+
+
+def first_per_product(prd_ids, embeddings, categories):
+    # One query vector per product (the first one, as in the inner similarity)
+    first = {}
+    for row, prd_id in enumerate(prd_ids):
+        first.setdefault(prd_id, row)
+    rows = list(first.values())
+    return list(first), embeddings[rows], [categories[_] for _ in rows]
+
+
+def write_similar_products(db_conn, db_cur, prd_tag, category_only, rows):
+    # Replace the previous result of this tag/scope in a single transaction
+    db_cur.execute(
+        """
+        DELETE FROM product_similarity.products_similarity_topk
+        WHERE prd_tag = %s AND category_only = %s;
+        """,
+        (prd_tag, category_only)
+    )
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == insert_batch_size:
+            insert_batch_similar_products(db_cur, prd_tag, category_only, batch)
+            written += len(batch)
+            batch = []
+    insert_batch_similar_products(db_cur, prd_tag, category_only, batch)
+    written += len(batch)
+    db_conn.commit()
+    return written
+
+
+def main(category_only, backend):
+    db_conn = psycopg2.connect(**DB_CONFIG)
+    db_cur = db_conn.cursor()
+    store = open_vector_store(backend)
+
+    for prd_tag in prd_tags:
+        started = time.perf_counter()
+        with span("export", prd_tag=prd_tag):
+            # The category stored with each vector is the one category searches filter on
+            prd_ids, embeddings, categories = first_per_product(*store.export(prd_tag, categories=True))
+
+        if category_only:
+            groups = {}
+            for row, category in enumerate(categories):
+                groups.setdefault(category, []).append(row)
+            rows = (
+                result
+                for category, group in groups.items() if category is not None
+                for result in search_similar_products(
+                    store, [prd_ids[_] for _ in group], embeddings[group], prd_tag,
+                    top_k=top_k, category=category, batch_size=search_batch_size)
+            )
+        else:
+            rows = search_similar_products(
+                store, prd_ids, embeddings, prd_tag,
+                top_k=top_k, batch_size=search_batch_size)
+
+        # Searches run lazily while the rows are written, so this span covers both
+        with span("search_and_write", prd_tag=prd_tag):
+            written = write_similar_products(db_conn, db_cur, prd_tag, category_only, rows)
+        elapsed = time.perf_counter() - started
+        print(f"{prd_tag}: {len(prd_ids)} products, {written} rows in {elapsed:.1f}s "
+              f"({len(prd_ids) / elapsed:.1f} products/sec)")
+
+    db_cur.close()
+    db_conn.close()
+
+
+# Run
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store the top-k most similar products per product and tag.")
+    parser.add_argument(
+        "--same-category", action="store_true",
+        help="only consider candidates from the product's own category")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default="milvus",
+        help="vector store searched: milvus (IVF_FLAT), numpy (exact) or faiss (HNSW / IVF-PQ)")
+    args = parser.parse_args()
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        main(category_only=args.same_category, backend=args.backend)
+    finally:
+        exporter.close()
@@ -0,0 +1,87 @@
+import argparse
+import importlib
+import time
+
+from sentence_transformers import SentenceTransformer
+
+from app.metrics import start_metrics, span
+from app.service import SimilarProducts, serve
+from app.vectorstore import BACKENDS, open_vector_store
+
+
+# Model, instruction and prompt must match the ones the products were embedded with
+embed_script = importlib.import_module("05_product_embedding_milvus")
+
+SERVICE_CONFIG = {
+    "host": "0.0.0.0",
+    "port": 8080,
+    "tags": [tag for tag, _ in embed_script.prd_sources],  # searchable tags, the first is the default
+    "result_cache": 50_000,     # (query, tag, k, category) results kept in memory
+    "embedding_cache": 20_000,  # text query embeddings kept in memory
+    "default_k": 10,
+    "max_k": 100,
+    "max_batch": 32,            # text queries embedded per model call
+    "max_wait": 0.005,          # seconds a text query waits for others to share its batch
+}
+
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces.
+# The service also answers /metrics on its own port.
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/08_similar_products_service.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/08_similar_products_service.trace.jsonl" to trace every span
+}
+
+
+def main(args):
+    # Model and index are loaded once and kept warm for the life of the service
+    with span("load"):
+        store = open_vector_store(args.backend)
+        model = None if args.no_text else SentenceTransformer(embed_script.ENCODE_CONFIG['model'])
+        service = SimilarProducts(
+            store,
+            model,
+            model_name=embed_script.ENCODE_CONFIG['model'],
+            instruct=embed_script.instruct,
+            prompt_template=embed_script.prompt,
+            tags=SERVICE_CONFIG['tags'],
+            result_cache=SERVICE_CONFIG['result_cache'],
+            embedding_cache=SERVICE_CONFIG['embedding_cache'],
+            default_k=SERVICE_CONFIG['default_k'],
+            max_k=SERVICE_CONFIG['max_k'],
+            max_batch=SERVICE_CONFIG['max_batch'],
+            max_wait=SERVICE_CONFIG['max_wait'],
+        )
+        service.warm()
+    server = serve(service, host=SERVICE_CONFIG['host'], port=args.port)
+    print(f"Serving similar products from the {args.backend} store on "
+          f"http://{SERVICE_CONFIG['host']}:{args.port}/similar")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+        print(service.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve similar-product queries over HTTP.")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default="milvus",
+        help="vector store searched: milvus (IVF_FLAT), numpy (exact) or faiss (HNSW / IVF-PQ)")
+    parser.add_argument(
+        "--port", type=int, default=SERVICE_CONFIG['port'],
+        help="port the API listens on")
+    parser.add_argument(
+        "--no-text", action="store_true",
+        help="do not load the embedding model, only prd_id queries are answered")
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        main(parser.parse_args())
+    finally:
+        exporter.close()
@@ -0,0 +1,194 @@
+"""
+Dynamic micro-batching in front of an embedding model: concurrent encode
+requests are collected for up to max_wait seconds or max_batch prompts and
+encoded as one batch, and every caller gets back its own vectors.
+
+    batcher = EmbeddingBatcher(SentenceTransformer(model_name), max_batch=32, max_wait=0.005)
+    vector = batcher.encode(prompt)               # from any thread
+    vectors = batcher.encode(prompts)             # SentenceTransformer.encode compatible
+    print(batcher.report())
+    batcher.close()
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from app import metrics
+from app.scheduler import percentile
+
+
+BATCH_SIZE = metrics.histogram(
+    "embedding_coalesced_batch_size", "Prompts per coalesced encode call", ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+QUEUE_SECONDS = metrics.histogram(
+    "embedding_queue_seconds", "Time a prompt waited for its batch to start", ["batcher"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+ENCODE_SECONDS = metrics.histogram(
+    "embedding_coalesced_encode_seconds", "Time to encode one coalesced batch", ["batcher"])
+
+# Tells the batching thread to stop once the queue before it is drained
+_CLOSE = object()
+
+
+class EmbeddingBatcher:
+    """
+    Request coalescer owning an embedding model. A single background thread
+    calls the model, so callers need no lock around it. Prompts are batched
+    in arrival order; prompts already queued (e.g. one large encode call) are
+    taken without waiting, so full batches are never delayed.
+    """
+
+    def __init__(self, model, max_batch=32, max_wait=0.005, name="default", history=10_000):
+        """
+        Args:
+            model (SentenceTransformer): Loaded embedding model (anything with encode)
+            max_batch (int): Most prompts per model call
+            max_wait (float): Seconds a batch waits for more prompts after its first one
+            name (str): Label of the batcher in the metrics
+            history (int): Recent per-prompt latencies kept for the percentiles
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self.batches = 0
+        self.full_batches = 0
+        self.items = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.latencies = deque(maxlen=history)
+        self.started = time.perf_counter()
+        self._queue = queue.SimpleQueue()
+        self._stats_lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"embedding-batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt):
+        """
+        Queue one prompt.
+        Args:
+            prompt (str): Prompt, already formatted with the instruction
+        Returns:
+            Future: Resolves to the float32 vector of the prompt
+        """
+        future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError(f"Embedding batcher {self.name} is closed")
+            self._queue.put((prompt, future, time.perf_counter()))
+        return future
+
+    def encode(self, sentences, batch_size=None, convert_to_numpy=True, **kwargs):
+        """
+        Encode prompts through the batcher, blocking until all are done.
+        Same call as SentenceTransformer.encode, so a batcher can replace the
+        model (batch_size and other options are set by the batcher).
+        Args:
+            sentences (str or list): One prompt or a list of prompts
+        Returns:
+            ndarray: float32 vector of a single prompt, or (len(sentences), dim) matrix
+        """
+        single = isinstance(sentences, str)
+        futures = [self.submit(prompt) for prompt in ([sentences] if single else sentences)]
+        vectors = [future.result() for future in futures]
+        if single:
+            return vectors[0]
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def _collect(self):
+        item = self._queue.get()
+        if item is _CLOSE:
+            return None
+        batch = [item]
+        deadline = item[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                # Encode what was collected, stop on the next round
+                self._queue.put(_CLOSE)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            for _, _, submitted in batch:
+                QUEUE_SECONDS.observe(started - submitted, batcher=self.name)
+            try:
+                embeddings = np.asarray(self.model.encode(
+                    [prompt for prompt, _, _ in batch], batch_size=len(batch), convert_to_numpy=True),
+                    dtype=np.float32)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._stats_lock:
+                    self.failed += len(batch)
+                continue
+            finished = time.perf_counter()
+            BATCH_SIZE.observe(len(batch), batcher=self.name)
+            ENCODE_SECONDS.observe(finished - started, batcher=self.name)
+            with self._stats_lock:
+                self.batches += 1
+                self.full_batches += len(batch) == self.max_batch
+                self.items += len(batch)
+                self.busy += finished - started
+                self.latencies.extend(finished - submitted for _, _, submitted in batch)
+            for (_, future, _), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def summary(self):
+        """
+        Returns:
+            dict: Batch counts, mean batch size, prompts/sec (overall and while
+                encoding) and p50/p99 per-prompt latency in seconds
+        """
+        with self._stats_lock:
+            elapsed = time.perf_counter() - self.started
+            latencies = list(self.latencies)
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "failed": self.failed,
+                "mean_batch": self.items / self.batches if self.batches else 0.0,
+                "full_batches": self.full_batches,
+                "rate": self.items / elapsed if elapsed > 0 else 0.0,
+                "busy_rate": self.items / self.busy if self.busy > 0 else 0.0,
+                "p50": percentile(latencies, 50),
+                "p99": percentile(latencies, 99),
+            }
+
+    def report(self):
+        s = self.summary()
+        return (
+            f"Batcher {self.name}: {s['items']} prompts in {s['batches']} batches "
+            f"(mean {s['mean_batch']:.1f}, {s['full_batches']} full, {s['failed']} failed), "
+            f"{s['busy_rate']:.1f} prompts/sec while encoding, "
+            f"p50 {s['p50'] * 1000:.1f} ms, p99 {s['p99'] * 1000:.1f} ms"
+        )
+
+    def close(self):
+        """
+        Encode the prompts already queued and stop the batching thread.
+        """
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_CLOSE)
+        self._thread.join()
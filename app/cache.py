@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app import metrics
+
+
+def hash_bytes(data):
+    """
+    Args:
+        data (bytes or str): Content to hash
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def llm_cache_key(service_llm, service_temperature, service_role, prompt, image_bytes=None):
+    """
+    Content-addressed key of an LLM request.
+    Every input that can change the answer is part of the key, so editing the
+    system role only invalidates the entries that were produced with it.
+    Args:
+        service_llm (str): Name of the language model
+        service_temperature (float): Temperature setting for the LLM
+        service_role (str): System role description for the LLM
+        prompt (str): User prompt text
+        image_bytes (bytes): Raw image content, if the request has an image
+    Returns:
+        str: Cache key
+    """
+    parts = [
+        service_llm,
+        float(service_temperature),
+        hash_bytes(service_role),
+        prompt,
+        hash_bytes(image_bytes) if image_bytes is not None else None,
+    ]
+    return hash_bytes(json.dumps(parts, ensure_ascii=False))
+
+
+CACHE_LOOKUPS = metrics.counter("cache_lookups_total", "Disk cache lookups", ["cache", "result"])
+
+
+class DiskCache:
+    """
+    Persistent key/value cache stored in SQLite with least-recently-used
+    eviction once max_entries entries or max_bytes bytes are exceeded.
+    Safe to share between threads; hits and misses are counted per instance.
+    Access times of hits are kept in memory and written in batches, so a
+    lookup does not pay for a write and a commit.
+    """
+
+    def __init__(self, path, max_entries=1_000_000, max_bytes=2 * 1024 ** 3,
+                 touch_batch=1000, touch_interval=5.0):
+        """
+        Args:
+            path (str): SQLite database file
+            max_entries (int): Maximum number of entries
+            max_bytes (int): Maximum total size of the stored values
+            touch_batch (int): Write the buffered access times once this many hits are buffered
+            touch_interval (float): Write them at least every n seconds while hits are buffered
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._touched = {}
+        self._touched_since = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            );
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_idx ON entries (accessed);")
+        self._conn.commit()
+        self._count, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries;").fetchone()
+
+    def get(self, key):
+        """
+        Args:
+            key (str): Cache key
+        Returns:
+            bytes: Stored value, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?;", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+                return None
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+            self._touch([key])
+            return row[0]
+
+    def get_many(self, keys, chunk_size=500):
+        """
+        Look up many keys with one query per chunk.
+        Args:
+            keys (list): Cache keys
+            chunk_size (int): Keys per query
+        Returns:
+            dict: key -> value for the keys that were found
+        """
+        found = {}
+        with self._lock:
+            now = time.time()
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({', '.join('?' * len(chunk))});",
+                    chunk
+                ).fetchall()
+                found.update(rows)
+            self._touch(found, now)
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        CACHE_LOOKUPS.inc(len(found), cache=self.name, result="hit")
+        CACHE_LOOKUPS.inc(len(set(keys)) - len(found), cache=self.name, result="miss")
+        return found
+
+    def put_many(self, items):
+        """
+        Store many values in one transaction.
+        Args:
+            items (list): (key, value) pairs
+        """
+        with self._lock:
+            now = time.time()
+            for key, value in items:
+                self._touched.pop(key, None)
+                old = self._conn.execute("SELECT size FROM entries WHERE key = ?;", (key,)).fetchone()
+                if old is not None:
+                    self._count -= 1
+                    self._bytes -= old[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?);",
+                    (key, sqlite3.Binary(value), len(value), now)
+                )
+                self._count += 1
+                self._bytes += len(value)
+            self._evict()
+            self._conn.commit()
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries when full.
+        Args:
+            key (str): Cache key
+            value (bytes): Value to store
+        """
+        self.put_many([(key, value)])
+
+    def _touch(self, keys, now=None):
+        # Called with the lock held
+        now = time.time() if now is None else now
+        if not self._touched:
+            self._touched_since = time.monotonic()
+        self._touched.update((key, now) for key in keys)
+        if (len(self._touched) >= self.touch_batch
+                or time.monotonic() - self._touched_since >= self.touch_interval):
+            self._write_touched()
+            self._conn.commit()
+
+    def _write_touched(self):
+        # Called with the lock held, committed by the caller
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE entries SET accessed = ? WHERE key = ?;",
+                [(accessed, key) for key, accessed in self._touched.items()])
+            self._touched = {}
+
+    def _evict(self):
+        if self._count > self.max_entries or self._bytes > self.max_bytes:
+            # Eviction order must see the recent hits
+            self._write_touched()
+        while self._count > self.max_entries or self._bytes > self.max_bytes:
+            # Evict in chunks so a full cache does not pay one DELETE per put
+            n = max(self._count - self.max_entries, 1, self._count // 100)
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed LIMIT ?;", (n,)).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM entries WHERE key = ?;", [(k,) for k, _ in rows])
+            self._count -= len(rows)
+            self._bytes -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters, hit rate and current size
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._count,
+            "bytes": self._bytes,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (
+            f"Cache {self.path}: {s['hits']} hits, {s['misses']} misses "
+            f"({s['hit_rate']:.1%} hit rate), {s['evictions']} evicted, "
+            f"{s['entries']} entries / {s['bytes'] / 1024 ** 2:.1f} MB"
+        )
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+            self._conn.close()
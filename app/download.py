@@ -0,0 +1,177 @@
+import csv
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import metrics
+
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+DOWNLOADS = metrics.counter("image_downloads_total", "Image downloads by result", ["result"])
+DOWNLOAD_SECONDS = metrics.histogram("image_download_seconds", "Latency of one image download attempt")
+DOWNLOAD_RETRIES = metrics.counter("image_download_retries_total", "Retried image download attempts")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the request rate across workers.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): Tokens added per second (requests/sec)
+            burst (int): Bucket capacity (defaults to one second worth of tokens)
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size):
+    """
+    Create an HTTP session whose connection pool fits the worker count.
+    Args:
+        pool_size (int): Number of pooled connections per host
+    Returns:
+        requests.Session: Session with keep-alive connections
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download_image(session, bucket, img_url, img_path, retries=3, backoff=1.0, timeout=30.0):
+    """
+    Download one image, streaming it to a temporary file that is renamed
+    into place only when complete.
+    Args:
+        session (requests.Session): Shared HTTP session
+        bucket (TokenBucket): Rate limiter shared by all workers
+        img_url (str): Image URL
+        img_path (str): Destination file
+        retries (int): Number of retries after the first failed attempt
+        backoff (float): Base delay in seconds for exponential backoff
+        timeout (float): Connect/read timeout in seconds
+    Returns:
+        dict: status and message
+    """
+    if os.path.exists(img_path) and os.path.getsize(img_path) > 0:
+        DOWNLOADS.inc(result="skipped")
+        return {"status": True, "return": f"Skipped (exists) : {img_path}"}
+    tmp_path = f"{img_path}.part"
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            DOWNLOAD_RETRIES.inc()
+            delay = backoff * (2 ** (attempt - 1))
+            time.sleep(delay + random.uniform(0, delay / 2))
+        bucket.acquire()
+        started = time.perf_counter()
+        try:
+            with session.get(img_url, stream=True, timeout=timeout) as response:
+                if response.status_code != 200:
+                    error = f"HTTP {response.status_code}"
+                    if response.status_code in RETRY_STATUS:
+                        continue
+                    break
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            os.replace(tmp_path, img_path)
+            DOWNLOADS.inc(result="downloaded")
+            return {"status": True, "return": f"Downloaded : {img_path}"}
+        except requests.RequestException as e:
+            error = str(e)
+        except OSError as e:
+            # Writing failed (disk full, permissions, bad path): retrying will not help
+            error = f"Write failed : {e}"
+            break
+        finally:
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+    with suppress(OSError):
+        os.remove(tmp_path)
+    DOWNLOADS.inc(result="failed")
+    return {"status": False, "return": error}
+
+
+def download_images(items, out_dir, concurrency=16, rate=20.0, retries=3, backoff=1.0,
+                    timeout=30.0, manifest_path=None, session=None):
+    """
+    Download images in parallel through one pooled session and a shared rate limit.
+    Args:
+        items (iterable): (img_id, img_url) pairs, saved as {out_dir}/{img_id}.jpg
+        out_dir (str): Destination directory
+        concurrency (int): Number of download threads
+        rate (float): Maximum requests per second across all threads
+        retries (int): Number of retries per image
+        backoff (float): Base delay in seconds for exponential backoff
+        timeout (float): Connect/read timeout in seconds
+        manifest_path (str): CSV file listing failed downloads (img_id, img_url, error)
+        session (requests.Session): Session to use (a pooled one is created when None)
+    Returns:
+        dict: Counts of downloaded, skipped and failed images and images/sec
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    own_session = session is None
+    if own_session:
+        session = make_session(concurrency)
+    bucket = TokenBucket(rate)
+    stats = {"downloaded": 0, "skipped": 0, "failed": 0}
+    failures = []
+    started = time.perf_counter()
+
+    def work(item):
+        img_id, img_url = item
+        img_path = os.path.join(out_dir, f"{img_id}.jpg")
+        return item, download_image(session, bucket, img_url, img_path, retries, backoff, timeout)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for (img_id, img_url), result in executor.map(work, items):
+                if not result.get("status"):
+                    stats["failed"] += 1
+                    failures.append((img_id, img_url, result.get("return")))
+                elif result.get("return").startswith("Skipped"):
+                    stats["skipped"] += 1
+                else:
+                    stats["downloaded"] += 1
+    finally:
+        if own_session:
+            session.close()
+
+    if manifest_path is not None:
+        with open(manifest_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["img_id", "img_url", "error"])
+            writer.writerows(failures)
+    elapsed = time.perf_counter() - started
+    stats["elapsed"] = elapsed
+    stats["rate"] = stats["downloaded"] / elapsed if elapsed > 0 else 0.0
+    return stats
@@ -0,0 +1,182 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from app import metrics
+from app.cache import hash_bytes
+
+EMBED_TEXTS = metrics.counter("embedding_texts_total", "Distinct texts embedded or taken from the cache", ["result"])
+EMBED_BATCH_SECONDS = metrics.histogram("embedding_batch_seconds", "Time to encode one batch (or worker shard)")
+
+
+def embedding_cache_key(model_name, instruct, prompt_template, text):
+    """
+    Key of an embedding in the vector cache.
+    Args:
+        model_name (str): Embedding model name
+        instruct (str): Instruction prepended to the text
+        prompt_template (str): Template combining instruction and text
+        text (str): Product name or trait string
+    Returns:
+        str: Cache key
+    """
+    return hash_bytes(json.dumps(
+        [model_name, instruct, prompt_template, hash_bytes(text)], ensure_ascii=False))
+
+
+# Model of a pool worker, loaded once by _init_worker
+_worker_model = None
+
+
+def _init_worker(model_name, threads):
+    # Thread counts must be set before torch starts its thread pools
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(threads)
+    global _worker_model
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _worker_dim():
+    return _worker_model.get_sentence_embedding_dimension()
+
+
+def _encode_shard(prompts, batch_size, out_path, shape, start):
+    # Vectors go straight into the shared memory-mapped output, only the
+    # row range is sent back to the parent
+    out = np.memmap(out_path, dtype=np.float32, mode="r+", shape=shape)
+    out[start:start + len(prompts)] = _worker_model.encode(
+        prompts, batch_size=batch_size, convert_to_numpy=True)
+    out.flush()
+    del out
+    return start, len(prompts)
+
+
+def _encode_serial(embedding_model, prompts, batch_size):
+    for start in range(0, len(prompts), batch_size):
+        embeddings = embedding_model.encode(
+            prompts[start:start + batch_size], batch_size=batch_size, convert_to_numpy=True)
+        yield start, np.asarray(embeddings, dtype=np.float32)
+
+
+def _encode_parallel(model_name, prompts, batch_size, workers, threads_per_worker=None, shard_batches=8):
+    """
+    Encode prompts with a pool of processes, each loading the model once.
+    Consecutive shards of shard_batches batches are handed out as workers
+    become free, so the length-sorted order keeps padding low and long
+    prompts do not pile up on one worker.
+    Yields:
+        tuple: (start, embeddings) for prompts[start:start + len(embeddings)],
+            in completion order
+    """
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    shard_size = batch_size * shard_batches
+    # /dev/shm keeps the memory-mapped output in RAM where available
+    tmp_root = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    # spawn: forking a parent that already imported torch can deadlock its thread pools
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(dir=tmp_root) as tmp, ProcessPoolExecutor(
+            workers, mp_context=context, initializer=_init_worker, initargs=(model_name, threads)) as pool:
+        dim = pool.submit(_worker_dim).result()
+        out_path = os.path.join(tmp, "embeddings.f32")
+        shape = (len(prompts), dim)
+        out = np.memmap(out_path, dtype=np.float32, mode="w+", shape=shape)
+        futures = [
+            pool.submit(_encode_shard, prompts[i:i + shard_size], batch_size, out_path, shape, i)
+            for i in range(0, len(prompts), shard_size)
+        ]
+        for future in as_completed(futures):
+            start, count = future.result()
+            yield start, np.array(out[start:start + count])
+        del out
+
+
+def encode_texts(embedding_model, texts, model_name, instruct, prompt_template,
+                 cache=None, batch_size=32, report_every=50, return_inverse=False,
+                 workers=1, threads_per_worker=None):
+    """
+    Encode texts through a single length-sorted queue, reusing cached vectors.
+    Every distinct text is encoded at most once and its vector is shared by
+    all positions holding that text. Sorting by prompt length puts prompts of
+    similar length in the same batch, so little compute is spent on padding.
+    Args:
+        embedding_model (SentenceTransformer): Loaded embedding model, or an
+            EmbeddingBatcher (app.batcher) shared with other callers
+        texts (list): Product names or trait strings
+        model_name (str): Embedding model name (part of the cache key)
+        instruct (str): Instruction prepended to every text
+        prompt_template (str): Template formatted with (instruct, text)
+        cache (DiskCache): Persistent vector cache (disabled when None)
+        batch_size (int): Prompts encoded per model call
+        report_every (int): Print throughput every n batches (0 disables)
+        return_inverse (bool): Return distinct vectors and an index instead of
+            one (possibly repeated) row per text
+        workers (int): Encoding processes; above 1 each worker loads model_name
+            on CPU and embedding_model is not used (it may be None)
+        threads_per_worker (int): Torch threads per worker (default: cores / workers)
+    Returns:
+        ndarray: float32 (len(texts), dim) matrix aligned with texts, or
+            (unique, inverse) with unique[inverse[i]] the vector of texts[i]
+    """
+    keys = [embedding_cache_key(model_name, instruct, prompt_template, _) for _ in texts]
+    # Identical texts (e.g. trait strings shared by many products) are encoded
+    # once; the first occurrence represents the key and the vector is fanned out
+    first = {}
+    for i, key in enumerate(keys):
+        first.setdefault(key, i)
+    cached = cache.get_many(list(first)) if cache is not None else {}
+    missing = [i for key, i in first.items() if key not in cached]
+
+    vectors = {}
+    for key, value in cached.items():
+        vectors[key] = np.frombuffer(value, dtype=np.float32)
+
+    # Longest prompts first, so the first batch also reveals peak memory use
+    prompts = {i: prompt_template.format(instruct, texts[i]) for i in missing}
+    order = sorted(missing, key=lambda i: len(prompts[i]), reverse=True)
+    ordered_prompts = [prompts[i] for i in order]
+    if workers > 1 and order:
+        source = _encode_parallel(model_name, ordered_prompts, batch_size, workers, threads_per_worker)
+    else:
+        source = _encode_serial(embedding_model, ordered_prompts, batch_size)
+    EMBED_TEXTS.inc(len(first) - len(missing), result="cached")
+    started = time.perf_counter()
+    batch_started = started
+    encoded = 0
+    report_rows = report_every * batch_size
+    for start, embeddings in source:
+        EMBED_BATCH_SECONDS.observe(time.perf_counter() - batch_started)
+        EMBED_TEXTS.inc(len(embeddings), result="encoded")
+        batch = order[start:start + len(embeddings)]
+        new_entries = []
+        for i, embedding in zip(batch, embeddings):
+            vectors[keys[i]] = embedding
+            new_entries.append((keys[i], embedding.tobytes()))
+        if cache is not None:
+            cache.put_many(new_entries)
+        encoded += len(batch)
+        batch_started = time.perf_counter()
+        if report_every and encoded // report_rows > (encoded - len(batch)) // report_rows:
+            elapsed = time.perf_counter() - started
+            print(f"Encoded {encoded}/{len(order)} ({encoded / elapsed:.1f} sentences/sec)")
+
+    elapsed = time.perf_counter() - started
+    print(f"{len(texts)} texts, {len(first)} distinct: encoded {encoded}, "
+          f"{len(first) - len(missing)} from cache"
+          + (f" ({encoded / elapsed:.1f} sentences/sec)" if encoded else ""))
+    if not texts:
+        empty = np.zeros((0, 0), dtype=np.float32)
+        return (empty, np.zeros(0, dtype=np.int64)) if return_inverse else empty
+    if return_inverse:
+        position = {key: n for n, key in enumerate(first)}
+        unique = np.stack([vectors[key] for key in first])
+        return unique, np.asarray([position[key] for key in keys], dtype=np.int64)
+    return np.stack([vectors[key] for key in keys])
@@ -0,0 +1,156 @@
+import asyncio
+import base64
+import glob
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.cache import hash_bytes
+
+
+def prepared_path(img_path, source_hash, max_side, quality):
+    """
+    Path of the prepared payload of an image, stored next to it. The source
+    hash is part of the name, so a re-downloaded image is prepared again.
+    Args:
+        img_path (str): Path to the source image
+        source_hash (str): Hex SHA-256 digest of the source image
+        max_side (int): Longest side of the prepared image in pixels
+        quality (int): JPEG quality of the prepared image
+    Returns:
+        str: Path to the base64 payload file
+    """
+    return f"{img_path}.prep-{max_side}q{quality}-{source_hash[:16]}.b64"
+
+
+def _downscale(image_bytes, max_side, quality):
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # JPEG draft mode decodes at a reduced scale, much cheaper than a full decode
+        img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def prepare_image(img_path, max_side=896, quality=85):
+    """
+    Downscale an image to the vision encoder's input size, recompress it and
+    return its base64 payload. The payload is cached on disk next to the
+    image; an image that is already small enough is sent as it is.
+    Args:
+        img_path (str): Path to the source image
+        max_side (int): Longest side of the prepared image in pixels
+        quality (int): JPEG quality of the prepared image
+    Returns:
+        dict: {
+            "status": True/False,
+            "return": base64 payload or error message,
+            "source_bytes": Size of the source image,
+            "payload_bytes": Size of the base64 payload,
+            "cached": True when the payload was read from disk
+        }
+    """
+    try:
+        with open(img_path, "rb") as img_file:
+            image_bytes = img_file.read()
+        path = prepared_path(img_path, hash_bytes(image_bytes), max_side, quality)
+        cached = os.path.exists(path)
+        if cached:
+            with open(path, "r", encoding="ascii") as payload_file:
+                payload = payload_file.read()
+        else:
+            prepared = _downscale(image_bytes, max_side, quality)
+            payload = base64.b64encode(min(prepared, image_bytes, key=len)).decode("ascii")
+            # Payloads of an earlier version of the image are stale
+            for stale in glob.glob(f"{glob.escape(img_path)}.prep-{max_side}q{quality}-*.b64"):
+                os.remove(stale)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="ascii") as payload_file:
+                payload_file.write(payload)
+            os.replace(tmp_path, path)
+        return {
+            "status": True,
+            "return": payload,
+            "source_bytes": len(image_bytes),
+            "payload_bytes": len(payload),
+            "cached": cached,
+        }
+    except Exception as e:
+        return {"status": False, "return": str(e), "source_bytes": 0, "payload_bytes": 0, "cached": False}
+
+
+class ImagePreparer:
+    """
+    Prepares image payloads in a pool of worker processes, so decoding and
+    resizing never block the event loop that drives the LLM requests.
+
+        async with ImagePreparer(workers=4) as preparer:
+            result = await preparer.prepare(img_path)
+    """
+
+    def __init__(self, workers=4, max_side=896, quality=85):
+        """
+        Args:
+            workers (int): Number of worker processes
+            max_side (int): Longest side of the prepared images in pixels
+            quality (int): JPEG quality of the prepared images
+        """
+        self.workers = workers
+        self.max_side = max_side
+        self.quality = quality
+        self.prepared = 0
+        self.cached = 0
+        self.failed = 0
+        self.source_bytes = 0
+        self.payload_bytes = 0
+        self.seconds = 0.0
+        self._executor = None
+
+    async def prepare(self, img_path):
+        """
+        Returns:
+            dict: Result of prepare_image
+        """
+        if self._executor is None:
+            # spawn: the parent may already hold torch/openai threads that fork would copy
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        started = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(
+            self._executor, prepare_image, img_path, self.max_side, self.quality)
+        self.seconds += time.perf_counter() - started
+        if not result.get("status"):
+            self.failed += 1
+            return result
+        self.prepared += 1
+        self.cached += result.get("cached")
+        self.source_bytes += result.get("source_bytes")
+        self.payload_bytes += result.get("payload_bytes")
+        return result
+
+    def report(self):
+        # A source image sent as is would cost its base64 size (4/3 of the raw bytes)
+        wire_before = self.source_bytes * 4 / 3
+        saved = 1 - self.payload_bytes / wire_before if wire_before else 0.0
+        per_image = self.seconds / max(self.prepared + self.failed, 1)
+        return (
+            f"Prepared {self.prepared} images ({self.cached} from disk, {self.failed} failed): "
+            f"{wire_before / 1024 ** 2:.1f} MB -> {self.payload_bytes / 1024 ** 2:.1f} MB on the wire "
+            f"({saved:.0%} less), {per_image * 1000:.1f} ms/image"
+        )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
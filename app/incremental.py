@@ -0,0 +1,137 @@
+import argparse
+from datetime import datetime
+
+
+STATUS_TABLE = "product_similarity.products_recognition_status"
+RECOGNITION_INPUTS = {
+    "image": ("prd_img", "product_similarity.products_trait_image"),
+    "text": ("prd_name", "product_similarity.products_trait_text"),
+}
+
+
+def parse_run_args(description):
+    """
+    Parse the command line options shared by the recognition scripts.
+    Args:
+        description (str): Script description shown in --help
+    Returns:
+        argparse.Namespace: incremental (bool), since (datetime or None)
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="only process products without traits, marked failed, or changed since their last run")
+    parser.add_argument(
+        "--since", type=datetime.fromisoformat, default=None,
+        help="only process products added or changed at or after this time (e.g. 2025-10-01 or 2025-10-01T03:00)")
+    return parser.parse_args()
+
+
+def select_products_query(source, incremental=False, since=None):
+    """
+    Build the query selecting the products a recognition run has to process.
+    In incremental mode a product is selected when it has no status record and
+    no trait rows, when its last run failed, or when product_raw changed after
+    its last successful run.
+    Args:
+        source (str): Trait source, "image" or "text"
+        incremental (bool): Skip products that are already processed
+        since (datetime): Only products added or changed at or after this time
+    Returns:
+        str: SQL query returning (prd_id, <input column>)
+    """
+    input_col, _ = RECOGNITION_INPUTS[source]
+    conditions = ["prw.prd_img IS NOT NULL"]
+    if since is not None:
+        conditions.append(f"prw.updated_at >= '{since.isoformat()}'::timestamp")
+    if incremental:
+        conditions.append(_pending_condition(source, "prs"))
+    where = "\n            AND ".join(conditions)
+    return f"""
+        SELECT prw.prd_id,
+            prw.{input_col}
+        FROM product_similarity.product_raw AS prw
+            LEFT JOIN {STATUS_TABLE} AS prs
+                ON prs.prd_id = prw.prd_id AND prs.source = '{source}'
+        WHERE {where}
+        ORDER BY prw.prd_id;
+    """
+
+
+def _pending_condition(source, status_alias):
+    # True when the product still has to be recognized from this source
+    _, trait_table = RECOGNITION_INPUTS[source]
+    return f"""(
+                ({status_alias}.status IS NULL
+                    AND NOT EXISTS (SELECT 1 FROM {trait_table} AS trt WHERE trt.prd_id = prw.prd_id))
+                OR {status_alias}.status = 'failed'
+                OR {status_alias}.updated_at < prw.updated_at
+            )"""
+
+
+def select_products_combined_query(incremental=False, since=None):
+    """
+    Build the query selecting the products of a combined image + text run,
+    reading product_raw once. The needs_* flags tell which sources a product
+    still has to be recognized from (always both outside incremental mode).
+    Args:
+        incremental (bool): Skip sources that are already processed
+        since (datetime): Only products added or changed at or after this time
+    Returns:
+        str: SQL query returning (prd_id, prd_name, prd_img, needs_image, needs_text)
+    """
+    needs = {
+        source: _pending_condition(source, f"prs_{source}") if incremental else "TRUE"
+        for source in RECOGNITION_INPUTS
+    }
+    conditions = ["prw.prd_img IS NOT NULL"]
+    if since is not None:
+        conditions.append(f"prw.updated_at >= '{since.isoformat()}'::timestamp")
+    if incremental:
+        conditions.append(f"({needs['image']} OR {needs['text']})")
+    where = "\n            AND ".join(conditions)
+    joins = "".join(
+        f"""
+            LEFT JOIN {STATUS_TABLE} AS prs_{source}
+                ON prs_{source}.prd_id = prw.prd_id AND prs_{source}.source = '{source}'"""
+        for source in RECOGNITION_INPUTS
+    )
+    return f"""
+        SELECT prw.prd_id,
+            prw.prd_name,
+            prw.prd_img,
+            {needs['image']} AS needs_image,
+            {needs['text']} AS needs_text
+        FROM product_similarity.product_raw AS prw{joins}
+        WHERE {where}
+        ORDER BY prw.prd_id;
+    """
+
+
+def status_record(prd_id, status, error=None):
+    """
+    Build a per-product status row.
+    Args:
+        prd_id (str): Product ID
+        status (str): "done" or "failed"
+        error (str): Error message of a failed run
+    Returns:
+        tuple: (prd_id, status, error)
+    """
+    return (prd_id, status, None if error is None else str(error)[:1000])
+
+
+def status_upsert_query(paramstyle="psycopg2"):
+    """
+    Returns:
+        str: Upsert statement for the status table (execute_values or asyncpg executemany)
+    """
+    values = "%s" if paramstyle == "psycopg2" else "($1, $2, $3, $4)"
+    return f"""
+        INSERT INTO {STATUS_TABLE} (prd_id, source, status, error)
+        VALUES {values}
+        ON CONFLICT (prd_id, source) DO UPDATE
+        SET status = EXCLUDED.status,
+            error = EXCLUDED.error,
+            updated_at = now();
+    """
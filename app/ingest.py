@@ -0,0 +1,149 @@
+import io
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+
+# Columns read from the web scraper export and their names in product_raw
+CSV_COLUMNS = {
+    'web-scraper-order': 'prd_id',
+    'category-link-0-href': 'category_link',
+    'name': 'prd_name',
+    'price3': 'price',
+    'rating': 'review',
+    'ratingValue': 'review_rating',
+    'image-src': 'prd_img',
+}
+RAW_COLUMNS = ['prd_id', 'category', 'prd_name', 'price', 'review', 'review_rating', 'prd_img']
+
+
+def read_product_chunks(csv_path, chunk_size=50_000):
+    """
+    Stream the product CSV in chunks, reading only the columns that are used.
+    Args:
+        csv_path (str): Path to the web scraper CSV export
+        chunk_size (int): Number of rows per chunk
+    Returns:
+        iterator: DataFrame chunks with string typed columns
+    """
+    return pd.read_csv(
+        csv_path,
+        usecols=list(CSV_COLUMNS),
+        dtype={col: 'string' for col in CSV_COLUMNS},
+        chunksize=chunk_size,
+    )
+
+
+def _strip_chars(series, chars):
+    # Literal replaces are several times faster than one regex character class
+    for char in chars:
+        series = series.str.replace(char, '', regex=False)
+    return series.str.strip()
+
+
+def clean_product_chunk(df, category_map, img_dir):
+    """
+    Clean one chunk with vectorized string operations.
+    Args:
+        df (DataFrame): Raw chunk from read_product_chunks
+        category_map (dict): Category link -> category name
+        img_dir (str): Directory the product images are downloaded to
+    Returns:
+        DataFrame: Typed columns (prd_id, category, prd_name, price, review,
+            review_rating, img_url, prd_img) where prd_img is the local image path
+    """
+    df = df.rename(columns=CSV_COLUMNS)
+    out = pd.DataFrame({
+        'prd_id': df['prd_id'],
+        'category': df['category_link'].map(category_map).astype('string'),
+        'prd_name': df['prd_name'],
+        # "12,345원" -> 12345
+        'price': pd.to_numeric(_strip_chars(df['price'], '원,'), errors='coerce'),
+        # "(1,234)" -> 1234
+        'review': pd.to_numeric(_strip_chars(df['review'], '(),'), errors='coerce'),
+        'review_rating': pd.to_numeric(df['review_rating'], errors='coerce'),
+        'img_url': df['prd_img'],
+    })
+    out['prd_img'] = (img_dir + out['prd_id'] + '.jpg').where(out['img_url'].notna())
+    return out
+
+
+def product_copy_payload(df):
+    """
+    Serialize a cleaned chunk as the CSV body of the product_raw COPY.
+    pyarrow (the storage of pandas' string columns) writes it about 10x
+    faster than DataFrame.to_csv; without pyarrow to_csv is used.
+    Args:
+        df (DataFrame): Chunk from clean_product_chunk
+    Returns:
+        file object: CSV rows of RAW_COLUMNS, without header, missing values as empty fields
+    """
+    if pa is None:
+        buffer = io.StringIO()
+        df[RAW_COLUMNS].to_csv(buffer, index=False, header=False)
+    else:
+        buffer = io.BytesIO()
+        pa_csv.write_csv(
+            pa.Table.from_pandas(df[RAW_COLUMNS], preserve_index=False), buffer,
+            pa_csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    return buffer
+
+
+def copy_product_chunk(db_cur, df):
+    """
+    Bulk load one cleaned chunk into product_raw with COPY through a staging
+    table, then upsert it (changed category, name or image bump updated_at).
+    When a product ID occurs more than once, its last row in the CSV wins.
+    Args:
+        db_cur: Database cursor
+        df (DataFrame): Chunk from clean_product_chunk
+    Returns:
+        dict: status and message
+    """
+    try:
+        db_cur.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS product_raw_stage
+            (LIKE product_similarity.product_raw INCLUDING DEFAULTS, src_row BIGSERIAL)
+            ON COMMIT DELETE ROWS;
+            """
+        )
+        # src_row numbers the rows in CSV order
+        db_cur.copy_expert(
+            f"COPY product_raw_stage ({', '.join(RAW_COLUMNS)}) FROM STDIN WITH (FORMAT csv);",
+            product_copy_payload(df)
+        )
+        db_cur.execute(
+            f"""
+            INSERT INTO product_similarity.product_raw ({', '.join(RAW_COLUMNS)})
+            SELECT DISTINCT ON (prd_id) {', '.join(RAW_COLUMNS)}
+            FROM product_raw_stage
+            WHERE prd_id IS NOT NULL
+            ORDER BY prd_id, src_row DESC
+            ON CONFLICT (prd_id) DO UPDATE
+            SET category = EXCLUDED.category,
+                prd_name = EXCLUDED.prd_name,
+                price = EXCLUDED.price,
+                review = EXCLUDED.review,
+                review_rating = EXCLUDED.review_rating,
+                prd_img = EXCLUDED.prd_img,
+                -- Only inputs of the recognition stages mark a product as changed
+                updated_at = CASE
+                    WHEN (product_raw.category, product_raw.prd_name, product_raw.prd_img)
+                        IS DISTINCT FROM (EXCLUDED.category, EXCLUDED.prd_name, EXCLUDED.prd_img)
+                    THEN now()
+                    ELSE product_raw.updated_at
+                END;
+            """
+        )
+        db_cur.connection.commit()
+        return {"status": True, "return": f"Copy successful : {len(df)} rows"}
+    except Exception as e:
+        db_cur.connection.rollback()
+        return {"status": False, "return": f"Copy failed : {len(df)} rows\n{str(e)}"}
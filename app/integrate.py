@@ -0,0 +1,260 @@
+import time
+
+from app import metrics
+
+
+SCHEMA = "product_similarity"
+WATERMARK_TABLE = f"{SCHEMA}.integration_watermark"
+INFORMATION_TABLE = f"{SCHEMA}.products_trait_information"
+TRAIT_FIELDS = [
+    ("cat1", "category1"), ("cat2", "category2"), ("color", "color"),
+    ("style", "style"), ("material", "material"), ("occasion", "occasion"),
+]
+INFORMATION_COLUMNS = (
+    ["prd_id", "category", "prd_name"]
+    + [f"text_{name}" for name, _ in TRAIT_FIELDS]
+    + [f"image_{name}" for name, _ in TRAIT_FIELDS]
+    + ["text_seq", "image_seq"]
+)
+# NOT NULL columns and VARCHAR lengths of products_trait_information (00_create_table.sql)
+INFORMATION_REQUIRED = ["prd_id", "category", "prd_name"]
+INFORMATION_LENGTHS = {
+    "prd_id": 30,
+    "category": 20,
+    **{f"{source}_{name}": 30 if name.startswith("cat") else 50
+       for source in ("text", "image") for name, _ in TRAIT_FIELDS},
+}
+
+UNKNOWN = "unknown"
+
+INTEGRATED_ROWS = metrics.counter(
+    "integration_rows_total", "Rows of products_trait_information changed by an integration", ["op"])
+INTEGRATION_FAILED = metrics.counter(
+    "integration_failed_total", "Products whose products_trait_information row could not be written")
+INTEGRATION_SECONDS = metrics.histogram("integration_seconds", "Duration of an integration run")
+
+
+def changed_products_query(since=None):
+    """
+    Build the query selecting the products an integration has to refresh:
+    products whose raw row or trait rows were written after since, or every
+    product (including rows of products that have vanished) when since is None.
+    Args:
+        since (datetime): Lower bound, passed as the %(since)s parameter (None selects every product)
+    Returns:
+        str: SQL query returning (prd_id)
+    """
+    if not since:
+        return f"""
+            SELECT prd_id FROM {SCHEMA}.product_raw
+            UNION
+            SELECT prd_id FROM {INFORMATION_TABLE}
+        """
+    # Each branch is an index range scan on updated_at
+    return f"""
+        SELECT prd_id FROM {SCHEMA}.product_raw WHERE updated_at > %(since)s
+        UNION
+        SELECT prd_id FROM {SCHEMA}.products_trait_text WHERE updated_at > %(since)s
+        UNION
+        SELECT prd_id FROM {SCHEMA}.products_trait_image WHERE updated_at > %(since)s
+    """
+
+
+def information_row_error(row):
+    """
+    Check a row against the constraints of products_trait_information, so
+    that one bad product is skipped instead of failing the COPY of its batch.
+    Args:
+        row (tuple): Row values ordered as INFORMATION_COLUMNS
+    Returns:
+        str: What is wrong with the row, or None when it can be written
+    """
+    values = dict(zip(INFORMATION_COLUMNS, row))
+    for col in INFORMATION_REQUIRED:
+        if values[col] is None:
+            return f"{col} is missing"
+    for col, length in INFORMATION_LENGTHS.items():
+        if values[col] is not None and len(values[col]) > length:
+            return f"{col} is longer than {length} characters"
+    return None
+
+
+def resolve_traits(prd_descs, category):
+    """
+    Pick the canonical trait record of a product among the objects of one
+    answer (an image may show several items). Same order as the SQL of
+    canonical_traits_query: an item of the product's own category first,
+    then the category most items agree on, then the most informative item,
+    then the earliest one.
+    Args:
+        prd_descs (list): Trait dicts of one product and source, in answer order
+        category (str): Product category from product_raw (e.g. "니트/조끼")
+    Returns:
+        tuple: (trait_seq, trait dict), or (None, None) when there are none
+    """
+    if not prd_descs:
+        return None, None
+    names = {category, *category.split("/")} if category else set()
+    votes = {}
+    for prd_desc in prd_descs:
+        votes[prd_desc.get("category1")] = votes.get(prd_desc.get("category1"), 0) + 1
+
+    def rank(item):
+        seq, prd_desc = item
+        category1 = prd_desc.get("category1")
+        return (
+            category1 in names or prd_desc.get("category2") in names,
+            0 if category1 in (None, UNKNOWN) else votes[category1],
+            sum(prd_desc.get(col) not in (None, UNKNOWN) for _, col in TRAIT_FIELDS),
+            -seq,
+        )
+
+    return max(enumerate(prd_descs), key=rank)
+
+
+def canonical_traits_query(source):
+    """
+    Build the subquery keeping one trait row per changed product of a source.
+    Args:
+        source (str): Trait source, "image" or "text"
+    Returns:
+        str: SQL selecting the canonical rows of products_trait_<source>
+    """
+    known = " + ".join(f"(trt.{col} IS NOT NULL AND trt.{col} <> '{UNKNOWN}')::int" for _, col in TRAIT_FIELDS)
+    names = "ARRAY[prw.category] || string_to_array(prw.category, '/')"
+    return f"""
+        SELECT DISTINCT ON (trt.prd_id) trt.*
+        FROM integration_changed AS chg
+            JOIN {SCHEMA}.product_raw AS prw ON prw.prd_id = chg.prd_id
+            JOIN {SCHEMA}.products_trait_{source} AS trt ON trt.prd_id = chg.prd_id
+        ORDER BY trt.prd_id,
+            -- an item of the product's own category (the shirt of a shirt + trousers photo)
+            COALESCE(trt.category1 = ANY({names}) OR trt.category2 = ANY({names}), FALSE) DESC,
+            -- the category most items agree on
+            CASE WHEN trt.category1 IS NULL OR trt.category1 = '{UNKNOWN}' THEN 0
+                ELSE count(*) OVER (PARTITION BY trt.prd_id, trt.category1) END DESC,
+            -- the most informative item
+            ({known}) DESC,
+            trt.trait_seq
+    """
+
+
+def _desired_query():
+    # One row per changed product, as products_trait_information should hold it
+    text_cols = ",\n            ".join(f"ptt.{col} AS text_{name}" for name, col in TRAIT_FIELDS)
+    image_cols = ",\n            ".join(f"pti.{col} AS image_{name}" for name, col in TRAIT_FIELDS)
+    return f"""
+        SELECT prw.prd_id,
+            prw.category,
+            prw.prd_name,
+            {text_cols},
+            {image_cols},
+            ptt.trait_seq AS text_seq,
+            pti.trait_seq AS image_seq
+        FROM integration_changed AS chg
+            JOIN {SCHEMA}.product_raw AS prw ON prw.prd_id = chg.prd_id
+            JOIN ({canonical_traits_query("text")}) AS ptt ON ptt.prd_id = chg.prd_id
+            JOIN ({canonical_traits_query("image")}) AS pti ON pti.prd_id = chg.prd_id
+    """
+
+
+def _upsert_query():
+    columns = ", ".join(INFORMATION_COLUMNS)
+    values = [col for col in INFORMATION_COLUMNS if col != "prd_id"]
+    assignments = ",\n            ".join(f"{col} = EXCLUDED.{col}" for col in values)
+    current = ", ".join(f"pin.{col}" for col in values)
+    excluded = ", ".join(f"EXCLUDED.{col}" for col in values)
+    return f"""
+        INSERT INTO {INFORMATION_TABLE} AS pin ({columns})
+        {_desired_query()}
+        ON CONFLICT (prd_id) DO UPDATE
+        SET {assignments},
+            updated_at = now()
+        WHERE ({current}) IS DISTINCT FROM ({excluded});
+    """
+
+
+def _delete_stale_query():
+    # Rows of changed products that lost their raw row or all traits of a source
+    exists = "\n                OR ".join(
+        f"NOT EXISTS (SELECT 1 FROM {SCHEMA}.{table} AS src WHERE src.prd_id = pin.prd_id)"
+        for table in ("product_raw", "products_trait_text", "products_trait_image")
+    )
+    return f"""
+        DELETE FROM {INFORMATION_TABLE} AS pin
+        USING integration_changed AS chg
+        WHERE pin.prd_id = chg.prd_id
+            AND ({exists});
+    """
+
+
+def integrate_traits(db_conn, stage="trait_information", full=False, lookback=600.0):
+    """
+    Refresh products_trait_information for the products whose raw row or
+    traits changed since the last integration, in one transaction. Each
+    product gets one row joining its canonical text and image traits
+    (canonical_traits_query); stale rows are deleted and current rows
+    upserted on prd_id, so rerunning it (or overlapping runs) never
+    duplicates rows.
+    The watermark is the start time of the transaction; changes are looked
+    up from lookback seconds before it, so rows committed by writers whose
+    transactions started before the previous integration are not missed.
+    Args:
+        db_conn: psycopg2 connection
+        stage (str): Watermark key
+        full (bool): Ignore the watermark and refresh every product
+        lookback (float): Overlap in seconds with the previous integration
+    Returns:
+        dict: {
+            "status": True/False,
+            "return": message,
+            "products": Products refreshed,
+            "deleted": Rows deleted,
+            "upserted": Rows inserted or updated,
+            "since": Watermark the changes were taken from (None for a full run)
+        }
+    """
+    result = {"status": False, "return": "", "products": 0, "deleted": 0, "upserted": 0, "since": None}
+    started = time.perf_counter()
+    try:
+        with db_conn.cursor() as db_cur:
+            since = None
+            if not full:
+                db_cur.execute(
+                    f"SELECT watermark - make_interval(secs => %s) FROM {WATERMARK_TABLE} WHERE stage = %s;",
+                    (lookback, stage))
+                row = db_cur.fetchone()
+                since = row[0] if row else None
+            db_cur.execute(
+                f"CREATE TEMP TABLE integration_changed ON COMMIT DROP AS {changed_products_query(since)};",
+                {"since": since})
+            result["products"] = db_cur.rowcount
+            db_cur.execute("ALTER TABLE integration_changed ADD PRIMARY KEY (prd_id);")
+            db_cur.execute("ANALYZE integration_changed;")
+
+            db_cur.execute(_delete_stale_query())
+            result["deleted"] = db_cur.rowcount
+            db_cur.execute(_upsert_query())
+            result["upserted"] = db_cur.rowcount
+
+            db_cur.execute(f"""
+                INSERT INTO {WATERMARK_TABLE} (stage, watermark)
+                VALUES (%s, now())
+                ON CONFLICT (stage) DO UPDATE SET watermark = EXCLUDED.watermark;
+            """, (stage,))
+        db_conn.commit()
+    except Exception as e:
+        db_conn.rollback()
+        result["return"] = f"Integration failed\n{str(e)}"
+        return result
+    INTEGRATION_SECONDS.observe(time.perf_counter() - started)
+    INTEGRATED_ROWS.inc(result["deleted"], op="deleted")
+    INTEGRATED_ROWS.inc(result["upserted"], op="upserted")
+    result["status"] = True
+    result["since"] = since
+    result["return"] = (
+        f"Integrated {result['products']} products "
+        f"(changed since {since.isoformat() if since else 'the beginning'}): "
+        f"{result['upserted']} rows upserted, {result['deleted']} deleted"
+    )
+    return result
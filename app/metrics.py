@@ -0,0 +1,338 @@
+"""
+Process-wide metrics in the Prometheus text format, without dependencies.
+
+Modules declare their metrics once at import time and update them inline:
+
+    LLM_SECONDS = metrics.histogram("llm_request_seconds", "LLM request latency", ["source"])
+    with LLM_SECONDS.time(source="image"):
+        ...
+
+A script calls start_metrics() to expose them on an HTTP endpoint for
+Prometheus to scrape and/or to append periodic snapshots to a JSON-lines
+file, and optionally to trace spans (per product) to a second JSON-lines file.
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _label_text(labelnames, key, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Returns:
+            list: (suffix, label text, value) tuples in exposition order
+        """
+        with self._lock:
+            return [("", _label_text(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {"labels": dict(zip(self.labelnames, key)), "value": value}
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count (requests, rows, retries, cache hits).
+    """
+    kind = "counter"
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down (queue depth, requests in flight).
+    """
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (latencies in seconds), kept as
+    cumulative bucket counts plus sum and count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[n] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                samples.append(("_bucket", _label_text(self.labelnames, key, f'le="{_format_value(bound)}"'), count))
+            samples.append(("_sum", _label_text(self.labelnames, key), total))
+            samples.append(("_count", _label_text(self.labelnames, key), counts[-1]))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "count": counts[-1],
+                    "sum": total,
+                    "buckets": {_format_value(bound): count for bound, count in zip(self.buckets, counts)},
+                }
+                for key, (counts, total) in sorted(self._values.items())
+            ]
+
+
+class Registry:
+    """
+    Named collection of metrics. Declaring a metric that already exists
+    returns the existing one, so modules can be imported more than once.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: metric name -> {"type", "samples"}, JSON serializable
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {"type": metric.kind, "samples": metric.snapshot()} for metric in metrics}
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+SPAN_SECONDS = histogram("span_seconds", "Duration of traced spans", ["span"])
+
+_tracer = None
+
+
+class _Tracer:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time a unit of work (e.g. one product in one stage). The duration is
+    always added to span_seconds{span=name}; when tracing is on, the span
+    is also written as one JSON line with its attributes (e.g. prd_id).
+        with span("recognize_image", prd_id=prd_id):
+            ...
+    """
+    started = time.perf_counter()
+    wall = time.time()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        SPAN_SECONDS.observe(seconds, span=name)
+        tracer = _tracer
+        if tracer is not None:
+            record = {"span": name, "start": wall, "seconds": seconds, **attrs}
+            if error is not None:
+                record["error"] = error
+            tracer.write(record)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the script output
+
+
+class MetricsExporter:
+    """
+    Background exporters started by start_metrics; close() writes a final
+    snapshot and stops them.
+    """
+
+    def __init__(self, port=None, jsonl_path=None, interval=15.0, trace_path=None):
+        global _tracer
+        self.jsonl_path = jsonl_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+        if port is not None:
+            self._server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+            self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        if jsonl_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+            self._threads.append(threading.Thread(target=self._write_loop, daemon=True))
+        if trace_path is not None:
+            _tracer = _Tracer(trace_path)
+        for thread in self._threads:
+            thread.start()
+
+    def write_snapshot(self):
+        record = {"ts": time.time(), "metrics": REGISTRY.snapshot()}
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self.write_snapshot()
+
+    def close(self):
+        global _tracer
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.jsonl_path is not None:
+            self.write_snapshot()
+        if _tracer is not None:
+            _tracer.close()
+            _tracer = None
+
+
+def start_metrics(port=None, jsonl_path=None, interval=15.0, trace_path=None):
+    """
+    Start exporting the metrics of this process.
+    Args:
+        port (int): Serve /metrics for Prometheus on this port (None disables)
+        jsonl_path (str): Append a snapshot of all metrics every interval seconds (None disables)
+        interval (float): Seconds between JSON-lines snapshots
+        trace_path (str): Write every span as a JSON line (None disables tracing)
+    Returns:
+        MetricsExporter: Call close() at the end of the run
+    """
+    return MetricsExporter(port=port, jsonl_path=jsonl_path, interval=interval, trace_path=trace_path)
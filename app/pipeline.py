@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+from app import metrics
+
+
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+STAGE_ITEMS = metrics.counter("pipeline_items_total", "Items per pipeline stage", ["stage", "event"])
+STAGE_SECONDS = metrics.histogram("pipeline_call_seconds", "Duration of one stage call (item or batch)", ["stage"])
+QUEUE_DEPTH = metrics.gauge("pipeline_queue_depth", "Items waiting in a stage's input queue", ["stage"])
+
+
+class StageStats:
+    """
+    Item counts and busy time of one pipeline stage.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.emitted = 0
+        self.failed = 0
+        self.busy = 0.0
+
+    def report(self, name, queue, concurrency, elapsed):
+        busy = self.busy / (elapsed * concurrency) if elapsed > 0 else 0.0
+        return (
+            f"{name:>10s}: in {self.received}, out {self.emitted}, failed {self.failed}, "
+            f"queue {queue.qsize()}/{queue.maxsize}, busy {busy:.0%}"
+        )
+
+
+class Stage:
+    """
+    One step of a streaming pipeline. concurrency workers pull items from a
+    bounded input queue and call fn; whatever fn returns is passed to the
+    next stage. A full queue blocks the stage feeding it (backpressure).
+
+    fn is a coroutine function called with one item, or with a list of up
+    to batch_size items when batch_size is set (collected for at most
+    max_wait seconds). It returns an iterable of output items, or None to
+    drop the input.
+    """
+
+    def __init__(self, name, fn, concurrency=1, batch_size=None, max_wait=1.0, queue_size=None):
+        """
+        Args:
+            name (str): Stage name used in reports
+            fn (coroutine function): Stage work, see above
+            concurrency (int): Number of workers
+            batch_size (int): Items per call (None calls fn per item)
+            max_wait (float): Seconds a partial batch waits for more items
+            queue_size (int): Input queue capacity (default: 2 calls worth of items per worker)
+        """
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue_size = queue_size or concurrency * (batch_size or 1) * 2
+        self.stats = StageStats()
+
+    async def _next_batch(self, queue):
+        # Returns (items, done); done means the end-of-stream marker was seen
+        item = await queue.get()
+        if item is _DONE:
+            return [], True
+        if self.batch_size is None:
+            return [item], False
+        items = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is _DONE:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _span_attrs(self, items):
+        # Per-item calls are traced per product, batches by their size
+        if self.batch_size is None and isinstance(items[0], dict) and "prd_id" in items[0]:
+            return {"prd_id": items[0]["prd_id"]}
+        return {"items": len(items)}
+
+    async def _worker(self, queue, downstream):
+        while True:
+            items, done = await self._next_batch(queue)
+            QUEUE_DEPTH.set(queue.qsize(), stage=self.name)
+            if items:
+                self.stats.received += len(items)
+                STAGE_ITEMS.inc(len(items), stage=self.name, event="received")
+                started = time.perf_counter()
+                try:
+                    with metrics.span(self.name, **self._span_attrs(items)):
+                        outputs = await self.fn(items if self.batch_size is not None else items[0])
+                except Exception as e:
+                    outputs = None
+                    self.stats.failed += len(items)
+                    STAGE_ITEMS.inc(len(items), stage=self.name, event="failed")
+                    print(f"Stage {self.name} failed on {len(items)} item(s): {e}")
+                elapsed = time.perf_counter() - started
+                self.stats.busy += elapsed
+                STAGE_SECONDS.observe(elapsed, stage=self.name)
+                for output in outputs or []:
+                    self.stats.emitted += 1
+                    STAGE_ITEMS.inc(stage=self.name, event="emitted")
+                    if downstream is not None:
+                        await downstream.put(output)
+            if done:
+                # Hand the marker on to the sibling workers
+                await queue.put(_DONE)
+                return
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues. Items flow through as soon
+    as each stage is done with them, so all stages work at the same time.
+
+        pipeline = Pipeline([Stage("download", download, 16), Stage("embed", embed, batch_size=64)])
+        await pipeline.run(products)
+    """
+
+    def __init__(self, stages, report_interval=30.0):
+        """
+        Args:
+            stages (list): Stage objects, in order
+            report_interval (float): Seconds between progress reports (0 disables)
+        """
+        self.stages = stages
+        self.report_interval = report_interval
+
+    def report(self, queues, started):
+        elapsed = time.perf_counter() - started
+        return "\n".join(
+            stage.stats.report(stage.name, queue, stage.concurrency, elapsed)
+            for stage, queue in zip(self.stages, queues)
+        )
+
+    async def run(self, source):
+        """
+        Feed the source through all stages and wait until everything has drained.
+        Args:
+            source (iterable or async iterable): Input items of the first stage
+        Returns:
+            dict: stage name -> StageStats
+        """
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        started = time.perf_counter()
+
+        async def feed():
+            if hasattr(source, "__aiter__"):
+                async for item in source:
+                    await queues[0].put(item)
+            else:
+                for item in source:
+                    await queues[0].put(item)
+            await queues[0].put(_DONE)
+
+        async def run_stage(n, stage):
+            downstream = queues[n + 1] if n + 1 < len(queues) else None
+            await asyncio.gather(*[stage._worker(queues[n], downstream) for _ in range(stage.concurrency)])
+            queues[n].get_nowait()  # the marker put back by the last worker
+            if downstream is not None:
+                await downstream.put(_DONE)
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(self.report_interval)
+                print(self.report(queues, started))
+
+        ticker = asyncio.create_task(reporter()) if self.report_interval else None
+        try:
+            await asyncio.gather(feed(), *[run_stage(n, stage) for n, stage in enumerate(self.stages)])
+        finally:
+            if ticker is not None:
+                ticker.cancel()
+        print(self.report(queues, started))
+        print(f"Pipeline finished in {time.perf_counter() - started:.1f}s")
+        return {stage.name: stage.stats for stage in self.stages}
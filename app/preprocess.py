@@ -1,10 +1,23 @@
+import asyncio
 import base64
 import json
-import re
+import time
 from openai import OpenAI
 from openai import AsyncOpenAI
 import asyncpg
 
+from app import metrics
+from app.cache import llm_cache_key
+from app.traits import TRAIT_KEYS, answer_objects, extract_traits, normalize_trait
+
+LLM_REQUESTS = metrics.counter(
+    "llm_requests_total", "LLM recognition calls by outcome (ok, invalid, error, cached)", ["source", "outcome"])
+LLM_SECONDS = metrics.histogram("llm_request_seconds", "Latency of LLM chat completions", ["source"])
+LLM_TOKENS = metrics.counter("llm_tokens_total", "Tokens reported by the LLM server", ["source"])
+LLM_REREQUESTS = metrics.counter(
+    "llm_batch_rerequests_total", "Product names re-requested individually after a batched request")
+
+
 def encode_image(image_path):
     """
     Load an image file and encode it to base64.
@@ -13,31 +26,96 @@ def encode_image(image_path):
     Returns:
         byte: Base64 encoded image data.
     """
+    return base64.b64encode(read_image(image_path)).decode("utf-8")
+
+
+def read_image(image_path):
+    """
+    Load the raw bytes of an image file.
+    Args:
+        image_path (str): Path to the image file.
+    Returns:
+        bytes: Image content.
+    """
     with open(image_path, "rb") as img_file:
-        image_encoded = base64.b64encode(img_file.read()).decode("utf-8")
-    return image_encoded
+        return img_file.read()
+
 
+def text_prompt(text_query):
+    """
+    Returns:
+        str: User prompt asking for the traits of one product name
+    """
+    return f'What can you tell me about "{text_query}" ?'
 
-def extract_json(text):
+
+def batch_text_prompt(text_queries):
     """
-    Extract JSON objects from a text string.
+    Build one user prompt asking for the traits of several product names.
+    The answer is a JSON array with an "index" key per object, so the
+    objects can be mapped back to the names even when some are left out.
     Args:
-        text (str): Input text containing JSON objects.
+        text_queries (list): Product names
+    Returns:
+        str: User prompt
+    """
+    names = "\n".join(f'{n}. "{text_query}"' for n, text_query in enumerate(text_queries, start=1))
+    return (
+        f"What can you tell me about each of these {len(text_queries)} products?\n"
+        f"{names}\n"
+        "Respond with one json array holding one json object per product, in the same order. "
+        'Each object starts with an "index" key set to the product number, '
+        f"followed by the keys {', '.join(TRAIT_KEYS)}."
+    )
+
+
+def trait_response_format(indexed=False):
+    """
+    Structured-output response format constraining the answer to
+    {"products": [trait, ...]}, for servers that support json_schema
+    (OpenAI, Ollama >= 0.5, vLLM).
+    Args:
+        indexed (bool): Require an integer "index" key per product (batched requests)
+    Returns:
+        dict: response_format argument of chat.completions.create
+    """
+    keys = (["index"] if indexed else []) + TRAIT_KEYS
+    item = {
+        "type": "object",
+        "properties": {key: {"type": "integer" if key == "index" else "string"} for key in keys},
+        "required": keys,
+        "additionalProperties": False,
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "product_traits",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"products": {"type": "array", "items": item}},
+                "required": ["products"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def usage_tokens(response):
+    """
     Returns:
-        list: A list of extracted JSON objects.
+        int: Prompt + completion tokens of a chat completion (0 when the server does not report usage)
     """
-    matches = re.findall(r'\{.*?\}', text, re.DOTALL)
-    json_objects = []
-    for match in matches:
-        try:
-            obj = json.loads(match)
-            json_objects.append(obj)
-        except json.JSONDecodeError:
-            continue
-    return json_objects
+    usage = getattr(response, "usage", None)
+    return (getattr(usage, "total_tokens", None) or 0) if usage is not None else 0
+
 
+def _observe_completion(source, started, response):
+    LLM_SECONDS.observe(time.perf_counter() - started, source=source)
+    LLM_TOKENS.inc(usage_tokens(response), source=source)
 
-def recognize_image(service_url, service_key, service_llm, service_temperature, service_role, img_path):
+
+def recognize_image(service_url, service_key, service_llm, service_temperature, service_role, img_path, cache=None, image_payload=None, structured_output=False):
     """
     Recognizes the content of an image using a language model.
     Args:
@@ -47,6 +125,9 @@ def recognize_image(service_url, service_key, service_llm, service_temperature,
         service_role (str): System role description for the LLM
         service_temperature (float): Temperature setting for the LLM
         img_path (str): Path to the image file
+        cache (DiskCache): Response cache (disabled when None)
+        image_payload (str): Prepared base64 image (see app.imageprep), sent instead of img_path
+        structured_output (bool): Constrain the answer with trait_response_format (json_schema)
     Returns:
         status (boolean): Status of the operation (True/False)
         return (list): Extracted JSON content or error message
@@ -71,11 +152,24 @@ def recognize_image(service_url, service_key, service_llm, service_temperature,
             ]
     """
     try:
+        # The cache is keyed by what is sent, so prepared and original images do not mix
+        image_bytes = image_payload if image_payload is not None else read_image(img_path)
+        prompt = "What can you tell me about this image?"
+        cache_key = None
+        if cache is not None:
+            cache_key = llm_cache_key(
+                service_llm, service_temperature, service_role, prompt, image_bytes)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                prd_descs = extract_traits(cached.decode("utf-8"))
+                if prd_descs:
+                    LLM_REQUESTS.inc(source="image", outcome="cached")
+                    return {"status": True, "return": prd_descs}
         client = OpenAI(
             base_url=service_url,
             api_key=service_key,
         )
-        encoded_image = encode_image(img_path)
+        encoded_image = image_payload if image_payload is not None else base64.b64encode(image_bytes).decode("utf-8")
         messages = [
             {
                 "role": "system",
@@ -93,7 +187,7 @@ def recognize_image(service_url, service_key, service_llm, service_temperature,
                     [
                         {
                             "type": "text",
-                            "text": "What can you tell me about this image?"
+                            "text": prompt
                         },
                         {
                             "type": "image_url",
@@ -102,18 +196,31 @@ def recognize_image(service_url, service_key, service_llm, service_temperature,
                     ],
             }
         ]
+        started = time.perf_counter()
         response = client.chat.completions.create(
             model=service_llm,
             messages=messages,
             temperature=service_temperature,
+            **({"response_format": trait_response_format()} if structured_output else {}),
         )
-        return {"status": True, "return": extract_json(response.choices[0].message.content)}
+        _observe_completion("image", started, response)
+        content = response.choices[0].message.content
+        prd_descs = extract_traits(content)
+        if not prd_descs:
+            # Not cached and reported as a failure, so the request is retried
+            LLM_REQUESTS.inc(source="image", outcome="invalid")
+            return {"status": False, "return": f"No valid trait object in answer: {content[:200]!r}"}
+        if cache is not None:
+            cache.put(cache_key, content.encode("utf-8"))
+        LLM_REQUESTS.inc(source="image", outcome="ok")
+        return {"status": True, "return": prd_descs}
     except Exception as e:
         print(f"Error: {e}")
+        LLM_REQUESTS.inc(source="image", outcome="error")
         return {"status": False, "return": str(e)}
 
 
-def recognize_text(service_url, service_key, service_llm, service_temperature, service_role, text_query):
+def recognize_text(service_url, service_key, service_llm, service_temperature, service_role, text_query, cache=None, structured_output=False):
     """
     Recognizes the content of an text using a language model.
     Args:
@@ -122,6 +229,9 @@ def recognize_text(service_url, service_key, service_llm, service_temperature, s
         service_llm (str): Name of the language model
         service_role (str): System role description for the LLM
         service_temperature (float): Temperature setting for the LLM
+        text_query (str): Product name to describe
+        cache (DiskCache): Response cache (disabled when None)
+        structured_output (bool): Constrain the answer with trait_response_format (json_schema)
     Returns:
         status (boolean): Status of the operation (True/False)
         return (list): Extracted JSON content or error message
@@ -146,6 +256,16 @@ def recognize_text(service_url, service_key, service_llm, service_temperature, s
             ]
     """
     try:
+        prompt = f'What can you tell me about "{text_query}" ?'
+        cache_key = None
+        if cache is not None:
+            cache_key = llm_cache_key(service_llm, service_temperature, service_role, prompt)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                prd_descs = extract_traits(cached.decode("utf-8"))
+                if prd_descs:
+                    LLM_REQUESTS.inc(source="text", outcome="cached")
+                    return {"status": True, "return": prd_descs}
         client = OpenAI(
             base_url=service_url,
             api_key=service_key,
@@ -167,23 +287,36 @@ def recognize_text(service_url, service_key, service_llm, service_temperature, s
                     [
                         {
                             "type": "text",
-                            "text": f'What can you tell me about "{text_query}" ?'
+                            "text": prompt
                         }
                     ],
             }
         ]
+        started = time.perf_counter()
         response = client.chat.completions.create(
             model=service_llm,
             messages=messages,
             temperature=service_temperature,
+            **({"response_format": trait_response_format()} if structured_output else {}),
         )
-        return {"status": True, "return": extract_json(response.choices[0].message.content)}
+        _observe_completion("text", started, response)
+        content = response.choices[0].message.content
+        prd_descs = extract_traits(content)
+        if not prd_descs:
+            # Not cached and reported as a failure, so the request is retried
+            LLM_REQUESTS.inc(source="text", outcome="invalid")
+            return {"status": False, "return": f"No valid trait object in answer: {content[:200]!r}"}
+        if cache is not None:
+            cache.put(cache_key, content.encode("utf-8"))
+        LLM_REQUESTS.inc(source="text", outcome="ok")
+        return {"status": True, "return": prd_descs}
     except Exception as e:
         print(f"Error: {e}")
+        LLM_REQUESTS.inc(source="text", outcome="error")
         return {"status": False, "return": str(e)}
 
 
-async def recognize_text_async(service_url, service_key, service_llm, service_temperature, service_role, text_query):
+async def recognize_text_async(service_url, service_key, service_llm, service_temperature, service_role, text_query, client=None, cache=None, structured_output=False):
     """
     Asynchronously recognizes the content of a text using a language model.
     Args:
@@ -192,17 +325,130 @@ async def recognize_text_async(service_url, service_key, service_llm, service_te
         service_llm (str): Name of the language model
         service_role (str): System role description for the LLM
         service_temperature (float): Temperature setting for the LLM
+        text_query (str): Product name to describe
+        client (AsyncOpenAI): Shared client to reuse (a new one is created when None)
+        cache (DiskCache): Response cache (disabled when None)
+        structured_output (bool): Constrain the answer with trait_response_format (json_schema)
     Returns:
         dict: {
             "status": True/False,
-            "return": Extracted JSON content or error message
+            "return": Extracted JSON content or error message,
+            "tokens": Tokens used by the request (0 on a cache hit),
+            "requests": Chat completions sent (0 on a cache hit)
         }
     """
     try:
-        client = AsyncOpenAI(
-            base_url=service_url,
-            api_key=service_key,
+        prompt = text_prompt(text_query)
+        cache_key = None
+        if cache is not None:
+            cache_key = llm_cache_key(service_llm, service_temperature, service_role, prompt)
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                prd_descs = extract_traits(cached.decode("utf-8"))
+                if prd_descs:
+                    LLM_REQUESTS.inc(source="text", outcome="cached")
+                    return {"status": True, "return": prd_descs, "tokens": 0, "requests": 0}
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=service_url,
+                api_key=service_key,
+            )
+        messages = [
+            {
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": service_role
+                    }
+                ],
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ],
+            }
+        ]
+        started = time.perf_counter()
+        response = await client.chat.completions.create(
+            model=service_llm,
+            messages=messages,
+            temperature=service_temperature,
+            **({"response_format": trait_response_format()} if structured_output else {}),
         )
+        _observe_completion("text", started, response)
+        content = response.choices[0].message.content
+        prd_descs = extract_traits(content)
+        if not prd_descs:
+            # Not cached and reported as a failure, so the request is retried
+            LLM_REQUESTS.inc(source="text", outcome="invalid")
+            return {"status": False, "return": f"No valid trait object in answer: {content[:200]!r}",
+                    "tokens": usage_tokens(response), "requests": 1}
+        if cache is not None:
+            await asyncio.to_thread(cache.put, cache_key, content.encode("utf-8"))
+        LLM_REQUESTS.inc(source="text", outcome="ok")
+        return {"status": True, "return": prd_descs, "tokens": usage_tokens(response), "requests": 1}
+    except Exception as e:
+        print(f"Error: {e}")
+        LLM_REQUESTS.inc(source="text", outcome="error")
+        return {"status": False, "return": str(e)}
+
+
+async def recognize_text_batch_async(service_url, service_key, service_llm, service_temperature, service_role, text_queries, client=None, cache=None, structured_output=False):
+    """
+    Asynchronously recognizes several product names with one chat completion,
+    so the system role is sent once per batch instead of once per product.
+    Answers are cached per product name under the same key as
+    recognize_text_async, so both paths share the cache.
+    Args:
+        service_url (str): URL for LLM service
+        service_key (str): API key for LLM service
+        service_llm (str): Name of the language model
+        service_role (str): System role description for the LLM
+        service_temperature (float): Temperature setting for the LLM
+        text_queries (list): Product names to describe
+        client (AsyncOpenAI): Shared client to reuse (a new one is created when None)
+        cache (DiskCache): Response cache (disabled when None)
+        structured_output (bool): Constrain the answer with trait_response_format (json_schema)
+    Returns:
+        dict: {
+            "status": True/False,
+            "return": One entry per product name, a list with its trait dict or None when
+                      the answer is missing or invalid (error message when status is False),
+            "tokens": Tokens used by the request (0 when every name was cached),
+            "requests": Chat completions sent (0 when every name was cached)
+        }
+    """
+    try:
+        prd_descs = [None] * len(text_queries)
+        cache_keys = [None] * len(text_queries)
+        found = {}
+        if cache is not None:
+            cache_keys = [
+                llm_cache_key(service_llm, service_temperature, service_role, text_prompt(text_query))
+                for text_query in text_queries
+            ]
+            # SQLite lookups run off the event loop
+            found = await asyncio.to_thread(cache.get_many, cache_keys)
+        pending = []
+        for n in range(len(text_queries)):
+            cached = found.get(cache_keys[n])
+            prd_descs[n] = (extract_traits(cached.decode("utf-8")) if cached is not None else None) or None
+            if prd_descs[n]:
+                LLM_REQUESTS.inc(source="text", outcome="cached")
+                continue
+            pending.append(n)
+        if not pending:
+            return {"status": True, "return": prd_descs, "tokens": 0, "requests": 0}
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=service_url,
+                api_key=service_key,
+            )
         messages = [
             {
                 "role": "system",
@@ -218,23 +464,91 @@ async def recognize_text_async(service_url, service_key, service_llm, service_te
                 "content": [
                     {
                         "type": "text",
-                        "text": f'What can you tell me about "{text_query}" ?'
+                        "text": batch_text_prompt([text_queries[n] for n in pending])
                     }
                 ],
             }
         ]
+        started = time.perf_counter()
         response = await client.chat.completions.create(
             model=service_llm,
             messages=messages,
             temperature=service_temperature,
+            **({"response_format": trait_response_format(indexed=True)} if structured_output else {}),
         )
-        return {"status": True, "return": extract_json(response.choices[0].message.content)}
+        _observe_completion("text_batch", started, response)
+        new_entries = []
+        for obj in answer_objects(response.choices[0].message.content):
+            try:
+                index = int(obj.get("index"))
+            except (TypeError, ValueError):
+                continue
+            trait = normalize_trait(obj)
+            if not 1 <= index <= len(pending) or trait is None:
+                continue
+            n = pending[index - 1]
+            if prd_descs[n] is not None:
+                continue  # first answer for a product wins
+            prd_descs[n] = [trait]
+            if cache is not None:
+                new_entries.append((cache_keys[n], json.dumps(prd_descs[n], ensure_ascii=False).encode("utf-8")))
+        if new_entries:
+            await asyncio.to_thread(cache.put_many, new_entries)
+        LLM_REQUESTS.inc(source="text_batch", outcome="ok")
+        return {"status": True, "return": prd_descs, "tokens": usage_tokens(response), "requests": 1}
     except Exception as e:
         print(f"Error: {e}")
+        LLM_REQUESTS.inc(source="text_batch", outcome="error")
         return {"status": False, "return": str(e)}
 
 
-async def recognize_image_async(service_url, service_key, service_llm, service_temperature, service_role, img_path):
+async def recognize_text_batched_async(service_url, service_key, service_llm, service_temperature, service_role, text_queries, client=None, cache=None, structured_output=False):
+    """
+    Recognizes product names batch-wise with recognize_text_batch_async and
+    re-requests the names without a valid answer individually.
+    Args:
+        Same as recognize_text_batch_async
+    Returns:
+        dict: {
+            "status": True/False,
+            "return": One {"status", "return"} result per product name, as returned by recognize_text_async,
+            "tokens": Tokens used by the batch request and the re-requests,
+            "requests": Number of chat completions sent,
+            "rerequested": Number of names re-requested on their own
+        }
+    """
+    service = {
+        "service_url": service_url,
+        "service_key": service_key,
+        "service_llm": service_llm,
+        "service_temperature": service_temperature,
+        "service_role": service_role,
+        "client": client,
+        "cache": cache,
+        "structured_output": structured_output,
+    }
+    result_batch = await recognize_text_batch_async(text_queries=text_queries, **service)
+    tokens = result_batch.get("tokens", 0)
+    prd_descs = result_batch.get("return") if result_batch.get("status") else [None] * len(text_queries)
+    missing = [n for n, prd_desc in enumerate(prd_descs) if not prd_desc]
+    LLM_REREQUESTS.inc(len(missing))
+    retried = await asyncio.gather(*[
+        recognize_text_async(text_query=text_queries[n], **service) for n in missing
+    ])
+    results = [{"status": True, "return": prd_desc} for prd_desc in prd_descs]
+    for n, result in zip(missing, retried):
+        results[n] = result
+        tokens += result.get("tokens", 0)
+    return {
+        "status": all(result.get("status") for result in results),
+        "return": results,
+        "tokens": tokens,
+        "requests": result_batch.get("requests", 1) + sum(result.get("requests", 1) for result in retried),
+        "rerequested": len(missing),
+    }
+
+
+async def recognize_image_async(service_url, service_key, service_llm, service_temperature, service_role, img_path, client=None, cache=None, image_payload=None, structured_output=False):
     """
     Asynchronously recognizes the content of an image using a language model.
     Args:
@@ -244,6 +558,10 @@ async def recognize_image_async(service_url, service_key, service_llm, service_t
         service_role (str): System role description for the LLM
         service_temperature (float): Temperature setting for the LLM
         img_path (str): Path to the image file
+        client (AsyncOpenAI): Shared client to reuse (a new one is created when None)
+        cache (DiskCache): Response cache (disabled when None)
+        image_payload (str): Prepared base64 image (see app.imageprep), sent instead of img_path
+        structured_output (bool): Constrain the answer with trait_response_format (json_schema)
     Returns:
         dict: {
             "status": True/False,
@@ -251,11 +569,25 @@ async def recognize_image_async(service_url, service_key, service_llm, service_t
         }
     """
     try:
-        client = AsyncOpenAI(
-            base_url=service_url,
-            api_key=service_key,
-        )
-        encoded_image = encode_image(img_path)
+        # The cache is keyed by what is sent, so prepared and original images do not mix
+        image_bytes = image_payload if image_payload is not None else read_image(img_path)
+        prompt = "What can you tell me about this image?"
+        cache_key = None
+        if cache is not None:
+            cache_key = llm_cache_key(
+                service_llm, service_temperature, service_role, prompt, image_bytes)
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                prd_descs = extract_traits(cached.decode("utf-8"))
+                if prd_descs:
+                    LLM_REQUESTS.inc(source="image", outcome="cached")
+                    return {"status": True, "return": prd_descs}
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=service_url,
+                api_key=service_key,
+            )
+        encoded_image = image_payload if image_payload is not None else base64.b64encode(image_bytes).decode("utf-8")
         messages = [
             {
                 "role": "system",
@@ -266,20 +598,33 @@ async def recognize_image_async(service_url, service_key, service_llm, service_t
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": "What can you tell me about this image?"},
+                    {"type": "text", "text": prompt},
                     {"type": "image_url", "image_url": {
                         "url": f"data:image/jpeg;base64,{encoded_image}"}}
                 ],
             }
         ]
+        started = time.perf_counter()
         response = await client.chat.completions.create(
             model=service_llm,
             messages=messages,
             temperature=service_temperature,
+            **({"response_format": trait_response_format()} if structured_output else {}),
         )
-        return {"status": True, "return": extract_json(response.choices[0].message.content)}
+        _observe_completion("image", started, response)
+        content = response.choices[0].message.content
+        prd_descs = extract_traits(content)
+        if not prd_descs:
+            # Not cached and reported as a failure, so the request is retried
+            LLM_REQUESTS.inc(source="image", outcome="invalid")
+            return {"status": False, "return": f"No valid trait object in answer: {content[:200]!r}"}
+        if cache is not None:
+            await asyncio.to_thread(cache.put, cache_key, content.encode("utf-8"))
+        LLM_REQUESTS.inc(source="image", outcome="ok")
+        return {"status": True, "return": prd_descs}
     except Exception as e:
         print(f"Error: {e}")
+        LLM_REQUESTS.inc(source="image", outcome="error")
         return {"status": False, "return": str(e)}
 
 
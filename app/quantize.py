@@ -0,0 +1,95 @@
+import numpy as np
+
+
+# Storage dtype of each precision; bytes per dimension are 4, 2 and 1
+PRECISIONS = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "int8": np.int8,
+}
+
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def truncate_embeddings(embeddings, dim):
+    """
+    Matryoshka-style truncation: keep the first dim components and
+    re-normalize. Qwen3-Embedding is trained so that prefixes of the vector
+    (32 to 1024 dims) remain usable embeddings on their own.
+    Args:
+        embeddings (ndarray): (n, full_dim) matrix
+        dim (int): Dimensions kept (None or full_dim keeps all)
+    Returns:
+        ndarray: Normalized float32 (n, dim) matrix
+    """
+    embeddings = np.asarray(embeddings)
+    if dim is not None and dim > embeddings.shape[1]:
+        raise ValueError(f"Cannot truncate {embeddings.shape[1]}-dim embeddings to {dim} dims")
+    return _normalize(embeddings[:, :dim])
+
+
+def quantize_embeddings(embeddings, precision):
+    """
+    Normalize and store embeddings in reduced precision.
+    int8 uses symmetric per-vector scaling (max |component| -> 127). The
+    scale is not stored: cosine similarity does not depend on the length of
+    a vector, so dequantize_embeddings only has to re-normalize.
+    Args:
+        embeddings (ndarray): (n, dim) matrix
+        precision (str): float32, float16 or int8
+    Returns:
+        ndarray: (n, dim) matrix of the precision's dtype
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    embeddings = _normalize(embeddings)
+    if precision == "int8":
+        scale = 127.0 / np.maximum(np.abs(embeddings).max(axis=1, keepdims=True), 1e-12)
+        return np.rint(embeddings * scale).astype(np.int8)
+    return embeddings.astype(PRECISIONS[precision])
+
+
+def dequantize_embeddings(embeddings):
+    """
+    Args:
+        embeddings (ndarray): Matrix returned by quantize_embeddings
+    Returns:
+        ndarray: Normalized float32 matrix
+    """
+    return _normalize(embeddings)
+
+
+def precision_of(embeddings):
+    """
+    Returns:
+        str: Precision name of a stored matrix
+    """
+    for precision, dtype in PRECISIONS.items():
+        if embeddings.dtype == dtype:
+            return precision
+    raise ValueError(f"Unsupported embedding dtype: {embeddings.dtype}")
+
+
+def cosine_scores(queries, embeddings, chunk_size=16384):
+    """
+    Cosine similarity of queries against a (possibly quantized) matrix,
+    dequantizing chunk_size rows at a time so the full matrix is never held
+    in float32.
+    Args:
+        queries (ndarray): (n_queries, dim) matrix
+        embeddings (ndarray): (n_rows, dim) matrix of any PRECISIONS dtype
+        chunk_size (int): Rows dequantized at once
+    Returns:
+        ndarray: float32 (n_queries, n_rows) similarity matrix
+    """
+    queries = _normalize(queries)
+    if embeddings.dtype == np.float32:
+        return queries @ embeddings.T
+    scores = np.empty((len(queries), len(embeddings)), dtype=np.float32)
+    for i in range(0, len(embeddings), chunk_size):
+        scores[:, i:i + chunk_size] = queries @ dequantize_embeddings(embeddings[i:i + chunk_size]).T
+    return scores
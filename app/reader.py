@@ -0,0 +1,110 @@
+import itertools
+
+import pandas as pd
+
+from app import metrics
+
+
+ROWS_READ = metrics.counter("db_rows_read_total", "Rows streamed from Postgres", ["driver"])
+
+_cursor_names = itertools.count(1)
+
+
+def _fetch_batches(db_conn, query, params, fetch_size):
+    # WITH HOLD keeps the cursor open across the caller's commits on the same connection
+    db_cur = db_conn.cursor(name=f"stream_{next(_cursor_names)}", withhold=True)
+    try:
+        db_cur.itersize = fetch_size
+        db_cur.execute(query, params)
+        while True:
+            rows = db_cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            ROWS_READ.inc(len(rows), driver="psycopg2")
+            yield db_cur.description, rows
+    finally:
+        db_cur.close()
+        # End the reading transaction, so no snapshot is left open on the connection
+        if not db_conn.closed:
+            db_conn.commit()
+
+
+def stream_rows(db_conn, query, params=None, fetch_size=10_000):
+    """
+    Stream the result of a query in batches through a server-side (named)
+    cursor, so only fetch_size rows are held in memory at a time instead of
+    the whole result. The caller may keep committing writes on the same
+    connection while reading; the connection is committed when the stream ends.
+        for rows in stream_rows(db_conn, query, fetch_size=5_000):
+            ...
+    Args:
+        db_conn: psycopg2 connection
+        query (str): SELECT statement
+        params (tuple): Query parameters
+        fetch_size (int): Rows per round trip and per yielded batch
+    Yields:
+        list: Row tuples, at most fetch_size of them
+    """
+    for _, rows in _fetch_batches(db_conn, query, params, fetch_size):
+        yield rows
+
+
+def stream_frames(db_conn, query, params=None, chunk_size=50_000):
+    """
+    Stream the result of a query as DataFrames of at most chunk_size rows.
+    Args:
+        db_conn: psycopg2 connection
+        query (str): SELECT statement
+        params (tuple): Query parameters
+        chunk_size (int): Rows per DataFrame
+    Yields:
+        DataFrame: Chunk of the result with the query's column names
+    """
+    for description, rows in _fetch_batches(db_conn, query, params, chunk_size):
+        yield pd.DataFrame(rows, columns=[_[0] for _ in description])
+
+
+async def stream_records(pool, query, *args, fetch_size=1_000):
+    """
+    Stream the result of a query record by record through an asyncpg cursor,
+    fetching fetch_size records per round trip. The cursor holds one pool
+    connection (and its read-only transaction) until the stream is exhausted.
+        async for record in stream_records(pool, query):
+            ...
+    Args:
+        pool (asyncpg.Pool): Connection pool
+        query (str): SELECT statement
+        *args: Query parameters
+        fetch_size (int): Records per round trip
+    Yields:
+        asyncpg.Record: One row of the result
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            cursor = await conn.cursor(query, *args)
+            while True:
+                records = await cursor.fetch(fetch_size)
+                if not records:
+                    break
+                ROWS_READ.inc(len(records), driver="asyncpg")
+                for record in records:
+                    yield record
+
+
+async def abatched(records, size):
+    """
+    Group an async stream into lists of at most size items.
+    Args:
+        records (async iterable): e.g. stream_records(...)
+        size (int): Items per batch
+    Yields:
+        list: Consecutive items of the stream
+    """
+    batch = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
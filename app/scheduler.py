@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from app import metrics
+
+
+RETRIES = metrics.counter("scheduler_retries_total", "Retried worker attempts")
+TIMEOUTS = metrics.counter("scheduler_timeouts_total", "Worker attempts that timed out")
+IN_FLIGHT = metrics.gauge("scheduler_in_flight", "Worker calls in flight")
+ITEM_SECONDS = metrics.histogram("scheduler_item_seconds", "Time per item, retries included")
+SLOT_WAITING = metrics.gauge("limiter_waiting", "Requests waiting for a limiter slot", ["priority"])
+
+
+def percentile(values, q):
+    """
+    Compute a percentile with linear interpolation.
+    Args:
+        values (list): Numeric samples
+        q (float): Percentile in the range [0, 100]
+    Returns:
+        float: Percentile value (0.0 when there are no samples)
+    """
+    return percentiles(values, [q])[0]
+
+
+def percentiles(values, qs):
+    """
+    Compute several percentiles with a single sort.
+    Args:
+        values (iterable): Numeric samples
+        qs (list): Percentiles in the range [0, 100]
+    Returns:
+        list: Percentile values in the order of qs (0.0 when there are no samples)
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return [0.0] * len(qs)
+    result = []
+    for q in qs:
+        pos = (len(ordered) - 1) * q / 100.0
+        lower = int(pos)
+        upper = min(lower + 1, len(ordered) - 1)
+        result.append(ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower))
+    return result
+
+
+class RunStats:
+    """
+    Throughput and latency statistics of a scheduler run. Latency
+    percentiles are taken over the most recent `history` items, so memory
+    and report cost stay constant however long the run is.
+    """
+
+    def __init__(self, total, history=10_000):
+        self.total = total
+        self.done = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=history)
+        self.started = time.perf_counter()
+
+    def record(self, latency, status):
+        self.done += 1
+        self.latencies.append(latency)
+        if status:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    def summary(self):
+        """
+        Returns:
+            dict: Processed counts, products/sec and p50/p95 latency in seconds
+                (of the most recent items)
+        """
+        elapsed = time.perf_counter() - self.started
+        p50, p95 = percentiles(self.latencies, [50, 95])
+        return {
+            "total": self.total,
+            "done": self.done,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "elapsed": elapsed,
+            "rate": self.done / elapsed if elapsed > 0 else 0.0,
+            "p50": p50,
+            "p95": p95,
+        }
+
+    def report(self):
+        s = self.summary()
+        return (
+            f"Processed {s['done']}/{s['total'] if s['total'] is not None else '?'} "
+            f"(ok {s['succeeded']}, failed {s['failed']}, retries {s['retries']}) "
+            f"{s['rate']:.2f} products/sec, "
+            f"p50 {s['p50']:.2f}s, p95 {s['p95']:.2f}s"
+        )
+
+
+class PriorityLimiter:
+    """
+    Concurrency budget shared by several kinds of requests. When the budget
+    is used up, waiting requests are admitted lowest priority value first
+    (first come, first served within a priority).
+
+        limiter = PriorityLimiter(8)
+        async with limiter.slot(priority=0):
+            ...
+    """
+
+    def __init__(self, limit):
+        """
+        Args:
+            limit (int): Maximum number of requests holding a slot
+        """
+        self.limit = limit
+        self.in_use = 0
+        self.admitted = {}
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority=0):
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._order), future))
+            SLOT_WAITING.inc(priority=priority)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just before the cancellation
+                    self.release()
+                raise
+            finally:
+                SLOT_WAITING.dec(priority=priority)
+        self.admitted[priority] = self.admitted.get(priority, 0) + 1
+
+    def release(self):
+        # Hand the slot straight to the next waiter, so it cannot be taken out of order
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority=0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def waiting(self):
+        return sum(not future.done() for _, _, future in self._waiters)
+
+
+async def call_with_retry(worker, item, timeout, retries, backoff, stats):
+    """
+    Call a worker with a per-attempt timeout and exponential backoff.
+    The worker is expected to return {"status": bool, "return": ...};
+    a False status, an exception or a timeout all count as a failed attempt.
+    """
+    result = {"status": False, "return": "not started"}
+    for attempt in range(retries + 1):
+        if attempt:
+            stats.retries += 1
+            RETRIES.inc()
+            delay = backoff * (2 ** (attempt - 1))
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+        try:
+            result = await asyncio.wait_for(worker(item), timeout=timeout)
+        except asyncio.TimeoutError:
+            TIMEOUTS.inc()
+            result = {"status": False, "return": f"Timed out after {timeout}s"}
+        except Exception as e:
+            result = {"status": False, "return": str(e)}
+        if result.get("status"):
+            break
+    return result
+
+
+async def run_bounded(items, worker, on_result=None, max_concurrency=8, timeout=120.0,
+                      retries=3, backoff=2.0, report_every=100):
+    """
+    Run an async worker over items with a bounded number of requests in flight.
+    A fixed number of consumers pull from a queue, so memory stays constant
+    no matter how many items there are. Items may be an async iterable (e.g.
+    app.reader.stream_records), which is only read as fast as it is consumed.
+    Args:
+        items (iterable): Work items (e.g. database rows), sync or async
+        worker (coroutine function): Called as worker(item), returns {"status", "return"}
+        on_result (coroutine function): Called as on_result(item, result) after each item
+        max_concurrency (int): Maximum number of in-flight worker calls
+        timeout (float): Timeout in seconds for a single attempt
+        retries (int): Number of retries after the first failed attempt
+        backoff (float): Base delay in seconds for exponential backoff
+        report_every (int): Print a progress line every n items (0 disables)
+    Returns:
+        RunStats: Throughput and latency statistics of the run
+    """
+    # A stream's length is unknown until it is exhausted
+    stats = RunStats(total=len(items) if hasattr(items, "__len__") else None)
+    queue = asyncio.Queue(maxsize=max_concurrency * 2)
+
+    async def producer():
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        for _ in range(max_concurrency):
+            await queue.put(None)
+
+    async def consumer():
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            started = time.perf_counter()
+            IN_FLIGHT.inc()
+            try:
+                result = await call_with_retry(worker, item, timeout, retries, backoff, stats)
+            finally:
+                IN_FLIGHT.dec()
+            ITEM_SECONDS.observe(time.perf_counter() - started)
+            stats.record(time.perf_counter() - started, result.get("status"))
+            if on_result is not None:
+                await on_result(item, result)
+            if report_every and stats.done % report_every == 0:
+                print(stats.report())
+
+    await asyncio.gather(producer(), *[consumer() for _ in range(max_concurrency)])
+    if not report_every or stats.done % report_every:
+        print(stats.report())
+    return stats
@@ -0,0 +1,317 @@
+"""
+Similar-products query service: the embedding model and the vector store
+stay loaded, and answers are served over HTTP as JSON.
+
+    GET /similar?prd_id=P123&tag=product_name&k=10&category=티셔츠
+    GET /similar?prd_id=P123&same_category=1
+    GET /similar?text=오버핏 반팔 티셔츠&k=20
+    GET /health
+    GET /metrics
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from app import metrics
+from app.batcher import EmbeddingBatcher
+from app.embedding import search_similar_products
+from app.encoder import embedding_cache_key
+from app.quantize import truncate_embeddings
+
+
+REQUESTS = metrics.counter("service_requests_total", "Similar-products queries", ["kind", "status"])
+REQUEST_SECONDS = metrics.histogram(
+    "service_request_seconds", "Similar-products query latency", ["kind"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+CACHE_LOOKUPS = metrics.counter("cache_lookups_total", "Disk cache lookups", ["cache", "result"])
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with hit/miss counters.
+    """
+
+    def __init__(self, name, max_entries=10_000):
+        """
+        Args:
+            name (str): Cache label in cache_lookups_total
+            max_entries (int): Least recently used entries are evicted beyond this size
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SimilarProducts:
+    """
+    Answers "what is similar to product X / to this text" from a vector store
+    written by 05, with LRU caches of query embeddings and of results.
+    """
+
+    def __init__(self, store, model, model_name, instruct, prompt_template, tags,
+                 result_cache=10_000, embedding_cache=10_000, default_k=10, max_k=100,
+                 max_batch=32, max_wait=0.005):
+        """
+        Args:
+            store: Vector store (app.vectorstore) holding the product embeddings
+            model (SentenceTransformer): Loaded embedding model (None disables text queries)
+            model_name (str): Embedding model name (part of the embedding cache key)
+            instruct (str): Instruction the products were embedded with
+            prompt_template (str): Template formatted with (instruct, text)
+            tags (list): Searchable prd_tags, the first one is the default
+            result_cache (int): Results kept in the LRU cache
+            embedding_cache (int): Query embeddings kept in the LRU cache
+            default_k (int): Results per query when k is not given
+            max_k (int): Largest k accepted
+            max_batch (int): Most text queries embedded in one model call
+            max_wait (float): Seconds a text query waits for others to share its batch
+        """
+        self.store = store
+        self.model = model
+        # Concurrent text queries are coalesced into one model call
+        self.encoder = EmbeddingBatcher(model, max_batch, max_wait, name="service") if model is not None else None
+        self.model_name = model_name
+        self.instruct = instruct
+        self.prompt_template = prompt_template
+        self.tags = list(tags)
+        self.default_k = default_k
+        self.max_k = max_k
+        self.results = LRUCache("service_results", result_cache)
+        self.embeddings = LRUCache("service_embeddings", embedding_cache)
+        # The local stores build their per-tag/category views and indexes lazily:
+        # the first search of a (tag, category) is serialized, later ones run
+        # concurrently (the service never writes to the store)
+        self._build_lock = threading.Lock() if not hasattr(store, "collection") else None
+        self._built = set()
+
+    def warm(self):
+        """
+        Build the unfiltered index of every tag and run the model once, so
+        the first queries do not pay for it.
+        """
+        dummy = np.full((1, self.store.dim), self.store.dim ** -0.5, dtype=np.float32)
+        for prd_tag in self.tags:
+            self._search(prd_tag, dummy, 1, None)
+        with self._lock(None):
+            self.store.lookup(self.tags[0], [])
+        if self.model is not None:
+            self._embed_text("warm up")
+
+    def _lock(self, key):
+        if self._build_lock is None or key in self._built:
+            return nullcontext()
+        return self._build_lock
+
+    def _search(self, prd_tag, queries, k, category, prd_id=None):
+        key = (prd_tag, category)
+        with self._lock(key):
+            # The query product itself is skipped by search_similar_products
+            hits = list(search_similar_products(
+                self.store, [prd_id], queries, prd_tag, top_k=k, category=category, batch_size=1))
+            self._built.add(key)
+        return hits
+
+    def _embed_text(self, text):
+        key = embedding_cache_key(self.model_name, self.instruct, self.prompt_template, text)
+        embedding = self.embeddings.get(key)
+        if embedding is None:
+            embedding = self.encoder.encode([self.prompt_template.format(self.instruct, text)])
+            # Products may be stored truncated (Matryoshka), queries must match
+            embedding = truncate_embeddings(np.asarray(embedding, dtype=np.float32), self.store.dim)
+            self.embeddings.put(key, embedding)
+        return embedding
+
+    def query(self, prd_id=None, text=None, prd_tag=None, k=None, category=None, same_category=False):
+        """
+        Find the products most similar to a product or to a free text.
+        Args:
+            prd_id (str): Query product (its own vector of prd_tag is the query)
+            text (str): Free-text query, embedded like the products
+            prd_tag (str): Tag searched (default: the first of tags)
+            k (int): Number of results
+            category (str): Only return products of this category
+            same_category (bool): Only return products of the query product's category
+        Returns:
+            dict: {
+                "status": True/False,
+                "return": [{"rank", "prd_id", "similarity"}] or error message,
+                "cached": True when the result came from the LRU cache
+            }
+        """
+        prd_tag = prd_tag or self.tags[0]
+        k = self.default_k if k is None else k
+        if (prd_id is None) == (text is None):
+            return {"status": False, "return": "Give exactly one of prd_id or text", "cached": False}
+        if prd_tag not in self.tags:
+            return {"status": False, "return": f"Unknown tag {prd_tag}, expected one of {self.tags}", "cached": False}
+        if not 1 <= k <= self.max_k:
+            return {"status": False, "return": f"k must be between 1 and {self.max_k}", "cached": False}
+        if text is not None and self.model is None:
+            return {"status": False, "return": "Text queries are disabled (no model loaded)", "cached": False}
+
+        key = (prd_id, text, prd_tag, k, category, bool(same_category))
+        cached = self.results.get(key)
+        if cached is not None:
+            return {"status": True, "return": cached, "cached": True}
+
+        if prd_id is not None:
+            found = self.store.lookup(prd_tag, [prd_id]).get(prd_id)
+            if found is None:
+                return {"status": False, "return": f"Unknown product {prd_id} for tag {prd_tag}", "cached": False}
+            prd_category, embedding = found
+            queries = np.asarray(embedding)[None, :]
+            if same_category:
+                category = prd_category
+        else:
+            queries = self._embed_text(text)
+
+        hits = self._search(prd_tag, queries, k, category, prd_id)
+        results = [
+            {"rank": rank, "prd_id": similar_prd_id, "similarity": round(float(similarity), 6)}
+            for _, rank, similar_prd_id, similarity in hits
+        ]
+        self.results.put(key, results)
+        return {"status": True, "return": results, "cached": False}
+
+    def invalidate(self):
+        self.results.clear()
+
+    def stats(self):
+        stats = {"results": self.results.stats(), "embeddings": self.embeddings.stats()}
+        if self.encoder is not None:
+            stats["encoder"] = self.encoder.summary()
+        return stats
+
+    def close(self):
+        if self.encoder is not None:
+            self.encoder.close()
+
+
+def _first(params, name, cast=str):
+    values = params.get(name)
+    if not values or values[0] == "":
+        return None
+    return cast(values[0])
+
+
+def _handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, so clients do not reconnect per query
+        disable_nagle_algorithm = True  # headers and body are separate writes, Nagle would hold the body ~40 ms
+
+        def _send(self, code, body, content_type="application/json; charset=utf-8"):
+            payload = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._send(200, {"status": "ok", "cache": service.stats()})
+                return
+            if url.path == "/metrics":
+                self._send(200, metrics.REGISTRY.render().encode("utf-8"),
+                           "text/plain; version=0.0.4; charset=utf-8")
+                return
+            if url.path != "/similar":
+                self._send(404, {"error": f"Unknown path {url.path}"})
+                return
+
+            started = time.perf_counter()
+            params = parse_qs(url.query)
+            try:
+                query = {
+                    "prd_id": _first(params, "prd_id"),
+                    "text": _first(params, "text"),
+                    "prd_tag": _first(params, "tag"),
+                    "k": _first(params, "k", int),
+                    "category": _first(params, "category"),
+                    "same_category": _first(params, "same_category") in ("1", "true", "yes"),
+                }
+            except ValueError as e:
+                self._send(400, {"error": str(e)})
+                return
+            kind = "text" if query["text"] is not None else "prd_id"
+            try:
+                result = service.query(**query)
+            except Exception as e:
+                REQUESTS.inc(kind=kind, status="error")
+                self._send(500, {"error": str(e)})
+                return
+            elapsed = time.perf_counter() - started
+            REQUEST_SECONDS.observe(elapsed, kind=kind)
+            REQUESTS.inc(kind=kind, status="ok" if result.get("status") else "rejected")
+            if not result.get("status"):
+                self._send(400, {"error": result.get("return")})
+                return
+            self._send(200, {
+                "query": {key: value for key, value in query.items() if value not in (None, False)},
+                "results": result.get("return"),
+                "cached": result.get("cached"),
+                "ms": round(elapsed * 1000, 3),
+            })
+
+        def log_message(self, format, *args):
+            pass  # one line per query would dominate the latency under load
+
+    return Handler
+
+
+def serve(service, host="0.0.0.0", port=8080):
+    """
+    Serve the similar-products API until interrupted.
+    Args:
+        service (SimilarProducts): Loaded service
+        host (str): Interface to listen on
+        port (int): Port to listen on
+    Returns:
+        ThreadingHTTPServer: The server, already serving in a background thread
+    """
+    server = ThreadingHTTPServer((host, port), _handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,113 @@
+"""
+Parsing of LLM trait answers: JSON objects are recovered from free text
+(markdown fences, prose, trailing commas, structured output) and validated
+as trait records. No client dependencies, so it can be used and tested on
+its own.
+"""
+import json
+import re
+
+
+TRAIT_KEYS = ["category1", "category2", "color", "style", "material", "occasion"]
+# Answers meaning "not sure", compared lowercased
+UNKNOWN_VALUES = {"", "unknown", "unk", "n/a", "na", "none", "null", "-", "?", "알 수 없음", "알수없음", "모름", "불명", "미상"}
+
+_JSON_START = re.compile(r"[\[{]")
+_JSON_DECODER = json.JSONDecoder()
+
+
+def normalize_trait(prd_desc):
+    """
+    Validate a recognized trait object and normalize its values: every trait
+    key must be present, a one-element list is unwrapped, and empty or
+    "unknown"-like values (null, "N/A", "알 수 없음", ...) become "unknown".
+    Args:
+        prd_desc (dict): Object parsed from an LLM answer
+    Returns:
+        dict: The six trait keys with string values, or None when the object is not a valid trait
+    """
+    if not isinstance(prd_desc, dict):
+        return None
+    trait = {}
+    for key in TRAIT_KEYS:
+        if key not in prd_desc:
+            return None
+        value = prd_desc[key]
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value is None:
+            value = "unknown"
+        if isinstance(value, (dict, list, bool)):
+            return None
+        value = str(value).strip()
+        trait[key] = "unknown" if value.lower() in UNKNOWN_VALUES else value
+    return trait
+
+
+def valid_trait(prd_desc):
+    """
+    Returns:
+        bool: True when the object is a valid trait (see normalize_trait)
+    """
+    return normalize_trait(prd_desc) is not None
+
+
+def extract_json(text):
+    """
+    Extract JSON objects from a text string in one pass. At every "{" or "["
+    a whole JSON value is decoded, nested braces included; objects are kept
+    and arrays contribute the objects they hold. A fragment that does not
+    decode (e.g. an array with a trailing comma) is skipped one character at
+    a time, so the objects inside it are still found.
+    Args:
+        text (str): Input text containing JSON objects.
+    Returns:
+        list: A list of extracted JSON objects.
+    """
+    json_objects = []
+    match = _JSON_START.search(text)
+    while match:
+        try:
+            obj, end = _JSON_DECODER.raw_decode(text, match.start())
+        except json.JSONDecodeError:
+            match = _JSON_START.search(text, match.start() + 1)
+            continue
+        if isinstance(obj, dict):
+            json_objects.append(obj)
+        elif isinstance(obj, list):
+            json_objects.extend(item for item in obj if isinstance(item, dict))
+        match = _JSON_START.search(text, end)
+    return json_objects
+
+
+def answer_objects(text):
+    """
+    Iterate over the JSON objects of an LLM answer, unwrapping structured
+    answers ({"products": [...]}) into their product objects.
+    Args:
+        text (str): LLM answer
+    Returns:
+        iterator: Dicts, not yet validated (see normalize_trait)
+    """
+    for obj in extract_json(text):
+        if isinstance(obj.get("products"), list):
+            yield from (item for item in obj["products"] if isinstance(item, dict))
+        else:
+            yield obj
+
+
+def extract_traits(text):
+    """
+    Extract the valid, normalized trait objects of an LLM answer, plain
+    text or structured output alike.
+    Args:
+        text (str): LLM answer
+    Returns:
+        list: Trait dicts (see normalize_trait)
+    """
+    traits = []
+    for obj in answer_objects(text):
+        trait = normalize_trait(obj)
+        if trait is not None:
+            traits.append(trait)
+    return traits
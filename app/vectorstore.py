@@ -0,0 +1,333 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.embedding import (
+    open_embedding_collection, collection_precision, get_collection_state, export_embeddings,
+    get_embeddings, delete_embeddings, rebuild_embedding_index, embedding_key)
+from app.quantize import quantize_embeddings, dequantize_embeddings, precision_of, cosine_scores
+
+
+ROW_COLUMNS = ["id", "prd_id", "category", "prd_text", "prd_tag", "text_hash"]
+
+# Default location / index settings of each backend; numpy and faiss share the
+# same files, so vectors written by one can be searched with the other
+STORE_CONFIG = {
+    "milvus": {
+        "uri": "./milvus_db/product_similarity.db",
+        "collection_name": "product_embedding",
+        "search_params": {"nprobe": 16},
+    },
+    "numpy": {
+        "path": "./vector_store",
+    },
+    "faiss": {
+        "path": "./vector_store",
+        "index_factory": "HNSW32",          # or e.g. "IVF1024,PQ64" for a compressed index
+        "search_params": "efSearch=128",    # or e.g. "nprobe=32" for IVF indexes
+    },
+}
+BACKENDS = list(STORE_CONFIG)
+
+
+class MilvusStore:
+    """
+    Vector store backed by the Milvus Lite product_embedding collection.
+    """
+
+    def __init__(self, collection, search_params=None):
+        """
+        Args:
+            collection: Loaded Milvus collection
+            search_params (dict): Index search parameters (default {"nprobe": 16})
+        """
+        self.collection = collection
+        self.search_params = search_params or {"nprobe": 16}
+        self.precision = collection_precision(collection)
+        self.dim = next(_ for _ in collection.schema.fields if _.name == "embedding").params.get("dim")
+
+    @classmethod
+    def open(cls, uri, collection_name="product_embedding", dim=None, rebuild=False, search_params=None,
+             precision=None):
+        """
+        Args:
+            uri (str): Milvus Lite database file
+            collection_name (str): Collection name
+            dim (int): Embedding dimension (None: as stored)
+            rebuild (bool): Drop the existing collection first
+            search_params (dict): Index search parameters
+            precision (str): float32, float16 or int8 (None: as stored)
+        """
+        from pymilvus import connections
+        os.makedirs(os.path.dirname(os.path.abspath(uri)), exist_ok=True)
+        connections.connect("default", uri=uri)
+        collection = open_embedding_collection(collection_name, dim=dim, rebuild=rebuild, precision=precision)
+        return cls(collection, search_params)
+
+    def _vectors(self, embeddings):
+        # int8 is quantized by the IVF_SQ8 index, so only float16 changes the payload
+        dtype = np.float16 if self.precision == "float16" else np.float32
+        return dequantize_embeddings(embeddings).astype(dtype)
+
+    def state(self):
+        return get_collection_state(self.collection)
+
+    def upsert(self, rows, embeddings):
+        self.collection.upsert([rows[col].tolist() for col in ROW_COLUMNS] + [self._vectors(embeddings)])
+
+    def delete(self, ids):
+        delete_embeddings(self.collection, list(ids))
+
+    def commit(self):
+        self.collection.flush()
+
+    def reindex(self):
+        rebuild_embedding_index(self.collection, self.precision)
+
+    def export(self, prd_tag, categories=False):
+        return export_embeddings(self.collection, prd_tag, categories=categories)
+
+    def lookup(self, prd_tag, prd_ids):
+        rows, embeddings = get_embeddings(self.collection, [embedding_key(prd_tag, _) for _ in prd_ids])
+        return {row['prd_id']: (row['category'], embeddings[i]) for i, row in enumerate(rows)}
+
+    def search(self, prd_tag, queries, k, category=None):
+        expr = f'prd_tag == "{prd_tag}"'
+        if category is not None:
+            expr += f' and category == "{category}"'
+        result = self.collection.search(
+            data=self._vectors(queries),
+            anns_field="embedding",
+            param={"metric_type": "COSINE", "params": self.search_params},
+            expr=expr,
+            output_fields=["prd_id"],
+            limit=k
+        )
+        return [[(hit.get('entity').get('prd_id'), hit.get('distance')) for hit in hits] for hits in result]
+
+
+class NumpyStore:
+    """
+    Exact (brute-force) vector store kept in memory as one normalized matrix
+    (float32, float16 or int8, see app.quantize) and persisted to a directory
+    as embeddings.npy + rows.pkl.
+    """
+
+    def __init__(self, path, dim=None, rebuild=False, precision=None):
+        """
+        Args:
+            path (str): Directory holding the store files
+            dim (int): Embedding dimension (None: as stored, 1024 for a new store)
+            rebuild (bool): Start from an empty store
+            precision (str): float32, float16 or int8 (None: as stored, float32 for a new store)
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        if not rebuild and os.path.exists(self._file("rows.pkl")):
+            self.rows = pd.read_pickle(self._file("rows.pkl"))
+            self.embeddings = np.load(self._file("embeddings.npy"))
+            stored = (self.embeddings.shape[1], precision_of(self.embeddings))
+            wanted = (dim or stored[0], precision or stored[1])
+            if wanted != stored:
+                raise RuntimeError(
+                    f"Vector store {path} holds {stored[0]}-dim {stored[1]} vectors, "
+                    f"rerun with --rebuild to store {wanted[0]}-dim {wanted[1]} vectors")
+            self.dim, self.precision = stored
+        else:
+            self.dim, self.precision = dim or 1024, precision or "float32"
+            self.rows = pd.DataFrame(columns=ROW_COLUMNS)
+            self.embeddings = quantize_embeddings(np.zeros((0, self.dim), dtype=np.float32), self.precision)
+        self._pending = []
+        self._views = {}
+        self._positions = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _materialize(self):
+        # Upserts are appended lazily, so batched writes do not copy the matrix each time
+        if not self._pending:
+            return
+        rows = pd.concat([self.rows] + [r for r, _ in self._pending], ignore_index=True)
+        embeddings = np.concatenate([self.embeddings] + [e for _, e in self._pending])
+        keep = ~rows['id'].duplicated(keep='last').to_numpy()
+        self.rows = rows[keep].reset_index(drop=True)
+        self.embeddings = embeddings[keep]
+        self._pending = []
+        self._invalidate()
+
+    def _invalidate(self):
+        # Views, indexes and positions are rebuilt from the current rows on next use
+        self._views = {}
+        self._positions = None
+
+    def state(self):
+        self._materialize()
+        return dict(zip(self.rows['id'], zip(self.rows['text_hash'], self.rows['category'])))
+
+    def upsert(self, rows, embeddings):
+        self._pending.append(
+            (rows[ROW_COLUMNS].reset_index(drop=True), quantize_embeddings(embeddings, self.precision)))
+        # Searches after an upsert see the new rows, as with Milvus
+        self._invalidate()
+
+    def delete(self, ids):
+        self._materialize()
+        keep = ~self.rows['id'].isin(set(ids)).to_numpy()
+        self.rows = self.rows[keep].reset_index(drop=True)
+        self.embeddings = self.embeddings[keep]
+        self._invalidate()
+
+    def commit(self):
+        self._materialize()
+        np.save(self._file("embeddings.tmp.npy"), self.embeddings)
+        self.rows.to_pickle(self._file("rows.tmp.pkl"))
+        os.replace(self._file("embeddings.tmp.npy"), self._file("embeddings.npy"))
+        os.replace(self._file("rows.tmp.pkl"), self._file("rows.pkl"))
+
+    def reindex(self):
+        self._views = {}
+
+    def export(self, prd_tag, categories=False):
+        self._materialize()
+        mask = (self.rows['prd_tag'] == prd_tag).to_numpy()
+        if categories:
+            return self.rows['prd_id'][mask].tolist(), self.embeddings[mask], self.rows['category'][mask].tolist()
+        return self.rows['prd_id'][mask].tolist(), self.embeddings[mask]
+
+    def lookup(self, prd_tag, prd_ids):
+        self._materialize()
+        if self._positions is None:
+            self._positions = dict(zip(self.rows['id'], range(len(self.rows))))
+        found = {}
+        for prd_id in prd_ids:
+            row = self._positions.get(embedding_key(prd_tag, prd_id))
+            if row is not None:
+                found[prd_id] = (self.rows['category'].iat[row], self.embeddings[row])
+        return found
+
+    def _view(self, prd_tag, category):
+        key = (prd_tag, category)
+        if key not in self._views:
+            self._materialize()
+            mask = (self.rows['prd_tag'] == prd_tag).to_numpy()
+            if category is not None:
+                mask = mask & (self.rows['category'] == category).to_numpy()
+            self._views[key] = (self.rows['prd_id'][mask].to_numpy(), self.embeddings[mask])
+        return self._views[key]
+
+    def search(self, prd_tag, queries, k, category=None):
+        prd_ids, embeddings = self._view(prd_tag, category)
+        if not len(prd_ids):
+            return [[] for _ in range(len(queries))]
+        sims = cosine_scores(queries, embeddings)
+        k = min(k, len(prd_ids))
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        return [
+            [(prd_ids[j], float(s)) for j, s in zip(row, row_sims)]
+            for row, row_sims in zip(top, top_sims)
+        ]
+
+
+class FaissStore(NumpyStore):
+    """
+    Approximate vector store: vectors are kept and persisted like NumpyStore,
+    and searched through a faiss index (e.g. "HNSW32" or "IVF1024,PQ64")
+    built lazily per (prd_tag, category).
+    """
+
+    # Scalar quantizer appended to a bare HNSW / IVF factory string, so the
+    # index holds vectors in the same precision as the store
+    SCALAR_QUANTIZERS = {"float16": "SQfp16", "int8": "SQ8"}
+
+    def __init__(self, path, dim=None, rebuild=False, precision=None, index_factory="HNSW32",
+                 search_params="efSearch=128", train_size=100_000):
+        """
+        Args:
+            path (str): Directory holding the store files
+            dim (int): Embedding dimension (None: as stored)
+            rebuild (bool): Start from an empty store
+            precision (str): float32, float16 or int8 (None: as stored)
+            index_factory (str): faiss index factory string
+            search_params (str): faiss ParameterSpace string, e.g. "efSearch=128" or "nprobe=16"
+            train_size (int): Maximum number of vectors used to train IVF/PQ indexes
+        """
+        import faiss
+        self._faiss = faiss
+        super().__init__(path, dim=dim, rebuild=rebuild, precision=precision)
+        encoding = self.SCALAR_QUANTIZERS.get(self.precision)
+        if encoding and index_factory.startswith("HNSW") and "," not in index_factory:
+            index_factory = f"{index_factory},{encoding}"
+        elif encoding and index_factory.startswith("IVF") and index_factory.endswith(",Flat"):
+            index_factory = f"{index_factory[:-len(',Flat')]},{encoding}"
+        self.index_factory = index_factory
+        self.search_params = search_params
+        self.train_size = train_size
+        self._indexes = {}
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._indexes = {}
+
+    def reindex(self):
+        super().reindex()
+        self._indexes = {}
+
+    def build_index(self, prd_tag, category=None):
+        """
+        Build (or return the cached) faiss index of a tag/category.
+        Returns:
+            tuple: (prd_ids, faiss index)
+        """
+        key = (prd_tag, category)
+        if key in self._indexes and self._views.get(key) is not None:
+            return self._indexes[key]
+        prd_ids, embeddings = self._view(prd_tag, category)
+        index = self._faiss.index_factory(self.dim, self.index_factory, self._faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            sample = embeddings
+            if len(sample) > self.train_size:
+                rows = np.random.default_rng(0).choice(len(sample), self.train_size, replace=False)
+                sample = sample[rows]
+            index.train(dequantize_embeddings(sample))
+        for i in range(0, len(embeddings), 65536):
+            index.add(dequantize_embeddings(embeddings[i:i + 65536]))
+        if self.search_params:
+            self._faiss.ParameterSpace().set_index_parameters(index, self.search_params)
+        self._indexes[key] = (prd_ids, index)
+        return self._indexes[key]
+
+    def search(self, prd_tag, queries, k, category=None):
+        prd_ids, index = self.build_index(prd_tag, category)
+        if not len(prd_ids):
+            return [[] for _ in range(len(queries))]
+        sims, rows = index.search(dequantize_embeddings(queries), min(k, len(prd_ids)))
+        return [
+            [(prd_ids[j], float(s)) for j, s in zip(row, row_sims) if j >= 0]
+            for row, row_sims in zip(rows, sims)
+        ]
+
+
+def open_vector_store(backend, rebuild=False, **config):
+    """
+    Open a vector store backend.
+    Args:
+        backend (str): "milvus", "numpy" (exact) or "faiss" (HNSW / IVF-PQ)
+        rebuild (bool): Start from an empty store
+        **config: Options overriding STORE_CONFIG[backend] (uri / path, dim, index settings)
+    Returns:
+        Vector store with state, upsert, delete, commit, reindex, export, lookup and search
+    """
+    config = {**STORE_CONFIG.get(backend, {}), **config}
+    if backend == "milvus":
+        return MilvusStore.open(rebuild=rebuild, **config)
+    if backend == "numpy":
+        return NumpyStore(rebuild=rebuild, **config)
+    if backend == "faiss":
+        return FaissStore(rebuild=rebuild, **config)
+    raise ValueError(f"Unknown vector store backend: {backend}")
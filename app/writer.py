@@ -0,0 +1,264 @@
+import asyncio
+import time
+from contextlib import suppress
+
+import psycopg2.extras
+
+from app import metrics
+from app.incremental import status_record, status_upsert_query
+
+
+TRAIT_SCHEMA = "product_similarity"
+TRAIT_TABLES = {
+    "image": "products_trait_image",
+    "text": "products_trait_text",
+}
+TRAIT_COLUMNS = ["category1", "category2", "color", "style", "material", "occasion", "prd_id", "trait_seq"]
+
+DB_WRITE_SECONDS = metrics.histogram("db_write_seconds", "Latency of bulk writes to Postgres", ["table"])
+DB_ROWS_WRITTEN = metrics.counter("db_rows_written_total", "Rows written to Postgres", ["table"])
+DB_WRITE_ERRORS = metrics.counter("db_write_errors_total", "Failed bulk writes to Postgres", ["table"])
+PRODUCTS_RECORDED = metrics.counter(
+    "products_recorded_total", "Products recorded in the status table", ["source", "status"])
+
+
+def trait_record(prd_id, prd_desc, trait_seq=0):
+    """
+    Convert a recognized trait dict into a row tuple ordered as TRAIT_COLUMNS.
+    Args:
+        prd_id (str): Product ID
+        prd_desc (dict): Product description containing traits
+        trait_seq (int): Position of the trait dict in the answer, (prd_id, trait_seq) is the row's key
+    Returns:
+        tuple: Row values
+    """
+    return (
+        prd_desc.get("category1"),
+        prd_desc.get("category2"),
+        prd_desc.get("color"),
+        prd_desc.get("style"),
+        prd_desc.get("material"),
+        prd_desc.get("occasion"),
+        prd_id,
+        trait_seq,
+    )
+
+
+def failed_statuses(statuses, error):
+    """
+    Mark the products of a batch whose write failed as "failed", so an
+    incremental rerun picks them up again. Products that already failed keep
+    their own error.
+    Args:
+        statuses (list): Status tuples built by status_record
+        error (str): Error of the failed write
+    Returns:
+        list: Status tuples
+    """
+    return [
+        status_record(prd_id, "failed", error if status == "done" else prd_error)
+        for prd_id, status, prd_error in statuses
+    ]
+
+
+def insert_product_traits(db_cur, source, records, statuses=None):
+    """
+    Inserts a batch of product trait rows with a single commit.
+    When per-product statuses are given, earlier trait rows of the products
+    marked "done" are replaced and the statuses are recorded in the same
+    transaction, so the status table doubles as the run checkpoint.
+    Args:
+        db_cur: Database cursor
+        source (str): Trait source, "image" or "text"
+        records (list): Row tuples built by trait_record
+        statuses (list): Status tuples built by status_record
+    Returns:
+        dict: status and message
+    """
+    statuses = statuses or []
+    if not records and not statuses:
+        return {"status": True, "return": "Nothing to insert"}
+    try:
+        done_ids = [prd_id for prd_id, status, _ in statuses if status == "done"]
+        if done_ids:
+            db_cur.execute(
+                f"DELETE FROM {TRAIT_SCHEMA}.{TRAIT_TABLES[source]} WHERE prd_id = ANY(%s);",
+                (done_ids,)
+            )
+        if records:
+            query = f"""
+                INSERT INTO {TRAIT_SCHEMA}.{TRAIT_TABLES[source]}
+                ({", ".join(TRAIT_COLUMNS)})
+                VALUES %s;
+            """
+            psycopg2.extras.execute_values(db_cur, query, records, page_size=1000)
+        if statuses:
+            psycopg2.extras.execute_values(
+                db_cur,
+                status_upsert_query(),
+                [(prd_id, source, status, error) for prd_id, status, error in statuses],
+                page_size=1000
+            )
+        db_cur.connection.commit()
+        return {"status": True, "return": f"Insert successful : {len(records)} rows"}
+    except Exception as e:
+        db_cur.connection.rollback()
+        return {"status": False, "return": f"Insert failed : {len(records)} rows\n{str(e)}"}
+
+
+class TraitWriter:
+    """
+    Buffers recognized traits and writes them in bulk through an asyncpg pool.
+    The buffer is flushed with COPY when it reaches flush_rows rows or when
+    flush_interval seconds have passed since the last flush. Every flush also
+    replaces earlier traits of the flushed products and records their status.
+
+        async with TraitWriter(pool, "image") as writer:
+            await writer.add(prd_id, prd_descs)
+            await writer.fail(other_prd_id, error)
+    """
+
+    def __init__(self, pool, source, flush_rows=500, flush_interval=5.0):
+        """
+        Args:
+            pool (asyncpg.Pool): Shared connection pool
+            source (str): Trait source, "image" or "text"
+            flush_rows (int): Flush once this many rows are buffered
+            flush_interval (float): Flush at least every n seconds while rows are buffered
+        """
+        self.pool = pool
+        self.source = source
+        self.table = TRAIT_TABLES[source]
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.failed_flushes = 0
+        self._buffer = []
+        self._statuses = []
+        self._lock = asyncio.Lock()
+        self._last_flush = time.monotonic()
+        self._ticker = None
+
+    async def __aenter__(self):
+        self._ticker = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._statuses and time.monotonic() - self._last_flush >= self.flush_interval:
+                result = await self.flush()
+                if not result.get("status"):
+                    print(result.get("return"))
+
+    async def add(self, prd_id, prd_descs):
+        """
+        Buffer the traits of one product, flushing when the buffer is full.
+        Args:
+            prd_id (str): Product ID
+            prd_descs (list): Trait dicts recognized for the product
+        Returns:
+            dict: status and message of the flush, if one was triggered
+        """
+        self._buffer.extend(trait_record(prd_id, prd_desc, seq) for seq, prd_desc in enumerate(prd_descs))
+        self._statuses.append(status_record(prd_id, "done"))
+        return await self._maybe_flush(prd_id)
+
+    async def fail(self, prd_id, error):
+        """
+        Record a failed product so that an incremental rerun picks it up again.
+        Args:
+            prd_id (str): Product ID
+            error (str): Error message
+        Returns:
+            dict: status and message of the flush, if one was triggered
+        """
+        self._statuses.append(status_record(prd_id, "failed", error))
+        return await self._maybe_flush(prd_id)
+
+    async def _maybe_flush(self, prd_id):
+        if len(self._buffer) >= self.flush_rows or len(self._statuses) >= self.flush_rows:
+            return await self.flush()
+        return {"status": True, "return": f"Buffered : {prd_id}"}
+
+    def _restore(self, records, statuses):
+        # Rows of a failed flush go back in front of the buffer and are retried by the next one
+        self._buffer[:0] = records
+        self._statuses[:0] = statuses
+
+    async def flush(self):
+        """
+        Write all buffered rows with a single COPY and record the product
+        statuses in the same transaction. When the write fails, the rows stay
+        buffered for the next flush.
+        Returns:
+            dict: status and message
+        """
+        async with self._lock:
+            records, self._buffer = self._buffer, []
+            statuses, self._statuses = self._statuses, []
+            self._last_flush = time.monotonic()
+            if not records and not statuses:
+                return {"status": True, "return": "Nothing to flush"}
+            try:
+                done_ids = [prd_id for prd_id, status, _ in statuses if status == "done"]
+                started = time.perf_counter()
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        if done_ids:
+                            await conn.execute(
+                                f"DELETE FROM {TRAIT_SCHEMA}.{self.table} WHERE prd_id = ANY($1::varchar[]);",
+                                done_ids
+                            )
+                        if records:
+                            await conn.copy_records_to_table(
+                                self.table,
+                                records=records,
+                                columns=TRAIT_COLUMNS,
+                                schema_name=TRAIT_SCHEMA,
+                            )
+                        await conn.executemany(
+                            status_upsert_query(paramstyle="asyncpg"),
+                            [(prd_id, self.source, status, error) for prd_id, status, error in statuses]
+                        )
+                DB_WRITE_SECONDS.observe(time.perf_counter() - started, table=self.table)
+                DB_ROWS_WRITTEN.inc(len(records), table=self.table)
+                PRODUCTS_RECORDED.inc(len(done_ids), source=self.source, status="done")
+                PRODUCTS_RECORDED.inc(len(statuses) - len(done_ids), source=self.source, status="failed")
+                self.rows_written += len(records)
+                return {"status": True, "return": f"Insert successful : {len(records)} rows"}
+            except asyncio.CancelledError:
+                self._restore(records, statuses)
+                raise
+            except Exception as e:
+                DB_WRITE_ERRORS.inc(table=self.table)
+                self.failed_flushes += 1
+                self._restore(records, statuses)
+                return {"status": False, "return": f"Insert failed : {len(records)} rows\n{str(e)}"}
+
+    async def close(self):
+        """
+        Stop the periodic flush and write what is left. When that write fails,
+        the buffered products are recorded as failed instead (their traits are
+        dropped); if even that fails, RuntimeError is raised.
+        """
+        if self._ticker is not None:
+            self._ticker.cancel()
+            # A flush interrupted by the cancellation has put its rows back
+            with suppress(asyncio.CancelledError):
+                await self._ticker
+            self._ticker = None
+        result = await self.flush()
+        if result.get("status"):
+            return
+        print(result.get("return"))
+        async with self._lock:
+            self._statuses = failed_statuses(self._statuses, result.get("return"))
+            self._buffer = []
+        result = await self.flush()
+        if not result.get("status"):
+            raise RuntimeError(
+                f"Could not record {len(self._statuses)} {self.source} products: {result.get('return')}")
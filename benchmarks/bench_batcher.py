@@ -0,0 +1,75 @@
+"""
+Throughput and per-request latency of single-prompt encode requests from
+concurrent callers, sent straight to the model (one call per prompt,
+serialized by a lock) and through EmbeddingBatcher for different max_wait
+settings. Product-name-like synthetic prompts are used.
+
+    python -m benchmarks.bench_batcher --callers 32 --requests 2000 --max-waits 0.001 0.005 0.02
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sentence_transformers import SentenceTransformer
+
+from app.batcher import EmbeddingBatcher
+from app.scheduler import percentile
+from benchmarks.bench_encode_workers import synthetic_texts
+
+
+def run(encode_one, prompts, callers):
+    latencies = []
+    lock = threading.Lock()
+
+    def call(prompt):
+        started = time.perf_counter()
+        encode_one(prompt)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(callers) as pool:
+        list(pool.map(call, prompts))
+    return time.perf_counter() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="Qwen/Qwen3-Embedding-0.6B")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--callers", type=int, default=32, help="concurrent threads, one prompt per request")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-waits", type=float, nargs="+", default=[0.001, 0.005, 0.02])
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model, device="cpu")
+    prompts = [f"Instruct: 패션 의류 및 아이템 상품 유사도 분류\nQuery: {text}"
+               for text in synthetic_texts(args.requests)]
+    model.encode(prompts[:args.max_batch], batch_size=args.max_batch)  # warm up
+
+    results = []
+    model_lock = threading.Lock()
+
+    def direct(prompt):
+        with model_lock:
+            return model.encode([prompt], batch_size=1, convert_to_numpy=True)
+
+    elapsed, latencies = run(direct, prompts, args.callers)
+    results.append(("direct", elapsed, latencies, 1.0))
+    for max_wait in args.max_waits:
+        batcher = EmbeddingBatcher(model, max_batch=args.max_batch, max_wait=max_wait, name="bench")
+        elapsed, latencies = run(batcher.encode, prompts, args.callers)
+        batcher.close()
+        results.append((f"batched {max_wait * 1000:g} ms", elapsed, latencies, batcher.summary()['mean_batch']))
+
+    print(f"{args.requests} requests from {args.callers} callers, max batch {args.max_batch}")
+    print(f"{'mode':<18} {'req/sec':>9} {'batch':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, elapsed, latencies, mean_batch in results:
+        print(f"{mode:<18} {len(latencies) / elapsed:>9.1f} {mean_batch:>6.1f} "
+              f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
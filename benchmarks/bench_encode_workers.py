@@ -0,0 +1,58 @@
+"""
+CPU encoding throughput of encode_texts for different worker counts, with
+the threads of the machine split evenly between workers. Product-name-like
+synthetic texts are used and no cache, so every run encodes everything.
+
+    python -m benchmarks.bench_encode_workers --texts 4000 --workers 1 2 4 8
+"""
+import argparse
+import os
+import random
+import time
+
+from app.encoder import encode_texts
+
+
+WORDS = ["오버핏", "린넨", "셔츠", "와이드", "데님", "팬츠", "니트", "가디건", "반팔", "원피스",
+         "슬림", "코튼", "블라우스", "스커트", "자켓", "후드", "맨투맨", "트레이닝", "조거", "플리츠"]
+
+
+def synthetic_texts(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(2, 12))) + f" {i}" for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="Qwen/Qwen3-Embedding-0.6B")
+    parser.add_argument("--texts", type=int, default=4000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.texts)
+    cores = os.cpu_count() or 1
+    results = []
+    for workers in args.workers:
+        threads = max(1, cores // workers)
+        model = None
+        if workers == 1:
+            import torch
+            from sentence_transformers import SentenceTransformer
+            torch.set_num_threads(threads)
+            model = SentenceTransformer(args.model, device="cpu")
+        # Model loading (once per worker) is part of the wall time
+        started = time.perf_counter()
+        encode_texts(
+            model, texts, model_name=args.model, instruct="", prompt_template="{}{}",
+            batch_size=args.batch_size, report_every=0, workers=workers, threads_per_worker=threads)
+        results.append((workers, threads, time.perf_counter() - started))
+
+    print(f"{'workers':>7s} {'threads':>7s} {'seconds':>8s} {'texts/sec':>10s} {'speedup':>8s}")
+    for workers, threads, elapsed in results:
+        print(f"{workers:7d} {threads:7d} {elapsed:8.1f} {len(texts) / elapsed:10.1f} "
+              f"{results[0][2] / elapsed:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
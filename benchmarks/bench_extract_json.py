@@ -0,0 +1,80 @@
+"""
+Check extract_traits against a corpus of malformed LLM answers (markdown
+fences, trailing commas, nested or quoted braces, truncation, "unknown"
+spellings, structured output) and time it against the legacy regex
+extractor. Each corpus line gives the number of valid traits expected and
+how many of their values must come out as "unknown"; the exit status is
+non-zero when a case does not match.
+
+    python -m benchmarks.bench_extract_json --repeat 2000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from app.traits import extract_traits, normalize_trait
+
+
+# Shared with tests/test_extract_json.py
+CORPUS = os.path.join(os.path.dirname(__file__), os.pardir, "tests", "data", "llm_outputs.jsonl")
+
+
+def legacy_extract_json(text):
+    # extract_json before the raw_decode scanner
+    json_objects = []
+    for match in re.findall(r'\{.*?\}', text, re.DOTALL):
+        try:
+            json_objects.append(json.loads(match))
+        except json.JSONDecodeError:
+            continue
+    return json_objects
+
+
+def legacy_traits(text):
+    return [trait for trait in map(normalize_trait, legacy_extract_json(text)) if trait is not None]
+
+
+def time_per_call(fn, outputs, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for output in outputs:
+            fn(output)
+    return (time.perf_counter() - started) / (repeat * len(outputs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    failed = 0
+    print(f"{'case':<24s} {'expected':>8s} {'legacy':>6s} {'new':>4s}")
+    for case in cases:
+        traits = extract_traits(case['output'])
+        unknown = sum(value == "unknown" for trait in traits for value in trait.values())
+        ok = len(traits) == case['traits'] and unknown == case['unknown']
+        failed += not ok
+        print(f"{case['case']:<24s} {case['traits']:8d} {len(legacy_traits(case['output'])):6d} "
+              f"{len(traits):4d}{'' if ok else '  MISMATCH'}")
+
+    outputs = [case['output'] for case in cases]
+    expected = sum(case['traits'] for case in cases)
+    print(f"\nValid traits recovered: legacy {sum(len(legacy_traits(o)) for o in outputs)}/{expected}, "
+          f"new {sum(len(extract_traits(o)) for o in outputs)}/{expected}")
+    for name, fn in (("legacy regex", legacy_extract_json), ("legacy + validation", legacy_traits),
+                     ("extract_traits", extract_traits)):
+        print(f"{name:>20s}: {time_per_call(fn, outputs, args.repeat) * 1e6:7.1f} us/answer")
+    if failed:
+        print(f"{failed} case(s) mismatched")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Bytes on the wire and preparation time of the image payloads (app.imageprep)
+compared with sending the original images, cold (resize + recompress) and
+warm (payload read back from disk). With --llm the request latency of
+recognize_image_async is also measured for original and prepared payloads,
+against the LLM server configured in 02_product_image_recognition_async.py.
+Synthetic photos are generated in a temp dir unless --images is given.
+
+    python -m benchmarks.bench_image_prep --images "./data/prd_img/*.jpg" --workers 4
+    python -m benchmarks.bench_image_prep --count 200 --llm 20
+"""
+import argparse
+import asyncio
+import glob
+import importlib
+import os
+import random
+import tempfile
+import time
+
+from app.imageprep import ImagePreparer
+from app.preprocess import recognize_image_async
+from app.scheduler import percentile
+
+
+def make_images(directory, count, size=1200, seed=0):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    y, x = np.mgrid[0:size, 0:size]
+    for i in range(count):
+        # Smooth gradients plus texture, closer to a product photo than pure noise
+        base = np.stack([(x * rng.uniform(0.1, 0.3) + y * rng.uniform(0.1, 0.3)) % 256] * 3, axis=-1)
+        noise = rng.normal(0, 12, (size, size, 3))
+        path = os.path.join(directory, f"bench-{i}.jpg")
+        Image.fromarray(np.clip(base + noise, 0, 255).astype("uint8")).save(path, quality=95)
+        paths.append(path)
+    return paths
+
+
+async def prepare_all(preparer, paths):
+    started = time.perf_counter()
+    results = await asyncio.gather(*[preparer.prepare(path) for path in paths])
+    return time.perf_counter() - started, results
+
+
+async def llm_latency(paths, payloads):
+    llm_config = importlib.import_module("02_product_image_recognition_async").LLM_CONFIG
+    service = {
+        "service_url": llm_config['url'],
+        "service_key": llm_config['key'],
+        "service_llm": llm_config['model'],
+        "service_temperature": llm_config['temperature'],
+        "service_role": llm_config['role'],
+    }
+    latencies = {"original": [], "prepared": []}
+    # Interleaved, so drifting server load affects both variants alike
+    for path, payload in zip(paths, payloads):
+        for variant, image_payload in (("original", None), ("prepared", payload)):
+            started = time.perf_counter()
+            await recognize_image_async(img_path=path, image_payload=image_payload, **service)
+            latencies[variant].append(time.perf_counter() - started)
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None, help="glob of source images (default: synthetic)")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-side", type=int, default=896)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--llm", type=int, default=0, help="images sent to the LLM per variant (0 skips)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images:
+            # Prepared payloads are written next to the sources, so work on copies
+            paths = []
+            for n, source in enumerate(sorted(glob.glob(args.images))[:args.count]):
+                path = os.path.join(tmp, f"{n}-{os.path.basename(source)}")
+                with open(source, "rb") as src, open(path, "wb") as dst:
+                    dst.write(src.read())
+                paths.append(path)
+        else:
+            paths = make_images(tmp, args.count)
+        random.Random(0).shuffle(paths)
+
+        preparer = ImagePreparer(workers=args.workers, max_side=args.max_side, quality=args.quality)
+        await preparer.prepare(paths[0])  # start the worker processes outside the timings
+        for path in glob.glob(os.path.join(tmp, "*.b64")):
+            os.remove(path)
+        cold, results = await prepare_all(preparer, paths)
+        warm, _ = await prepare_all(preparer, paths)
+        preparer.close()
+
+        source_bytes = sum(result['source_bytes'] for result in results)
+        payload_bytes = sum(result['payload_bytes'] for result in results)
+        wire_before = source_bytes * 4 / 3
+        print(f"{len(paths)} images, {args.workers} workers, max side {args.max_side}, quality {args.quality}")
+        print(f"  original base64: {wire_before / len(paths) / 1024:8.1f} KB/image")
+        print(f"  prepared base64: {payload_bytes / len(paths) / 1024:8.1f} KB/image "
+              f"({1 - payload_bytes / wire_before:.0%} less)")
+        print(f"  prepare cold:    {cold / len(paths) * 1000:8.2f} ms/image (wall, {len(paths) / cold:.0f} images/sec)")
+        print(f"  prepare warm:    {warm / len(paths) * 1000:8.2f} ms/image (wall, {len(paths) / warm:.0f} images/sec)")
+
+        if args.llm:
+            n = min(args.llm, len(paths))
+            latencies = await llm_latency(paths[:n], [result['return'] for result in results[:n]])
+            for variant, values in latencies.items():
+                print(f"  LLM {variant:>8s}: p50 {percentile(values, 50):.2f}s, p95 {percentile(values, 95):.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
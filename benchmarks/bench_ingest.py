@@ -0,0 +1,130 @@
+"""
+Compare the legacy product_raw ingest (per-element lambdas, tuple
+comprehensions, whole CSV in memory) with the chunked vectorized path.
+Without --dsn only the in-process work is measured (the streaming path also
+pays for building the COPY payload, which the legacy path leaves to
+execute_values); with --dsn both paths also load into product_raw
+(execute_values vs COPY). Only synthetic "bench-*" rows are written.
+
+    python -m benchmarks.bench_ingest --rows 500000
+    python -m benchmarks.bench_ingest --rows 500000 --dsn "dbname=mydb user=myuser host=pgsql"
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from app.ingest import read_product_chunks, clean_product_chunk, copy_product_chunk, product_copy_payload
+
+
+CATEGORY_LINK = 'https://www.coupang.com/np/categories/498918?channel=plp_C2'
+
+
+def make_csv(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('web-scraper-order,category-link-0-href,name,price3,rating,ratingValue,image-src,image2-src\n')
+        for i in range(rows):
+            review = f'"({random.randint(1, 9999):,})"' if i % 5 else ''
+            f.write(
+                f'bench-{i},{CATEGORY_LINK},남성 오버핏 반팔 티셔츠 {i},'
+                f'"{random.randint(5000, 99000):,}원",{review},{random.uniform(3, 5):.1f},'
+                f'https://example.com/{i}.jpg,\n'
+            )
+
+
+def legacy_ingest(path, db_cur=None):
+    df_prd = pd.read_csv(path, dtype=str)
+    df_prd['category'] = df_prd['category-link-0-href'].map({CATEGORY_LINK: '티셔츠'})
+    df_prd['rating'] = df_prd['rating']\
+        .map(lambda x: x.replace('(', '').replace(')', '') if pd.notna(x) else x)
+    df_prd['price3'] = df_prd['price3']\
+        .map(lambda x: x.replace('원', '').replace(',', '') if pd.notna(x) else x)
+    df_prd = df_prd.rename(columns={
+        'web-scraper-order': 'prd_id', 'image-src': 'prd_img', 'rating': 'review',
+        'ratingValue': 'review_rating', 'price3': 'price', 'name': 'prd_name'})
+    df_prd['prd_path'] = df_prd['prd_id'].apply(lambda x: f"/tmp/prd_img/{x}.jpg")
+    df_prd.loc[df_prd['review'].isnull(), 'review'] = ''
+    df_prd.loc[df_prd['review_rating'].isnull(), 'review_rating'] = ''
+    cols = ['prd_id', 'category', 'prd_name', 'price', 'review', 'review_rating', 'prd_path']
+    db_insert = [tuple(_) for _ in df_prd[cols].to_numpy()]
+    db_insert = [tuple(None if __ == '' else __ for __ in _) for _ in db_insert]
+    if db_cur is not None:
+        import psycopg2.extras
+        psycopg2.extras.execute_values(
+            db_cur,
+            """
+            INSERT INTO product_similarity.product_raw
+            (prd_id, category, prd_name, price, review, review_rating, prd_img)
+            VALUES %s
+            ON CONFLICT (prd_id) DO NOTHING;
+            """,
+            db_insert
+        )
+        db_cur.connection.commit()
+    return len(db_insert)
+
+
+def streaming_ingest(path, chunk_size, db_cur=None):
+    rows = 0
+    for df_chunk in read_product_chunks(path, chunk_size):
+        df_prd = clean_product_chunk(df_chunk, {CATEGORY_LINK: '티셔츠'}, img_dir='/tmp/prd_img/')
+        if db_cur is not None:
+            result = copy_product_chunk(db_cur, df_prd)
+            if not result.get('status'):
+                raise RuntimeError(result.get('return'))
+        else:
+            # Same serialization work COPY would do
+            product_copy_payload(df_prd)
+        rows += len(df_prd)
+    return rows
+
+
+def clear_bench_rows(db_cur):
+    # Only the synthetic rows (prd_id "bench-*") are ever removed
+    if db_cur is not None:
+        db_cur.execute("DELETE FROM product_similarity.product_raw WHERE prd_id LIKE 'bench-%';")
+        db_cur.connection.commit()
+
+
+def measure(name, fn, db_cur=None):
+    # tracemalloc slows allocation-heavy code down several times, so time and
+    # peak memory are taken from separate runs
+    started = time.perf_counter()
+    rows = fn()
+    elapsed = time.perf_counter() - started
+    clear_bench_rows(db_cur)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    clear_bench_rows(db_cur)
+    print(f"{name:<10} {rows:>9} rows  {elapsed:7.2f}s  {rows / elapsed:>10.0f} rows/sec  "
+          f"peak {peak / 1024 ** 2:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--dsn", default=None, help="load into product_raw of this database")
+    args = parser.parse_args()
+
+    db_cur = None
+    if args.dsn:
+        import psycopg2
+        db_cur = psycopg2.connect(args.dsn).cursor()
+        clear_bench_rows(db_cur)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'product_information.csv')
+        make_csv(path, args.rows)
+        measure("legacy", lambda: legacy_ingest(path, db_cur), db_cur)
+        measure("streaming", lambda: streaming_ingest(path, args.chunk_size, db_cur), db_cur)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Memory savings versus similarity drift of reduced-precision (float16, int8)
+and Matryoshka-truncated embeddings, measured against full float32 vectors:
+
+- MB: memory of the vectors of all three tags for the catalogue size
+- mean/max |d cos|: cosine error on random pairs and on nearest-neighbour pairs
+- recall@k: overlap of the exact top-k with the float32 full-dim top-k
+
+Run it on our data by exporting the vectors of a store written by 05
+(full float32 dims), e.g. --backend milvus or --backend numpy. Without
+--backend, clustered synthetic vectors are used; those say little about
+truncation, since only real Matryoshka-trained embeddings keep their
+information in the leading dimensions.
+
+    python -m benchmarks.bench_quantization --backend milvus --prd-tag product_name
+    python -m benchmarks.bench_quantization --vectors 50000 --dims 1024 512 256
+"""
+import argparse
+
+import numpy as np
+
+from app.quantize import PRECISIONS, truncate_embeddings, quantize_embeddings, cosine_scores
+
+
+def synthetic_vectors(n, dim, clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=n)
+    return centroids[labels] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def top_k(queries, embeddings, k):
+    sims = cosine_scores(queries, embeddings)
+    return np.argpartition(-sims, k, axis=1)[:, :k + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=None, help="export vectors from this store instead of synthetic data")
+    parser.add_argument("--prd-tag", default="product_name")
+    parser.add_argument("--vectors", type=int, default=50000, help="synthetic vectors")
+    parser.add_argument("--dim", type=int, default=1024, help="synthetic dimension")
+    parser.add_argument("--dims", type=int, nargs="+", default=[1024, 768, 512, 256, 128])
+    parser.add_argument("--catalogue", type=int, default=3_000_000, help="products the MB column is scaled to")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--pairs", type=int, default=100000)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.backend:
+        from app.vectorstore import open_vector_store
+        _, vectors = open_vector_store(args.backend).export(args.prd_tag)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dim)
+    n, full_dim = vectors.shape
+    rng = np.random.default_rng(1)
+    queries = rng.choice(n, min(args.queries, n), replace=False)
+    pairs = rng.integers(n, size=(args.pairs, 2))
+
+    reference = truncate_embeddings(vectors, full_dim)
+    reference_top = top_k(reference[queries], reference, args.k)
+    # Nearest-neighbour pairs matter most: they decide the top-k ranking
+    near = np.stack([np.repeat(queries, args.k + 1), reference_top.ravel()], axis=1)
+
+    def pair_cos(embeddings, index):
+        return np.einsum('ij,ij->i', embeddings[index[:, 0]], embeddings[index[:, 1]])
+
+    reference_random, reference_near = pair_cos(reference, pairs), pair_cos(reference, near)
+
+    print(f"{n} vectors x {full_dim} dims ({args.prd_tag if args.backend else 'synthetic'}), "
+          f"MB for {args.catalogue} products x 3 tags")
+    print(f"{'dims':>5s} {'precision':>9s} {'MB':>10s} {'saving':>7s} {'random |d cos|':>18s} "
+          f"{'neighbour |d cos|':>18s} {f'recall@{args.k}':>9s}")
+    for dim in args.dims:
+        if dim > full_dim:
+            continue
+        truncated = truncate_embeddings(vectors, dim)
+        for precision, dtype in PRECISIONS.items():
+            stored = quantize_embeddings(truncated, precision)
+            restored = truncate_embeddings(stored, dim)
+            random_drift = np.abs(pair_cos(restored, pairs) - reference_random)
+            near_drift = np.abs(pair_cos(restored, near) - reference_near)
+            found = top_k(restored[queries], stored, args.k)
+            recall = np.mean([
+                len((set(a) - {q}) & (set(b) - {q})) / args.k
+                for q, a, b in zip(queries, found, reference_top)])
+            size = args.catalogue * 3 * dim * np.dtype(dtype).itemsize
+            full = args.catalogue * 3 * full_dim * 4
+            print(f"{dim:5d} {precision:>9s} {size / 1024 ** 2:10.0f} {1 - size / full:7.1%} "
+                  f"{random_drift.mean():8.5f} / {random_drift.max():7.5f} "
+                  f"{near_drift.mean():8.5f} / {near_drift.max():7.5f} {recall:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Load test of the similar-products service (08). Concurrent keep-alive
+clients send a mix of queries and the client-side latency is reported per
+kind:
+
+    prd_id   first lookup of a product (vector lookup + search)
+    cached   repeated query answered from the result cache
+    text     free-text query (embedding + search), only with --text-share
+
+Without --url an in-process service is started on a synthetic numpy store
+(--products random vectors per tag); text queries then need --model to
+load the real embedding model. The target is p99 < 50 ms for prd_id and
+cached queries on CPU.
+
+    python -m benchmarks.bench_service --products 20000 --requests 20000 --concurrency 8
+    python -m benchmarks.bench_service --url http://localhost:8080 --prd-ids prd_ids.txt --text-share 0.1
+"""
+import argparse
+import http.client
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+
+from app.embedding import embedding_key
+from app.scheduler import percentile
+from app.service import SimilarProducts, serve
+from app.vectorstore import NumpyStore, ROW_COLUMNS
+
+
+TARGET_P99 = 0.050  # seconds, for prd_id and cached queries
+TAGS = ["product_name", "product_image", "product_text"]
+CATEGORIES = ["티셔츠", "맨투맨/후디", "셔츠", "니트/조끼", "아우터", "바지", "신발", "가방/잡화"]
+TEXTS = ["오버핏 반팔 티셔츠", "슬림핏 청바지", "울 니트 조끼", "캐주얼 후드집업", "가죽 로퍼",
+         "린넨 셔츠", "패딩 점퍼", "트레이닝 팬츠", "캔버스 토트백", "기모 맨투맨"]
+
+
+def synthetic_store(path, products, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    store = NumpyStore(path, dim=dim, rebuild=True)
+    prd_ids = [f"bench-{i}" for i in range(products)]
+    categories = [CATEGORIES[i % len(CATEGORIES)] for i in range(products)]
+    for tag in TAGS:
+        rows = pd.DataFrame({
+            "id": [embedding_key(tag, prd_id) for prd_id in prd_ids],
+            "prd_id": prd_ids,
+            "category": categories,
+            "prd_text": "",
+            "prd_tag": tag,
+            "text_hash": "",
+        }, columns=ROW_COLUMNS)
+        embeddings = rng.standard_normal((products, dim), dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        store.upsert(rows, embeddings)
+    return store, prd_ids
+
+
+def make_queries(prd_ids, n, hot, repeat_share, text_share, same_category_share, seed=0):
+    """
+    Build the request mix: repeat_share of the queries come from a small hot
+    set (cached after their first use), text_share are free-text queries and
+    the rest are distinct prd_id lookups.
+    """
+    rng = random.Random(seed)
+    fresh = iter(rng.sample(prd_ids, min(len(prd_ids), n)))
+    hot_set = [{"prd_id": prd_id} for prd_id in rng.sample(prd_ids, min(hot, len(prd_ids)))]
+    queries = []
+    for _ in range(n):
+        draw = rng.random()
+        if draw < text_share:
+            query = {"text": rng.choice(TEXTS)}
+        elif draw < text_share + repeat_share:
+            query = dict(rng.choice(hot_set))
+        else:
+            query = {"prd_id": next(fresh, rng.choice(prd_ids))}
+            if rng.random() < same_category_share:
+                query["same_category"] = 1
+        query["tag"] = rng.choice(TAGS)
+        queries.append(query)
+    return queries
+
+
+def run_load(url, queries, concurrency):
+    target = urlparse(url)
+    local = threading.local()
+    latencies = {"prd_id": [], "cached": [], "text": []}
+    errors = []
+    lock = threading.Lock()
+
+    def send(query):
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        started = time.perf_counter()
+        local.conn.request("GET", f"/similar?{urlencode(query)}")
+        response = local.conn.getresponse()
+        body = json.loads(response.read())
+        elapsed = time.perf_counter() - started
+        with lock:
+            if response.status != 200:
+                errors.append(body.get("error"))
+            elif body.get("cached"):
+                latencies["cached"].append(elapsed)
+            else:
+                latencies["text" if "text" in query else "prd_id"].append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, queries))
+    return latencies, errors, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="running service to test (default: in-process synthetic one)")
+    parser.add_argument("--prd-ids", default=None, help="file with one product ID per line (with --url)")
+    parser.add_argument("--products", type=int, default=20_000, help="synthetic products per tag")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--model", default=None, help="embedding model loaded for text queries (in-process only)")
+    parser.add_argument("--requests", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--hot", type=int, default=200, help="distinct queries of the repeated (cached) set")
+    parser.add_argument("--repeat-share", type=float, default=0.5)
+    parser.add_argument("--text-share", type=float, default=0.0)
+    parser.add_argument("--same-category-share", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.url is None:
+            store, prd_ids = synthetic_store(tmp, args.products, args.dim)
+            model = None
+            if args.model:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(args.model)
+            service = SimilarProducts(
+                store, model, model_name=args.model or "", instruct="", prompt_template="{}{}", tags=TAGS)
+            service.warm()
+            server = serve(service, host="127.0.0.1", port=0)
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+        else:
+            url = args.url
+            with open(args.prd_ids, encoding="utf-8") as f:
+                prd_ids = [line.strip() for line in f if line.strip()]
+
+        queries = make_queries(prd_ids, args.requests, args.hot, args.repeat_share,
+                               args.text_share, args.same_category_share)
+        latencies, errors, elapsed = run_load(url, queries, args.concurrency)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            service.close()
+
+    print(f"{len(queries)} requests in {elapsed:.1f}s ({len(queries) / elapsed:.0f} req/sec), "
+          f"concurrency {args.concurrency}, {len(errors)} errors")
+    for kind, values in latencies.items():
+        if values:
+            p99 = percentile(values, 99)
+            target = "" if kind == "text" else f"  {'meets' if p99 < TARGET_P99 else 'misses'} p99 target"
+            print(f"{kind:<8} {len(values):>7}  p50 {percentile(values, 50) * 1000:6.1f} ms  "
+                  f"p95 {percentile(values, 95) * 1000:6.1f} ms  p99 {p99 * 1000:6.1f} ms{target}")
+    if errors:
+        print(f"First error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare the per-product Milvus path (get_product_similarity_inner, 5
+round-trips per product) with the in-memory matrix engine
+(get_product_similarity_inner_matrix), and check that the scores agree.
+By default a synthetic Milvus Lite collection is built in a temp dir; pass
+--uri/--collection to run against the real product_embedding collection.
+
+    python -m benchmarks.bench_similarity_inner --products 5000
+    python -m benchmarks.bench_similarity_inner --uri ./milvus_db/product_similarity.db
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection
+
+from app.embedding import get_product_similarity_inner, get_product_similarity_inner_matrix
+from app.vectorstore import MilvusStore
+
+
+def build_collection(uri, name, n_products, dim):
+    connections.connect("default", uri=uri)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+        FieldSchema(name="prd_id", dtype=DataType.VARCHAR, max_length=50),
+        FieldSchema(name="prd_text", dtype=DataType.VARCHAR, max_length=500),
+        FieldSchema(name="prd_tag", dtype=DataType.VARCHAR, max_length=50),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+    ]
+    collection = Collection(name, CollectionSchema(fields))
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(n_products, dim)).astype(np.float32)
+    prd_ids = [f"bench-{i}" for i in range(n_products)]
+    for tag in ["product_name", "product_text", "product_image"]:
+        # Correlated vectors per product, so scores are in a realistic range
+        vectors = base + 0.8 * rng.normal(size=(n_products, dim)).astype(np.float32)
+        for i in range(0, n_products, 2000):
+            collection.insert([
+                prd_ids[i:i + 2000], [""] * len(prd_ids[i:i + 2000]),
+                [tag] * len(prd_ids[i:i + 2000]), vectors[i:i + 2000]])
+    collection.flush()
+    collection.create_index(
+        "embedding", {"index_type": "IVF_FLAT", "metric_type": "COSINE", "params": {"nlist": 128}})
+    collection.load()
+    return collection, prd_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--sample", type=int, default=200, help="products timed on the Milvus path")
+    parser.add_argument("--uri", default=None)
+    parser.add_argument("--collection", default="product_embedding")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.uri is None:
+            collection, prd_ids = build_collection(
+                os.path.join(tmp, "bench.db"), "bench_embedding", args.products, args.dim)
+        else:
+            connections.connect("default", uri=args.uri)
+            collection = Collection(args.collection)
+            collection.load()
+            prd_ids = None
+
+        started = time.perf_counter()
+        matrix = get_product_similarity_inner_matrix(MilvusStore(collection))
+        matrix_elapsed = time.perf_counter() - started
+        scores = {row[0]: row[1:] for row in matrix}
+        prd_ids = prd_ids or list(scores)
+
+        sample = random.Random(0).sample(prd_ids, min(args.sample, len(prd_ids)))
+        started = time.perf_counter()
+        milvus, missed = [], 0
+        for prd_id in sample:
+            try:
+                milvus.append(get_product_similarity_inner(collection, prd_id))
+            except ValueError:
+                # IVF with nprobe=8 can miss the product's own vectors in a filtered search
+                missed += 1
+        milvus_elapsed = time.perf_counter() - started
+
+        max_diff = max(
+            (abs(a - b) for row in milvus for a, b in zip(row[1:], scores[row[0]])), default=0.0)
+        milvus_rate = len(sample) / milvus_elapsed
+        print(f"milvus   {milvus_rate:10.1f} products/sec "
+              f"(est. {len(matrix) / milvus_rate:8.1f}s for {len(matrix)} products)")
+        print(f"matrix   {len(matrix) / matrix_elapsed:10.1f} products/sec "
+              f"({matrix_elapsed:8.1f}s for {len(matrix)} products, export included)")
+        print(f"max |milvus - matrix| over {len(milvus)} products: {max_diff:.2e}"
+              f" (milvus path found no vector for {missed} of {len(sample)})")
+
+
+if __name__ == "__main__":
+    main()
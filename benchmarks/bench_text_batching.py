@@ -0,0 +1,94 @@
+"""
+Tokens/product and products/sec of text recognition with one product name
+per request (recognize_text_async) and with N names per request
+(recognize_text_batched_async, invalid answers re-requested individually).
+Requests are sent one after another without a cache, against the LLM server
+configured in 03_product_name_recognition_async.py. Product names come from
+product_raw with --dsn, otherwise synthetic names are used.
+
+    python -m benchmarks.bench_text_batching --products 64 --batch-sizes 8 16 32
+    python -m benchmarks.bench_text_batching --dsn "dbname=mydb user=myuser host=pgsql"
+"""
+import argparse
+import asyncio
+import importlib
+import random
+import time
+
+from openai import AsyncOpenAI
+
+from app.preprocess import recognize_text_async, recognize_text_batched_async
+from app.traits import valid_trait
+
+
+WORDS = ["남성", "여성", "오버핏", "린넨", "셔츠", "와이드", "데님", "팬츠", "니트", "가디건",
+         "반팔", "원피스", "슬림", "코튼", "블라우스", "스커트", "자켓", "후드", "맨투맨", "플리츠"]
+
+
+def synthetic_names(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(3, 8))) for _ in range(n)]
+
+
+def product_names(dsn, n):
+    import psycopg2
+    with psycopg2.connect(dsn) as db_conn:
+        with db_conn.cursor() as db_cur:
+            db_cur.execute(
+                "SELECT prd_name FROM product_similarity.product_raw ORDER BY random() LIMIT %s;", (n,))
+            return [row[0] for row in db_cur.fetchall()]
+
+
+async def run(names, batch_size, service):
+    tokens = requests = rerequested = valid = 0
+    started = time.perf_counter()
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        if batch_size == 1:
+            result = await recognize_text_async(text_query=batch[0], **service)
+            results = [result]
+        else:
+            result = await recognize_text_batched_async(text_queries=batch, **service)
+            results = result.get("return")
+            rerequested += result.get("rerequested", 0)
+        tokens += result.get("tokens", 0)
+        requests += result.get("requests", 1)
+        valid += sum(
+            bool(r.get("status")) and any(valid_trait(prd_desc) for prd_desc in r.get("return"))
+            for r in results
+        )
+    return time.perf_counter() - started, tokens, requests, rerequested, valid
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--dsn", default=None, help="read product names from product_raw")
+    args = parser.parse_args()
+
+    llm_config = importlib.import_module("03_product_name_recognition_async").LLM_CONFIG
+    names = product_names(args.dsn, args.products) if args.dsn else synthetic_names(args.products)
+    client = AsyncOpenAI(base_url=llm_config['url'], api_key=llm_config['key'])
+    service = {
+        "service_url": llm_config['url'],
+        "service_key": llm_config['key'],
+        "service_llm": llm_config['model'],
+        "service_temperature": llm_config['temperature'],
+        "service_role": llm_config['role'],
+        "client": client,
+    }
+
+    print(f"{'batch':>5s} {'seconds':>8s} {'prd/sec':>8s} {'tok/prd':>8s} {'requests':>8s} "
+          f"{'re-req':>7s} {'valid':>6s}")
+    baseline = None
+    for batch_size in [1] + [b for b in args.batch_sizes if b > 1]:
+        elapsed, tokens, requests, rerequested, valid = await run(names, batch_size, service)
+        baseline = baseline or elapsed
+        print(f"{batch_size:5d} {elapsed:8.1f} {len(names) / elapsed:8.2f} {tokens / len(names):8.0f} "
+              f"{requests:8d} {rerequested:7d} {valid / len(names):6.1%}  x{baseline / elapsed:.2f}")
+    await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+"""
+Compare vector store backends for the top-k similar products search:
+exact numpy search, faiss HNSW, faiss IVF-PQ and Milvus Lite IVF_FLAT.
+Reports build time, index memory, queries/sec and recall@k against the exact
+result. By default clustered synthetic vectors are used; pass --from-store to
+benchmark the product_name vectors of an existing local store (./vector_store).
+
+    python -m benchmarks.bench_vector_index --vectors 50000 --queries 1000
+    python -m benchmarks.bench_vector_index --from-store ./vector_store --prd-tag product_name
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.vectorstore import NumpyStore, FaissStore, MilvusStore
+
+
+def synthetic_vectors(n, dim, clusters=200, seed=0):
+    # Products of a category/style sit close together, so sample around centroids
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=n)
+    return centroids[labels] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def make_rows(n, prd_tag="product_name"):
+    prd_ids = [f"bench-{i}" for i in range(n)]
+    return pd.DataFrame({
+        "id": [f"{prd_tag}:{p}" for p in prd_ids],
+        "prd_id": prd_ids,
+        "category": "bench",
+        "prd_text": "",
+        "prd_tag": prd_tag,
+        "text_hash": "",
+    })
+
+
+def dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def recall_at_k(results, exact, k):
+    hits = sum(
+        len({p for p, _ in got[:k]} & {p for p, _ in want[:k]}) for got, want in zip(results, exact))
+    return hits / (len(exact) * k)
+
+
+def run(name, store, rows, vectors, queries, k, prd_tag, build):
+    started = time.perf_counter()
+    memory = build(store, rows, vectors)
+    build_elapsed = time.perf_counter() - started
+    # Warm-up query, so lazily built views/indexes are not counted as search time
+    store.search(prd_tag, queries[:1], k)
+    started = time.perf_counter()
+    results = []
+    for i in range(0, len(queries), 256):
+        results.extend(store.search(prd_tag, queries[i:i + 256], k))
+    search_elapsed = time.perf_counter() - started
+    return name, build_elapsed, memory, len(queries) / search_elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--from-store", default=None, help="directory of a numpy/faiss store")
+    parser.add_argument("--prd-tag", default="product_name")
+    parser.add_argument("--hnsw", default="HNSW32", help="faiss HNSW factory string")
+    parser.add_argument("--ef-search", type=int, default=128)
+    parser.add_argument("--ivfpq", default=None, help="faiss IVF-PQ factory string (default sized to data)")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--skip-milvus", action="store_true")
+    args = parser.parse_args()
+
+    prd_tag = args.prd_tag
+    if args.from_store:
+        prd_ids, vectors = NumpyStore(args.from_store).export(prd_tag)
+        rows = make_rows(len(prd_ids), prd_tag)
+        rows["prd_id"] = prd_ids
+        rows["id"] = [f"{prd_tag}:{i}" for i in range(len(prd_ids))]
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dim)
+        rows = make_rows(len(vectors), prd_tag)
+    n, dim = vectors.shape
+    queries = vectors[np.random.default_rng(1).choice(n, min(args.queries, n), replace=False)]
+    nlist = max(16, min(4096, int(4 * np.sqrt(n))))
+    ivfpq = args.ivfpq or f"IVF{nlist},PQ{dim // 16}"
+
+    def build_local(store, rows, vectors):
+        store.upsert(rows, vectors)
+        store.commit()
+        if isinstance(store, FaissStore):
+            _, index = store.build_index(prd_tag)
+            import faiss
+            return faiss.serialize_index(index).nbytes
+        return store.embeddings.nbytes
+
+    def build_milvus(store, rows, vectors):
+        for i in range(0, len(rows), 5000):
+            store.upsert(rows.iloc[i:i + 5000], vectors[i:i + 5000])
+        store.commit()
+        store.reindex()
+        return dir_size(os.path.dirname(uri))
+
+    print(f"{n} vectors x {dim} dims, {len(queries)} queries, recall@{args.k} against exact search")
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [run("numpy exact", NumpyStore(os.path.join(tmp, "numpy"), dim=dim),
+                    rows, vectors, queries, args.k, prd_tag, build_local)]
+        exact = runs[0][4]
+        try:
+            runs.append(run(
+                f"faiss {args.hnsw} ef={args.ef_search}",
+                FaissStore(os.path.join(tmp, "hnsw"), dim=dim, index_factory=args.hnsw,
+                           search_params=f"efSearch={args.ef_search}"),
+                rows, vectors, queries, args.k, prd_tag, build_local))
+            runs.append(run(
+                f"faiss {ivfpq} nprobe={args.nprobe}",
+                FaissStore(os.path.join(tmp, "ivfpq"), dim=dim, index_factory=ivfpq,
+                           search_params=f"nprobe={args.nprobe}"),
+                rows, vectors, queries, args.k, prd_tag, build_local))
+        except ImportError:
+            print("faiss is not installed, skipping the faiss backends")
+        if not args.skip_milvus:
+            uri = os.path.join(tmp, "milvus", "bench.db")
+            runs.append(run(
+                f"milvus IVF_FLAT nprobe={args.nprobe}",
+                MilvusStore.open(uri, "bench_embedding", dim=dim, search_params={"nprobe": args.nprobe}),
+                rows, vectors, queries, args.k, prd_tag, build_milvus))
+
+        print(f"{'backend':36s} {'build s':>9s} {'memory MB':>10s} {'queries/s':>10s} {'recall':>7s}")
+        for name, build_elapsed, memory, qps, results in runs:
+            print(f"{name:36s} {build_elapsed:9.1f} {memory / 1024 ** 2:10.1f} {qps:10.1f} "
+                  f"{recall_at_k(results, exact, args.k):7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Streaming runner for the whole pipeline (01 -> 06 in one process):
+
+    ingest -> download -> prepare -> recognize (image + text) -> integrate -> embed -> index -> score
+
+Stages are connected by bounded queues, so a product moves on as soon as
+its own inputs are ready: the first products are embedded while later
+chunks are still being downloaded. Concurrency, batch sizes and queue
+sizes are set per stage in PIPELINE_CONFIG. The stage settings (category
+map, prompts, models, caches) are loaded from the numbered scripts, which
+stay usable on their own. The top-k lists (07) need every vector and are
+still computed afterwards.
+
+    python run_pipeline.py --backend milvus
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import time
+
+import asyncpg
+import pandas as pd
+import psycopg2
+from openai import AsyncOpenAI
+
+from app.cache import DiskCache
+from app.download import TokenBucket, make_session, download_image
+from app.embedding import embedding_key
+from app.encoder import encode_texts, embedding_cache_key
+from app.imageprep import ImagePreparer
+from app.integrate import INFORMATION_COLUMNS, INTEGRATION_FAILED, information_row_error, resolve_traits
+from app.metrics import start_metrics
+from app.ingest import read_product_chunks, clean_product_chunk, copy_product_chunk
+from app.pipeline import Pipeline, Stage
+from app.preprocess import recognize_image_async, recognize_text_async
+from app.quantize import truncate_embeddings
+from app.scheduler import PriorityLimiter, RunStats, call_with_retry
+from app.traits import TRAIT_KEYS
+from app.vectorstore import BACKENDS, ROW_COLUMNS, open_vector_store
+from app.writer import TraitWriter, TRAIT_SCHEMA
+
+ingest_script = importlib.import_module("01_product_information")
+image_script = importlib.import_module("02_product_image_recognition_async")
+text_script = importlib.import_module("03_product_name_recognition_async")
+embed_script = importlib.import_module("05_product_embedding_milvus")
+
+DB_CONFIG = ingest_script.DB_CONFIG
+
+PIPELINE_CONFIG = {
+    "download": {"concurrency": 16},
+    "prepare": {"concurrency": image_script.IMAGE_CONFIG['workers']},
+    "recognize": {"concurrency": 16},
+    "llm_concurrency": 8,       # in-flight image + text LLM requests (within the recognize stage)
+    "llm_priority": {"image": 0, "text": 1},    # lower value is admitted first
+    "llm_timeout": image_script.RUN_CONFIG['timeout'],    # seconds per LLM request attempt
+    "llm_retries": image_script.RUN_CONFIG['retries'],
+    "llm_backoff": image_script.RUN_CONFIG['backoff'],    # base delay in seconds, doubled on every retry
+    "integrate": {"batch_size": 200, "max_wait": 5.0},
+    "embed": {"batch_size": 64, "max_wait": 2.0},
+    "index": {"batch_size": 500, "max_wait": 5.0},
+    "score": {"batch_size": 500, "max_wait": 5.0},
+    "pool_size": 8,
+    "report_interval": 30.0,
+}
+
+# Metrics (app.metrics): Prometheus endpoint and/or JSON-lines snapshots, optional span traces
+METRICS_CONFIG = {
+    "port": None,           # e.g. 9100 serves /metrics for Prometheus to scrape
+    "jsonl_path": "./metrics/run_pipeline.jsonl",
+    "interval": 15.0,       # seconds between JSON-lines snapshots
+    "trace_path": None,     # e.g. "./metrics/run_pipeline.trace.jsonl" to trace every span
+}
+
+def trait_text(prd_desc):
+    # Same text as the CONCAT_WS of 05, so embeddings are shared through the cache
+    values = [prd_desc.get(key) for key in ("category1", "category2", "style", "occasion")]
+    return " ".join("" if value == "unknown" else value for value in values if value is not None)
+
+
+async def ingest(db_conn):
+    """
+    Stream the CSV chunk by chunk into product_raw and yield its products.
+    """
+    csv_path = f"{ingest_script.dir_path}{ingest_script.file_name}"
+    chunks = read_product_chunks(csv_path, ingest_script.chunk_size)
+    while True:
+        df_chunk = await asyncio.to_thread(next, chunks, None)
+        if df_chunk is None:
+            break
+        df_prd = clean_product_chunk(
+            df_chunk, ingest_script.prd_dict, img_dir=f"{ingest_script.dir_path}prd_img/")
+        result_copy = await asyncio.to_thread(copy_product_chunk, db_conn.cursor(), df_prd)
+        if not result_copy.get('status'):
+            print(f"Failed to load chunk: {result_copy.get('return')}")
+            continue
+        for row in df_prd[['prd_id', 'category', 'prd_name', 'img_url', 'prd_img']].itertuples(index=False):
+            yield {
+                "prd_id": row.prd_id,
+                "category": None if pd.isna(row.category) else row.category,
+                "prd_name": None if pd.isna(row.prd_name) else row.prd_name,
+                "img_url": None if pd.isna(row.img_url) else row.img_url,
+                "prd_img": None if pd.isna(row.prd_img) else row.prd_img,
+            }
+
+
+async def main(args):
+    db_conn = psycopg2.connect(**DB_CONFIG)
+    pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=PIPELINE_CONFIG['pool_size'])
+    llm_cache = DiskCache(image_script.CACHE_CONFIG['path'], max_entries=image_script.CACHE_CONFIG['max_entries'])
+    encode_config = embed_script.ENCODE_CONFIG
+    vector_cache = DiskCache(
+        encode_config['cache_path'], max_entries=50_000_000, max_bytes=encode_config['cache_max_bytes'])
+    store = open_vector_store(args.backend, dim=args.dim)
+    client = AsyncOpenAI(base_url=image_script.LLM_CONFIG['url'], api_key=image_script.LLM_CONFIG['key'],
+                         max_retries=0)
+    download_config = ingest_script.DOWNLOAD_CONFIG
+    session = make_session(PIPELINE_CONFIG['download']['concurrency'])
+    bucket = TokenBucket(download_config['rate'])
+    image_config = image_script.IMAGE_CONFIG
+    preparer = ImagePreparer(
+        workers=image_config['workers'], max_side=image_config['max_side'], quality=image_config['quality'])
+    limiter = PriorityLimiter(PIPELINE_CONFIG['llm_concurrency'])
+    priority = PIPELINE_CONFIG['llm_priority']
+    llm_stats = RunStats(total=None)
+    embedding_model = None
+
+    async def download(item):
+        if item['img_url'] is not None:
+            os.makedirs(os.path.dirname(item['prd_img']), exist_ok=True)
+            result = await asyncio.to_thread(
+                download_image, session, bucket, item['img_url'], item['prd_img'],
+                download_config['retries'], download_config['backoff'], download_config['timeout'])
+            if not result.get('status'):
+                print(f"Failed to download image for {item['prd_id']}: {result.get('return')}")
+                item['prd_img'] = None
+        return [item]
+
+    async def prepare(item):
+        item['img_payload'] = None
+        if item['prd_img'] is not None and image_config['prepare']:
+            result = await preparer.prepare(item['prd_img'])
+            if not result.get('status'):
+                print(f"Failed to prepare image for {item['prd_id']}: {result.get('return')}")
+                item['prd_img'] = None
+            else:
+                item['img_payload'] = result.get('return')
+        return [item]
+
+    async def recognize_one(prd_id, source, writer, llm_config, recognize, **query):
+        async def attempt(query):
+            return await recognize(
+                service_url=llm_config['url'],
+                service_key=llm_config['key'],
+                service_llm=llm_config['model'],
+                service_temperature=llm_config['temperature'],
+                service_role=llm_config['role'],
+                structured_output=llm_config['structured_output'],
+                client=client,
+                cache=llm_cache,
+                **query,
+            )
+
+        # Timeouts and retries as in the 02/03 scheduler; the slot is kept across retries
+        async with limiter.slot(priority[source]):
+            started = time.perf_counter()
+            result = await call_with_retry(
+                attempt, query, PIPELINE_CONFIG['llm_timeout'], PIPELINE_CONFIG['llm_retries'],
+                PIPELINE_CONFIG['llm_backoff'], llm_stats)
+            llm_stats.record(time.perf_counter() - started, result.get('status'))
+        if result.get('status') and result.get('return'):
+            await writer.add(prd_id, result.get('return'))
+            return result.get('return')
+        await writer.fail(prd_id, result.get('return'))
+        return None
+
+    async def recognize(item):
+        # Image and text are recognized concurrently under one shared request budget
+        calls = [recognize_one(item['prd_id'], "text", text_writer, text_script.LLM_CONFIG,
+                               recognize_text_async, text_query=item['prd_name'])]
+        if item['prd_img'] is not None:
+            calls.append(recognize_one(item['prd_id'], "image", image_writer, image_script.LLM_CONFIG,
+                                       recognize_image_async, img_path=item['prd_img'],
+                                       image_payload=item.pop('img_payload')))
+        results = await asyncio.gather(*calls)
+        if len(results) < 2 or not all(results):
+            # Integration needs both trait sources
+            return None
+        item['text_traits'], item['image_traits'] = results
+        return [item]
+
+    async def write_information(rows):
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    f"DELETE FROM {TRAIT_SCHEMA}.products_trait_information WHERE prd_id = ANY($1::varchar[]);",
+                    [row[0] for row in rows]
+                )
+                await conn.copy_records_to_table(
+                    "products_trait_information", records=rows,
+                    columns=INFORMATION_COLUMNS, schema_name=TRAIT_SCHEMA)
+
+    async def integrate(items):
+        # One canonical trait record per product and source, chosen as 04 does
+        rows = {}
+        for item in items:
+            text_seq, item['text_trait'] = resolve_traits(item.pop('text_traits'), item['category'])
+            image_seq, item['image_trait'] = resolve_traits(item.pop('image_traits'), item['category'])
+            row = (
+                item['prd_id'], item['category'], item['prd_name'],
+                *[item['text_trait'].get(key) for key in TRAIT_KEYS],
+                *[item['image_trait'].get(key) for key in TRAIT_KEYS],
+                text_seq, image_seq,
+            )
+            error = information_row_error(row)
+            if error is not None:
+                # Its traits are stored, the row is left to 04 once the product is fixed
+                INTEGRATION_FAILED.inc()
+                print(f"Failed to integrate {item['prd_id']}: {error}")
+                continue
+            rows[item['prd_id']] = row
+        if not rows:
+            return None
+        try:
+            await write_information(list(rows.values()))
+        except Exception as e:
+            # Write product by product, so one row the checks missed only fails itself
+            print(f"Failed to integrate a batch of {len(rows)} products, writing them one by one: {e}")
+            for prd_id, row in list(rows.items()):
+                try:
+                    await write_information([row])
+                except Exception as e:
+                    INTEGRATION_FAILED.inc()
+                    print(f"Failed to integrate {prd_id}: {e}")
+                    del rows[prd_id]
+        return [item for item in items if item['prd_id'] in rows]
+
+    def encode(texts):
+        nonlocal embedding_model
+        if embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            embedding_model = SentenceTransformer(encode_config['model'])
+        embeddings = encode_texts(
+            embedding_model, texts,
+            model_name=encode_config['model'],
+            instruct=embed_script.instruct,
+            prompt_template=embed_script.prompt,
+            cache=vector_cache,
+            batch_size=encode_config['batch_size'],
+            report_every=0,
+        )
+        return truncate_embeddings(embeddings, store.dim)
+
+    async def embed(items):
+        texts = {
+            'product_name': [item['prd_name'] for item in items],
+            'product_image': [trait_text(item['image_trait']) for item in items],
+            'product_text': [trait_text(item['text_trait']) for item in items],
+        }
+        tags = [tag for tag, _ in embed_script.prd_sources]
+        embeddings = await asyncio.to_thread(encode, [text for tag in tags for text in texts[tag]])
+        for t, tag in enumerate(tags):
+            for n, item in enumerate(items):
+                item.setdefault('texts', {})[tag] = texts[tag][n]
+                item.setdefault('embeddings', {})[tag] = embeddings[t * len(items) + n]
+        return items
+
+    async def index(items):
+        tags = [tag for tag, _ in embed_script.prd_sources]
+        rows = pd.DataFrame([
+            {
+                "id": embedding_key(tag, item['prd_id']),
+                "prd_id": item['prd_id'],
+                "category": item['category'],
+                "prd_text": item['texts'][tag],
+                "prd_tag": tag,
+                "text_hash": embedding_cache_key(
+                    encode_config['model'], embed_script.instruct, embed_script.prompt, item['texts'][tag]),
+            }
+            for tag in tags for item in items
+        ], columns=ROW_COLUMNS)
+        embeddings = [item['embeddings'][tag] for tag in tags for item in items]
+        await asyncio.to_thread(store.upsert, rows, embeddings)
+        return items
+
+    async def score(items):
+        # One vector per (tag, product), so the max over a product's vectors is this cosine
+        def cosine(item, a, b):
+            return float(item['embeddings'][a] @ item['embeddings'][b])
+
+        similarities = [
+            (item['prd_id'],
+             cosine(item, 'product_name', 'product_text'),
+             cosine(item, 'product_name', 'product_image'),
+             cosine(item, 'product_text', 'product_image'))
+            for item in items
+        ]
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "DELETE FROM product_similarity.products_similarity_score_inner "
+                    "WHERE prd_id = ANY($1::varchar[]);",
+                    [item['prd_id'] for item in items]
+                )
+                await conn.executemany(
+                    "INSERT INTO product_similarity.products_similarity_score_inner "
+                    "(prd_id, similarity_name_text, similarity_name_image, similarity_text_image) "
+                    "VALUES ($1, $2, $3, $4);",
+                    similarities
+                )
+        return items
+
+    pipeline = Pipeline([
+        Stage("download", download, **PIPELINE_CONFIG['download']),
+        Stage("prepare", prepare, **PIPELINE_CONFIG['prepare']),
+        Stage("recognize", recognize, **PIPELINE_CONFIG['recognize']),
+        Stage("integrate", integrate, **PIPELINE_CONFIG['integrate']),
+        Stage("embed", embed, **PIPELINE_CONFIG['embed']),
+        Stage("index", index, **PIPELINE_CONFIG['index']),
+        Stage("score", score, **PIPELINE_CONFIG['score']),
+    ], report_interval=PIPELINE_CONFIG['report_interval'])
+
+    async with TraitWriter(pool, "image") as image_writer, TraitWriter(pool, "text") as text_writer:
+        await pipeline.run(ingest(db_conn))
+    store.commit()
+    preparer.close()
+
+    print(f"LLM requests: {llm_stats.report()}")
+    if image_config['prepare']:
+        print(preparer.report())
+    print(llm_cache.report())
+    print(vector_cache.report())
+    llm_cache.close()
+    vector_cache.close()
+    session.close()
+    await client.close()
+    await pool.close()
+    db_conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the product similarity pipeline as one stream.")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default="milvus",
+        help="vector store the embeddings are indexed in")
+    parser.add_argument(
+        "--dim", type=int, default=None,
+        help="embedding dimensions kept (default: as stored, 1024 for a new store)")
+    exporter = start_metrics(**METRICS_CONFIG)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    finally:
+        exporter.close()
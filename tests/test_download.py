@@ -0,0 +1,103 @@
+import csv
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.download import download_images
+
+
+IMAGE = b"\xff\xd8\xff\xe0" + b"\x00" * 2048 + b"\xff\xd9"
+
+
+class StandIn:
+    """
+    Local image server: /ok/* serves an image, /flaky/* answers 503 the
+    first two times, /missing/* answers 404. Requests are counted per path.
+    """
+
+    def __init__(self):
+        self.hits = Counter()
+        self._lock = threading.Lock()
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.hits[self.path] += 1
+                    hits = stand_in.hits[self.path]
+                if self.path.startswith("/ok/") or (self.path.startswith("/flaky/") and hits > 2):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(IMAGE)))
+                    self.end_headers()
+                    self.wfile.write(IMAGE)
+                else:
+                    self.send_error(503 if self.path.startswith("/flaky/") else 404)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def server():
+    stand_in = StandIn()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), stand_in.handler())
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    stand_in.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield stand_in
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def run(server, tmp_path, items, **kwargs):
+    manifest = tmp_path / "failed.csv"
+    stats = download_images(
+        [(img_id, f"{server.url}{path}") for img_id, path in items],
+        str(tmp_path / "images"),
+        concurrency=4,
+        rate=1000.0,
+        retries=3,
+        backoff=0.01,
+        timeout=5.0,
+        manifest_path=str(manifest),
+        **kwargs,
+    )
+    with open(manifest, newline="") as f:
+        return stats, list(csv.reader(f))
+
+
+def test_downloads_and_skips_existing(server, tmp_path):
+    stats, _ = run(server, tmp_path, [("a", "/ok/a.jpg"), ("b", "/ok/b.jpg")])
+    assert (stats["downloaded"], stats["skipped"], stats["failed"]) == (2, 0, 0)
+    assert (tmp_path / "images" / "a.jpg").read_bytes() == IMAGE
+    assert not list((tmp_path / "images").glob("*.part"))
+
+    stats, _ = run(server, tmp_path, [("a", "/ok/a.jpg"), ("b", "/ok/b.jpg")])
+    assert (stats["downloaded"], stats["skipped"], stats["failed"]) == (0, 2, 0)
+    assert server.hits["/ok/a.jpg"] == 1
+
+
+def test_retries_server_errors_with_backoff(server, tmp_path):
+    stats, rows = run(server, tmp_path, [("c", "/flaky/c.jpg")])
+    assert stats["downloaded"] == 1
+    assert server.hits["/flaky/c.jpg"] == 3
+    assert rows == [["img_id", "img_url", "error"]]
+
+
+def test_manifest_lists_failures(server, tmp_path):
+    (tmp_path / "images").mkdir()
+    items = [("ok", "/ok/ok.jpg"), ("gone", "/missing/gone.jpg"), ("nodir/x", "/ok/x.jpg")]
+    stats, rows = run(server, tmp_path, items)
+    assert (stats["downloaded"], stats["failed"]) == (1, 2)
+    # 404 is not retried
+    assert server.hits["/missing/gone.jpg"] == 1
+    failures = {row[0]: row for row in rows[1:]}
+    assert failures["gone"] == ["gone", f"{server.url}/missing/gone.jpg", "HTTP 404"]
+    # A write error (missing directory) fails the image without aborting the run
+    assert failures["nodir/x"][2].startswith("Write failed")
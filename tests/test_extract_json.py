@@ -0,0 +1,70 @@
+"""
+extract_traits / normalize_trait over the corpus of malformed LLM answers in
+data/llm_outputs.jsonl. The corpus is hand-written (its "source" field says
+so), modelled on the failure modes seen from the servers: markdown fences,
+prose, trailing commas, nested or quoted braces, truncation, "unknown"
+spellings and structured output. Answers captured from a real server can be
+appended with "source" set to the model name.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.traits import TRAIT_KEYS, extract_json, extract_traits, normalize_trait
+
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "llm_outputs.jsonl")
+
+with open(CORPUS, encoding="utf-8") as f:
+    CASES = [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["case"] for case in CASES])
+def test_corpus(case):
+    traits = extract_traits(case["output"])
+    assert len(traits) == case["traits"]
+    assert sum(value == "unknown" for trait in traits for value in trait.values()) == case["unknown"]
+    for trait in traits:
+        assert list(trait) == TRAIT_KEYS
+        assert all(isinstance(value, str) and value for value in trait.values())
+
+
+def test_normalize_trait():
+    trait = dict.fromkeys(TRAIT_KEYS, "면")
+    assert normalize_trait(trait) == trait
+    assert normalize_trait({**trait, "color": ["흰색"]})["color"] == "흰색"
+    assert normalize_trait({**trait, "color": None})["color"] == "unknown"
+    assert normalize_trait({**trait, "color": " N/A "})["color"] == "unknown"
+    assert normalize_trait({**trait, "color": "알 수 없음"})["color"] == "unknown"
+    assert normalize_trait({**trait, "size": 95}) == trait
+    assert normalize_trait({key: trait[key] for key in TRAIT_KEYS[1:]}) is None
+    assert normalize_trait({**trait, "color": {"main": "흰색"}}) is None
+    assert normalize_trait(["not", "a", "dict"]) is None
+
+
+def test_extract_json_keeps_objects_after_broken_fragment():
+    text = 'note {"a": [1, 2,]} then {"b": {"c": "}"}} and [{"d": 1}, 2]'
+    assert extract_json(text) == [{"b": {"c": "}"}}, {"d": 1}]
+
+
+def test_parser_has_no_client_dependencies():
+    code = "import sys, app.traits; print(sorted({'openai', 'asyncpg'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert result.stdout.strip() == "[]"
+
+
+def test_extract_traits_speed():
+    # Loose bound, the parser runs in the tens of microseconds per answer
+    outputs = [case["output"] for case in CASES]
+    repeat = 200
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for output in outputs:
+            extract_traits(output)
+    per_answer = (time.perf_counter() - started) / (repeat * len(outputs))
+    assert per_answer < 1e-3
@@ -0,0 +1,37 @@
+import csv
+import io
+
+import pandas as pd
+import pytest
+
+import app.ingest
+from app.ingest import CSV_COLUMNS, RAW_COLUMNS, clean_product_chunk, product_copy_payload
+
+
+LINK = "https://www.coupang.com/np/categories/498918"
+
+
+def chunk():
+    return pd.DataFrame({
+        "web-scraper-order": ["p1", "p2"],
+        "category-link-0-href": [LINK, "https://example.com/unknown"],
+        "name": ['오버핏 "반팔", 티셔츠\n2장', None],
+        "price3": ["12,345원", None],
+        "rating": ["(1,234)", None],
+        "ratingValue": ["4.5", None],
+        "image-src": ["https://example.com/p1.jpg", None],
+    }, columns=list(CSV_COLUMNS), dtype="string")
+
+
+@pytest.mark.parametrize("writer", ["pyarrow", "pandas"])
+def test_copy_payload(writer, monkeypatch):
+    if writer == "pandas":
+        monkeypatch.setattr(app.ingest, "pa", None)
+    df = clean_product_chunk(chunk(), {LINK: "티셔츠"}, img_dir="/img/")
+    payload = product_copy_payload(df).read()
+    text = payload.decode("utf-8") if isinstance(payload, bytes) else payload
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == ["p1", "티셔츠", '오버핏 "반팔", 티셔츠\n2장', "12345", "1234", "4.5", "/img/p1.jpg"]
+    # Missing values are empty unquoted fields, which COPY reads as NULL
+    assert rows[1] == ["p2"] + [""] * (len(RAW_COLUMNS) - 1)
+    assert text.endswith("," * (len(RAW_COLUMNS) - 1) + "\n")
@@ -0,0 +1,18 @@
+from app.integrate import INFORMATION_COLUMNS, information_row_error
+
+
+def row(**values):
+    base = {col: None for col in INFORMATION_COLUMNS}
+    base.update(prd_id="p1", category="셔츠", prd_name="린넨 셔츠", text_seq=0, image_seq=0)
+    base.update(values)
+    return tuple(base[col] for col in INFORMATION_COLUMNS)
+
+
+def test_information_row_error():
+    assert information_row_error(row()) is None
+    assert information_row_error(row(text_color="흰색", image_cat1="셔츠")) is None
+    assert information_row_error(row(category=None)) == "category is missing"
+    assert information_row_error(row(prd_name=None)) == "prd_name is missing"
+    assert information_row_error(row(prd_id="x" * 31)) == "prd_id is longer than 30 characters"
+    assert information_row_error(row(image_style="x" * 51)) == "image_style is longer than 50 characters"
+    assert information_row_error(row(text_cat2="x" * 31)) == "text_cat2 is longer than 30 characters"
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.embedding import embedding_key
+from app.vectorstore import ROW_COLUMNS, FaissStore, NumpyStore
+
+
+DIM = 8
+
+
+def rows(prd_ids, prd_tag="product_name", category="셔츠"):
+    return pd.DataFrame({
+        "id": [embedding_key(prd_tag, prd_id) for prd_id in prd_ids],
+        "prd_id": prd_ids,
+        "category": category,
+        "prd_text": "",
+        "prd_tag": prd_tag,
+        "text_hash": "",
+    }, columns=ROW_COLUMNS)
+
+
+def unit(axis):
+    vector = np.zeros((1, DIM), dtype=np.float32)
+    vector[0, axis] = 1.0
+    return vector
+
+
+@pytest.fixture(params=["numpy", "faiss"])
+def store(request, tmp_path):
+    if request.param == "faiss":
+        pytest.importorskip("faiss")
+        return FaissStore(str(tmp_path), dim=DIM, rebuild=True, index_factory="Flat", search_params="")
+    return NumpyStore(str(tmp_path), dim=DIM, rebuild=True)
+
+
+def test_search_sees_rows_upserted_after_a_search(store):
+    store.upsert(rows(["a"]), unit(0))
+    assert [prd_id for prd_id, _ in store.search("product_name", unit(1), 5)[0]] == ["a"]
+
+    store.upsert(rows(["b"]), unit(1))
+    hits = store.search("product_name", unit(1), 5)[0]
+    assert [prd_id for prd_id, _ in hits] == ["b", "a"]
+    assert hits[0][1] == pytest.approx(1.0)
+    assert store.search("product_name", unit(1), 5, category="셔츠")[0][0][0] == "b"
+    assert set(store.lookup("product_name", ["a", "b"])) == {"a", "b"}
+
+
+def test_upsert_replaces_and_delete_removes(store):
+    store.upsert(rows(["a", "b"]), np.vstack([unit(0), unit(1)]))
+    assert store.search("product_name", unit(0), 1)[0][0][0] == "a"
+
+    store.upsert(rows(["a"]), unit(2))
+    assert store.search("product_name", unit(2), 1)[0][0][0] == "a"
+    assert store.search("product_name", unit(0), 5)[0][0][1] == pytest.approx(0.0)
+
+    store.delete([embedding_key("product_name", "a")])
+    assert [prd_id for prd_id, _ in store.search("product_name", unit(2), 5)[0]] == ["b"]
+    assert store.lookup("product_name", ["a"]) == {}
+
+
+def test_commit_and_reopen(store, tmp_path):
+    store.upsert(rows(["a"]), unit(0))
+    store.commit()
+    reopened = NumpyStore(str(tmp_path))
+    assert reopened.search("product_name", unit(0), 1)[0][0][0] == "a"
+
+
+def test_export_with_categories(store):
+    store.upsert(rows(["a"]), unit(0))
+    store.upsert(rows(["b"], category="바지"), unit(1))
+    prd_ids, embeddings, categories = store.export("product_name", categories=True)
+    assert dict(zip(prd_ids, categories)) == {"a": "셔츠", "b": "바지"}
+    assert embeddings.shape == (2, DIM)
+    assert store.export("product_text", categories=True)[2] == []